@@ -0,0 +1,165 @@
+"""
+Локальная замена amoCRM API v4 для бенчмарков.
+
+Отдает сделки, контакты и компании SyntheticAccount с пагинацией
+(page/limit, _links.next), списками по filter[id][] и фильтром
+filter[updated_at][from]. Умеет добавлять задержку ответа и отвечать
+429 с заданной вероятностью. Считает запросы по эндпоинтам и статусам.
+"""
+
+import asyncio
+import random
+from collections import Counter
+from typing import Optional
+
+import orjson
+from aiohttp import web
+
+from benchmarks.synthetic import BASE_TIMESTAMP, SyntheticAccount
+
+MAX_LIMIT = 250
+
+
+class FakeAmoCRM:
+    def __init__(
+        self,
+        account: SyntheticAccount,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        retry_after: float = 1.0,
+        seed: int = 1,
+    ):
+        self.account = account
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.requests: Counter = Counter()
+        self._random = random.Random(seed)
+        self._runner: Optional[web.AppRunner] = None
+        self.url: Optional[str] = None
+
+        self.app = web.Application(middlewares=[self._middleware])
+        for entity in ("leads", "contacts", "companies"):
+            self.app.router.add_get(f"/api/v4/{entity}", self._list_handler(entity))
+            self.app.router.add_get(
+                f"/api/v4/{entity}/{{entity_id:\\d+}}", self._item_handler(entity)
+            )
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    @property
+    def total_requests(self) -> int:
+        return sum(count for (_, status), count in self.requests.items())
+
+    def stats(self) -> dict:
+        by_endpoint: Counter = Counter()
+        throttled = 0
+        for (endpoint, status), count in self.requests.items():
+            by_endpoint[endpoint] += count
+            if status == 429:
+                throttled += count
+        return {
+            "total": self.total_requests,
+            "throttled": throttled,
+            "by_endpoint": dict(by_endpoint),
+        }
+
+    @web.middleware
+    async def _middleware(self, request: web.Request, handler):
+        endpoint = (
+            request.match_info.route.resource.canonical
+            if request.match_info.route.resource
+            else request.path
+        )
+
+        delay = self.latency + self._random.uniform(0, self.jitter)
+        if delay:
+            await asyncio.sleep(delay)
+
+        if self.error_rate and self._random.random() < self.error_rate:
+            self.requests[(endpoint, 429)] += 1
+            return web.Response(
+                status=429, headers={"Retry-After": str(self.retry_after)}
+            )
+
+        response = await handler(request)
+        self.requests[(endpoint, response.status)] += 1
+        return response
+
+    def _get(self, entity: str, entity_id: int) -> Optional[dict]:
+        if entity == "leads" and 1 <= entity_id <= self.account.leads_count:
+            return self.account.lead(entity_id)
+        if entity == "contacts" and 1 <= entity_id <= self.account.leads_count:
+            return self.account.contact(entity_id)
+        if entity == "companies" and 1 <= entity_id <= self.account.companies_count:
+            return self.account.company(entity_id)
+        return None
+
+    def _count(self, entity: str) -> int:
+        if entity == "companies":
+            return self.account.companies_count
+        return self.account.leads_count
+
+    def _list_handler(self, entity: str):
+        async def handler(request: web.Request) -> web.Response:
+            query = request.query
+            ids = [int(value) for value in query.getall("filter[id][]", [])]
+            if ids:
+                items = [item for item in (self._get(entity, i) for i in ids) if item]
+                return self._page(entity, items, has_next=False)
+
+            limit = min(int(query.get("limit", 50)), MAX_LIMIT)
+            page = int(query.get("page", 1))
+
+            # updated_at растет вместе с id, фильтр сводится к сдвигу начала
+            first_id = 1
+            updated_from = query.get("filter[updated_at][from]")
+            if updated_from is not None:
+                first_id = max(int(updated_from) - BASE_TIMESTAMP, 1)
+
+            start = first_id + (page - 1) * limit
+            end = min(start + limit, self._count(entity) + 1)
+            if start >= end:
+                return web.Response(status=204)
+
+            items = [self._get(entity, i) for i in range(start, end)]
+            return self._page(entity, items, has_next=end <= self._count(entity))
+
+        return handler
+
+    def _item_handler(self, entity: str):
+        async def handler(request: web.Request) -> web.Response:
+            item = self._get(entity, int(request.match_info["entity_id"]))
+            if item is None:
+                return web.Response(status=404)
+            return web.Response(
+                body=orjson.dumps(item), content_type="application/hal+json"
+            )
+
+        return handler
+
+    @staticmethod
+    def _page(entity: str, items: list, has_next: bool) -> web.Response:
+        if not items:
+            return web.Response(status=204)
+
+        links = {"self": {"href": f"/api/v4/{entity}"}}
+        if has_next:
+            links["next"] = {"href": f"/api/v4/{entity}"}
+        return web.Response(
+            body=orjson.dumps({"_links": links, "_embedded": {entity: items}}),
+            content_type="application/hal+json",
+        )
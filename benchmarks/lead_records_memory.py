@@ -0,0 +1,139 @@
+"""
+Сравнение памяти: полные dict сделок из ответа amoCRM против LeadRecord.
+
+    python -m benchmarks.lead_records_memory --leads 100000
+"""
+
+import argparse
+import gc
+import json
+import random
+import tracemalloc
+
+import orjson
+
+from src.amocrm.records import LeadRecord
+
+
+def make_lead(lead_id: int) -> dict:
+    """Сделка в формате /api/v4/leads?with=contacts"""
+
+    contact_id = random.randint(1, 10**8)
+    return {
+        "id": lead_id,
+        "name": f"Сделка #{lead_id}",
+        "price": random.randint(0, 10**6),
+        "responsible_user_id": random.randint(1, 50),
+        "group_id": 0,
+        "status_id": random.randint(1, 20),
+        "pipeline_id": 1,
+        "loss_reason_id": None,
+        "created_by": 0,
+        "updated_by": 0,
+        "created_at": 1700000000 + lead_id,
+        "updated_at": 1700000000 + lead_id,
+        "closed_at": None,
+        "closest_task_at": None,
+        "is_deleted": False,
+        "custom_fields_values": [
+            {
+                "field_id": 100 + i,
+                "field_name": f"Поле {i}",
+                "field_code": None,
+                "field_type": "text",
+                "values": [{"value": f"значение {random.randint(0, 1000)}"}],
+            }
+            for i in range(5)
+        ],
+        "score": None,
+        "account_id": 1,
+        "labor_cost": None,
+        "_links": {
+            "self": {"href": f"https://example.amocrm.ru/api/v4/leads/{lead_id}"}
+        },
+        "_embedded": {
+            "tags": [],
+            "companies": [],
+            "contacts": [
+                {
+                    "id": contact_id,
+                    "is_main": True,
+                    "_links": {
+                        "self": {
+                            "href": f"https://example.amocrm.ru/api/v4/contacts/{contact_id}"
+                        }
+                    },
+                }
+            ],
+        },
+    }
+
+
+def measure(pages, parse) -> int:
+    """Память, которую занимает результат parse по всем страницам"""
+
+    gc.collect()
+    tracemalloc.start()
+    result = []
+    for page in pages:
+        result.extend(parse(page))
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return current
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--leads", type=int, default=100000)
+    parser.add_argument("--page-size", type=int, default=250)
+    args = parser.parse_args()
+
+    random.seed(1)
+    pages = [
+        orjson.dumps(
+            {
+                "_embedded": {
+                    "leads": [
+                        make_lead(lead_id)
+                        for lead_id in range(
+                            start, min(start + args.page_size, args.leads)
+                        )
+                    ]
+                }
+            }
+        )
+        for start in range(0, args.leads, args.page_size)
+    ]
+
+    custom_field_ids = frozenset({100})
+
+    def parse_dicts(page):
+        return orjson.loads(page)["_embedded"]["leads"]
+
+    def parse_records(page):
+        return [
+            LeadRecord.from_dict(lead, custom_field_ids)
+            for lead in orjson.loads(page)["_embedded"]["leads"]
+        ]
+
+    dict_bytes = measure(pages, parse_dicts)
+    record_bytes = measure(pages, parse_records)
+
+    print(
+        json.dumps(
+            {
+                "benchmark": "lead_records_memory",
+                "leads": args.leads,
+                "dict_bytes": dict_bytes,
+                "record_bytes": record_bytes,
+                "dict_bytes_per_lead": round(dict_bytes / args.leads, 1),
+                "record_bytes_per_lead": round(record_bytes / args.leads, 1),
+                "ratio": round(dict_bytes / record_bytes, 2),
+            }
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
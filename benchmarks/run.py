@@ -0,0 +1,199 @@
+"""
+Офлайн-бенчмарки сервиса против локального фейкового amoCRM.
+
+    python -m benchmarks.run --leads 100000 --duplicate-rate 0.1
+    python -m benchmarks.run --scenario duplicates --latency 0.05 --error-rate 0.02
+
+Сценарии:
+    leads_scan         - iter_leads_by_filter по всей воронке
+    contacts_single    - поиск контактов по одному (get_contact_by_id)
+    contacts_batched   - те же контакты через EntityLoader (filter[id][])
+    duplicates         - duplicate_leads целиком
+
+На каждый сценарий печатается строка JSON: пропускная способность,
+p50/p99 запросов к amoCRM (со стороны клиента, вместе с ожиданием
+лимитера и повторами), счетчики запросов фейкового сервера и пиковый
+RSS. Если сценариев несколько, каждый запускается в отдельном процессе,
+чтобы пиковый RSS не накапливался.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import resource
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List
+
+from loguru import logger
+
+from benchmarks.fake_amocrm import FakeAmoCRM
+from benchmarks.synthetic import SyntheticAccount
+from src.amocrm.cache import amo_cache
+from src.amocrm.client import AmoClient
+from src.amocrm.loader import EntityLoader
+from src.amocrm.services import build_headers, get_contact_by_id, iter_leads_by_filter
+from src.dublicate_widget.services import duplicate_leads
+
+SCENARIOS = ("leads_scan", "contacts_single", "contacts_batched", "duplicates")
+SUBDOMAIN = "benchmark"
+
+
+class BenchAmoClient(AmoClient):
+    """AmoClient, который отправляет запросы на фейковый сервер и замеряет их"""
+
+    def __init__(self, base_url: str, **kwargs):
+        super().__init__(**kwargs)
+        self.base_url = base_url
+        self.latencies: List[float] = []
+
+    async def _request(self, method: str, url: str, **kwargs):
+        url = url.replace(f"https://{SUBDOMAIN}.amocrm.ru", self.base_url, 1)
+        started = time.perf_counter()
+        response = await super()._request(method, url, **kwargs)
+        self.latencies.append(time.perf_counter() - started)
+        return response
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)]
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss в Linux - в килобайтах
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+async def leads_scan(client, account, args) -> Dict[str, Any]:
+    leads = 0
+    async for _ in iter_leads_by_filter(
+        client, SUBDOMAIN, build_headers("token"), account.pipeline_id
+    ):
+        leads += 1
+    return {"items": leads}
+
+
+def _sample_contact_ids(account, args) -> List[int]:
+    rng = random.Random(args.seed)
+    return [rng.randint(1, account.leads_count) for _ in range(args.lookups)]
+
+
+async def contacts_single(client, account, args) -> Dict[str, Any]:
+    contact_ids = _sample_contact_ids(account, args)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    headers = build_headers("token")
+
+    async def lookup(contact_id: int):
+        async with semaphore:
+            return await get_contact_by_id(contact_id, SUBDOMAIN, headers, client)
+
+    contacts = await asyncio.gather(*(lookup(i) for i in contact_ids))
+    return {"items": len(contacts)}
+
+
+async def contacts_batched(client, account, args) -> Dict[str, Any]:
+    contact_ids = _sample_contact_ids(account, args)
+    loader = EntityLoader("contacts", SUBDOMAIN, build_headers("token"), client)
+    contacts = await loader.load_many(contact_ids)
+    return {"items": len(contacts)}
+
+
+async def duplicates(client, account, args) -> Dict[str, Any]:
+    groups = await duplicate_leads(
+        client, SUBDOMAIN, build_headers("token"), account.pipeline_id
+    )
+    return {
+        "items": account.leads_count,
+        "groups": len(groups),
+        "duplicate_leads": sum(len(group["lead_ids"]) for group in groups),
+        "expected_duplicate_leads": account.expected_duplicate_leads(),
+    }
+
+
+async def run_scenario(name: str, args) -> Dict[str, Any]:
+    account = SyntheticAccount(
+        args.leads,
+        duplicate_rate=args.duplicate_rate,
+        company_rate=args.company_rate,
+        seed=args.seed,
+    )
+    server = FakeAmoCRM(
+        account,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        retry_after=args.retry_after,
+        seed=args.seed,
+    )
+    base_url = await server.start()
+
+    client = BenchAmoClient(
+        base_url, rate_limit=args.rate_limit, burst=max(int(args.rate_limit), 1)
+    )
+    await client.start()
+    amo_cache.local.clear()
+
+    try:
+        started = time.perf_counter()
+        result = await globals()[name](client, account, args)
+        elapsed = time.perf_counter() - started
+    finally:
+        await client.close()
+        await server.stop()
+
+    return {
+        "benchmark": name,
+        "leads": args.leads,
+        "duplicate_rate": args.duplicate_rate,
+        "latency": args.latency,
+        "error_rate": args.error_rate,
+        **result,
+        "elapsed_s": round(elapsed, 3),
+        "items_per_s": round(result["items"] / elapsed, 1) if elapsed else None,
+        "request_p50_ms": round(percentile(client.latencies, 0.5) * 1000, 2),
+        "request_p99_ms": round(percentile(client.latencies, 0.99) * 1000, 2),
+        "requests": server.stats(),
+        "cache": amo_cache.stats(),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS)
+    parser.add_argument("--leads", type=int, default=10000)
+    parser.add_argument("--duplicate-rate", type=float, default=0.1)
+    parser.add_argument("--company-rate", type=float, default=0.3)
+    parser.add_argument("--lookups", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    # Реальный лимит amoCRM - 7 rps; по умолчанию меряем сам сервис
+    parser.add_argument("--rate-limit", type=float, default=1000)
+    parser.add_argument("--seed", type=int, default=1)
+    args, argv = parser.parse_known_args()
+
+    scenarios = args.scenario or list(SCENARIOS)
+    if len(scenarios) == 1:
+        logger.remove()
+        logger.add(sys.stderr, level="ERROR")
+        print(json.dumps(asyncio.run(run_scenario(scenarios[0], args))), flush=True)
+        return
+
+    options = [arg for arg in sys.argv[1:] if not arg.startswith("--scenario")]
+    for name in scenarios:
+        subprocess.run(
+            [sys.executable, "-m", "benchmarks.run", "--scenario", name, *options],
+            check=True,
+        )
+
+
+if __name__ == "__main__":
+    main()
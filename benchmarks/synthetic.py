@@ -0,0 +1,143 @@
+"""
+Синтетический аккаунт amoCRM с управляемой долей дублей.
+
+Сущности не хранятся, а генерируются детерминированно по id, поэтому
+аккаунт на 1M сделок не занимает память. У каждой сделки один контакт,
+доля duplicate_rate контактов повторяет телефон и email ранее
+созданного человека (в другом написании), часть сделок привязана
+к компании.
+"""
+
+import random
+from typing import Any, Dict, List, Optional
+
+BASE_TIMESTAMP = 1700000000
+
+PHONE_FORMATS = (
+    "+7 (9{0:02d}) {1:03d}-{2:02d}-{3:02d}",
+    "8 9{0:02d} {1:03d} {2:02d} {3:02d}",
+    "+79{0:02d}{1:03d}{2:02d}{3:02d}",
+    "9{0:02d}{1:03d}{2:02d}{3:02d}",
+)
+
+
+class SyntheticAccount:
+    def __init__(
+        self,
+        leads: int,
+        duplicate_rate: float = 0.1,
+        company_rate: float = 0.3,
+        companies: Optional[int] = None,
+        pipeline_id: int = 1,
+        seed: int = 1,
+    ):
+        self.leads_count = leads
+        self.duplicate_rate = duplicate_rate
+        self.company_rate = company_rate
+        self.companies_count = companies or max(leads // 10, 1)
+        self.pipeline_id = pipeline_id
+        self.seed = seed
+
+    def _rng(self, kind: int, entity_id: int) -> random.Random:
+        return random.Random(self.seed * 1_000_003 + kind * 7_919_777 + entity_id)
+
+    def person_of(self, contact_id: int) -> int:
+        """Человек, которому принадлежит контакт (у дублей - чужой)"""
+
+        while contact_id > 1:
+            rng = self._rng(1, contact_id)
+            if rng.random() >= self.duplicate_rate:
+                break
+            contact_id = rng.randrange(1, contact_id)
+        return contact_id
+
+    def lead(self, lead_id: int) -> Dict[str, Any]:
+        rng = self._rng(0, lead_id)
+        contact_id = lead_id
+        companies: List[Dict[str, Any]] = []
+        if rng.random() < self.company_rate:
+            companies.append({"id": rng.randrange(1, self.companies_count + 1)})
+
+        return {
+            "id": lead_id,
+            "name": f"Сделка #{lead_id}",
+            "price": rng.randrange(0, 1_000_000),
+            "responsible_user_id": rng.randrange(1, 50),
+            "group_id": 0,
+            "status_id": rng.randrange(1, 10),
+            "pipeline_id": self.pipeline_id,
+            "created_by": 0,
+            "updated_by": 0,
+            "created_at": BASE_TIMESTAMP + lead_id,
+            "updated_at": BASE_TIMESTAMP + lead_id,
+            "closed_at": None,
+            "is_deleted": False,
+            "custom_fields_values": None,
+            "account_id": 1,
+            "_links": {"self": {"href": f"/api/v4/leads/{lead_id}"}},
+            "_embedded": {
+                "tags": [],
+                "companies": companies,
+                "contacts": [
+                    {
+                        "id": contact_id,
+                        "is_main": True,
+                        "_links": {"self": {"href": f"/api/v4/contacts/{contact_id}"}},
+                    }
+                ],
+            },
+        }
+
+    def contact(self, contact_id: int) -> Dict[str, Any]:
+        rng = self._rng(2, contact_id)
+        person = self.person_of(contact_id)
+        digits = (
+            person // 1_000_000 % 100,
+            person // 1000 % 1000,
+            person // 100 % 100,
+            person % 100,
+        )
+        phone = rng.choice(PHONE_FORMATS).format(*digits)
+        email = f"user{person}@example.com"
+        if rng.random() < 0.5:
+            email = email.upper()
+
+        return {
+            "id": contact_id,
+            "name": f"Контакт {person}",
+            "responsible_user_id": rng.randrange(1, 50),
+            "created_at": BASE_TIMESTAMP + contact_id,
+            "updated_at": BASE_TIMESTAMP + contact_id,
+            "custom_fields_values": [
+                {
+                    "field_id": 1,
+                    "field_code": "PHONE",
+                    "values": [{"value": phone, "enum_code": "WORK"}],
+                },
+                {
+                    "field_id": 2,
+                    "field_code": "EMAIL",
+                    "values": [{"value": email, "enum_code": "WORK"}],
+                },
+            ],
+            "_links": {"self": {"href": f"/api/v4/contacts/{contact_id}"}},
+        }
+
+    def company(self, company_id: int) -> Dict[str, Any]:
+        return {
+            "id": company_id,
+            "name": f"ООО Компания {company_id}",
+            "created_at": BASE_TIMESTAMP + company_id,
+            "updated_at": BASE_TIMESTAMP + company_id,
+            "custom_fields_values": None,
+            "_links": {"self": {"href": f"/api/v4/companies/{company_id}"}},
+        }
+
+    def expected_duplicate_leads(self) -> int:
+        """Сколько сделок попадет в группы дублей по телефону/email контакта"""
+
+        people: Dict[int, int] = {}
+        for contact_id in range(1, self.leads_count + 1):
+            person = self.person_of(contact_id)
+            people[person] = people.get(person, 0) + 1
+        return sum(count for count in people.values() if count > 1)
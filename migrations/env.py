@@ -6,10 +6,8 @@ from sqlalchemy.engine import Connection
 from sqlalchemy.ext.asyncio import async_engine_from_config
 from logging.config import fileConfig
 
-from src.common.config import conf
-from src.common.base import metadata
-
-# from migrations.models import all_models
+from src.common.database import DATABASE_URL, Base
+from migrations.models import all_models  # noqa: F401 - регистрирует таблицы
 
 
 config = context.config
@@ -17,15 +15,8 @@ config = context.config
 if config.config_file_name is not None:
     fileConfig(config.config_file_name)
 
-DATABASE_URL = conf.db.build_connection_str()
-TEST_DATABASE_URL = conf.db.build_connection_str(test_db=True)
-
-x_arg_list = context.get_x_argument()
-if "test" in x_arg_list:
-    DATABASE_URL = TEST_DATABASE_URL
-
-target_metadata = metadata
-config.set_main_option("sqlalchemy.url", DATABASE_URL)
+target_metadata = Base.metadata
+config.set_main_option("sqlalchemy.url", DATABASE_URL.replace("%", "%%"))
 
 
 def run_migrations_offline() -> None:
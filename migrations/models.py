@@ -1,9 +1,29 @@
-# from src.template.models import Template
-# from src.template_type.models import TemplateType
-# from src.user_settings.models import UserSettings
-#
-# all_models = [
-#     Template,
-#     TemplateType,
-#     UserSettings,
-# ]
+from src.dublicate_widget.models import (
+    DuplicateGroup,
+    DuplicateGroupMember,
+    ScanRun,
+    ScanState,
+)
+from src.mirror.models import (
+    AmoCompany,
+    AmoContact,
+    AmoContactKey,
+    AmoLead,
+    AmoLeadContact,
+    AmoLeadField,
+    SyncState,
+)
+
+all_models = [
+    ScanRun,
+    ScanState,
+    DuplicateGroup,
+    DuplicateGroupMember,
+    AmoLead,
+    AmoLeadContact,
+    AmoLeadField,
+    AmoContact,
+    AmoContactKey,
+    AmoCompany,
+    SyncState,
+]
@@ -0,0 +1,104 @@
+"""duplicate groups, scan runs and scan state
+
+Revision ID: 3f1c2a7d9b10
+Revises: 
+Create Date: 2026-10-18 12:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = "3f1c2a7d9b10"
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "scan_runs",
+        sa.Column("id", sa.BigInteger(), nullable=False),
+        sa.Column("subdomain", sa.String(length=255), nullable=False),
+        sa.Column("pipeline_id", sa.BigInteger(), nullable=False),
+        sa.Column("incremental", sa.Boolean(), nullable=False),
+        sa.Column("status", sa.String(length=16), nullable=False),
+        sa.Column(
+            "started_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=False,
+        ),
+        sa.Column("finished_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("leads_count", sa.Integer(), nullable=True),
+        sa.Column("groups_count", sa.Integer(), nullable=True),
+        sa.Column("high_water_mark", sa.BigInteger(), nullable=True),
+        sa.Column("error", sa.Text(), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        "ix_scan_runs_tenant", "scan_runs", ["subdomain", "pipeline_id", "id"]
+    )
+    op.create_table(
+        "scan_state",
+        sa.Column("subdomain", sa.String(length=255), nullable=False),
+        sa.Column("pipeline_id", sa.BigInteger(), nullable=False),
+        sa.Column("high_water_mark", sa.BigInteger(), nullable=True),
+        sa.Column(
+            "updated_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=False,
+        ),
+        sa.PrimaryKeyConstraint("subdomain", "pipeline_id"),
+    )
+    op.create_table(
+        "duplicate_groups",
+        sa.Column("subdomain", sa.String(length=255), nullable=False),
+        sa.Column("pipeline_id", sa.BigInteger(), nullable=False),
+        sa.Column("primary_lead_id", sa.BigInteger(), nullable=False),
+        sa.Column("matched_by", postgresql.ARRAY(sa.Text()), nullable=False),
+        sa.Column("size", sa.Integer(), nullable=False),
+        sa.Column("scan_run_id", sa.BigInteger(), nullable=True),
+        sa.Column(
+            "updated_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=False,
+        ),
+        sa.ForeignKeyConstraint(
+            ["scan_run_id"], ["scan_runs.id"], ondelete="SET NULL"
+        ),
+        sa.PrimaryKeyConstraint("subdomain", "pipeline_id", "primary_lead_id"),
+    )
+    op.create_table(
+        "duplicate_group_members",
+        sa.Column("subdomain", sa.String(length=255), nullable=False),
+        sa.Column("pipeline_id", sa.BigInteger(), nullable=False),
+        sa.Column("lead_id", sa.BigInteger(), nullable=False),
+        sa.Column("primary_lead_id", sa.BigInteger(), nullable=False),
+        sa.Column("scan_run_id", sa.BigInteger(), nullable=True),
+        sa.ForeignKeyConstraint(
+            ["scan_run_id"], ["scan_runs.id"], ondelete="SET NULL"
+        ),
+        sa.PrimaryKeyConstraint("subdomain", "pipeline_id", "lead_id"),
+    )
+    op.create_index(
+        "ix_duplicate_group_members_group",
+        "duplicate_group_members",
+        ["subdomain", "pipeline_id", "primary_lead_id"],
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(
+        "ix_duplicate_group_members_group", table_name="duplicate_group_members"
+    )
+    op.drop_table("duplicate_group_members")
+    op.drop_table("duplicate_groups")
+    op.drop_table("scan_state")
+    op.drop_index("ix_scan_runs_tenant", table_name="scan_runs")
+    op.drop_table("scan_runs")
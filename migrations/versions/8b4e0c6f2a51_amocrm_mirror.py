@@ -0,0 +1,148 @@
+"""amoCRM mirror: leads, contacts, companies and sync state
+
+Revision ID: 8b4e0c6f2a51
+Revises: 3f1c2a7d9b10
+Create Date: 2026-10-18 15:10:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = "8b4e0c6f2a51"
+down_revision: Union[str, None] = "3f1c2a7d9b10"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _synced_at() -> sa.Column:
+    return sa.Column(
+        "synced_at",
+        sa.DateTime(timezone=True),
+        server_default=sa.text("now()"),
+        nullable=False,
+    )
+
+
+def upgrade() -> None:
+    op.create_table(
+        "amo_leads",
+        sa.Column("subdomain", sa.String(length=255), nullable=False),
+        sa.Column("id", sa.BigInteger(), nullable=False),
+        sa.Column("name", sa.Text(), nullable=True),
+        sa.Column("pipeline_id", sa.BigInteger(), nullable=True),
+        sa.Column("status_id", sa.BigInteger(), nullable=True),
+        sa.Column("responsible_user_id", sa.BigInteger(), nullable=True),
+        sa.Column(
+            "company_ids",
+            postgresql.ARRAY(sa.BigInteger()),
+            server_default="{}",
+            nullable=False,
+        ),
+        sa.Column("created_at", sa.BigInteger(), nullable=False),
+        sa.Column("updated_at", sa.BigInteger(), nullable=False),
+        sa.Column("deleted_at", sa.BigInteger(), nullable=True),
+        _synced_at(),
+        sa.PrimaryKeyConstraint("subdomain", "id"),
+    )
+    op.create_index(
+        "ix_amo_leads_pipeline",
+        "amo_leads",
+        ["subdomain", "pipeline_id", "status_id"],
+        postgresql_where=sa.text("deleted_at IS NULL"),
+    )
+    op.create_index("ix_amo_leads_updated_at", "amo_leads", ["subdomain", "updated_at"])
+    op.create_table(
+        "amo_lead_contacts",
+        sa.Column("subdomain", sa.String(length=255), nullable=False),
+        sa.Column("lead_id", sa.BigInteger(), nullable=False),
+        sa.Column("contact_id", sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint("subdomain", "lead_id", "contact_id"),
+    )
+    op.create_index(
+        "ix_amo_lead_contacts_contact",
+        "amo_lead_contacts",
+        ["subdomain", "contact_id"],
+    )
+    op.create_table(
+        "amo_lead_fields",
+        sa.Column("subdomain", sa.String(length=255), nullable=False),
+        sa.Column("lead_id", sa.BigInteger(), nullable=False),
+        sa.Column("field_id", sa.BigInteger(), nullable=False),
+        sa.Column("value", sa.Text(), nullable=False),
+        sa.PrimaryKeyConstraint("subdomain", "lead_id", "field_id", "value"),
+    )
+    op.create_index(
+        "ix_amo_lead_fields_value",
+        "amo_lead_fields",
+        ["subdomain", "field_id", "value"],
+    )
+    op.create_table(
+        "amo_contacts",
+        sa.Column("subdomain", sa.String(length=255), nullable=False),
+        sa.Column("id", sa.BigInteger(), nullable=False),
+        sa.Column("name", sa.Text(), nullable=True),
+        sa.Column("responsible_user_id", sa.BigInteger(), nullable=True),
+        sa.Column("created_at", sa.BigInteger(), nullable=False),
+        sa.Column("updated_at", sa.BigInteger(), nullable=False),
+        sa.Column("deleted_at", sa.BigInteger(), nullable=True),
+        _synced_at(),
+        sa.PrimaryKeyConstraint("subdomain", "id"),
+    )
+    op.create_index(
+        "ix_amo_contacts_updated_at", "amo_contacts", ["subdomain", "updated_at"]
+    )
+    op.create_table(
+        "amo_contact_keys",
+        sa.Column("subdomain", sa.String(length=255), nullable=False),
+        sa.Column("contact_id", sa.BigInteger(), nullable=False),
+        sa.Column("kind", sa.String(length=16), nullable=False),
+        sa.Column("value", sa.Text(), nullable=False),
+        sa.PrimaryKeyConstraint("subdomain", "contact_id", "kind", "value"),
+    )
+    op.create_index(
+        "ix_amo_contact_keys_value",
+        "amo_contact_keys",
+        ["subdomain", "kind", "value"],
+    )
+    op.create_table(
+        "amo_companies",
+        sa.Column("subdomain", sa.String(length=255), nullable=False),
+        sa.Column("id", sa.BigInteger(), nullable=False),
+        sa.Column("name", sa.Text(), nullable=True),
+        sa.Column("responsible_user_id", sa.BigInteger(), nullable=True),
+        sa.Column("created_at", sa.BigInteger(), nullable=False),
+        sa.Column("updated_at", sa.BigInteger(), nullable=False),
+        sa.Column("deleted_at", sa.BigInteger(), nullable=True),
+        _synced_at(),
+        sa.PrimaryKeyConstraint("subdomain", "id"),
+    )
+    op.create_table(
+        "amo_sync_state",
+        sa.Column("subdomain", sa.String(length=255), nullable=False),
+        sa.Column("entity", sa.String(length=16), nullable=False),
+        sa.Column("high_water_mark", sa.BigInteger(), nullable=True),
+        sa.Column("full_synced_at", sa.DateTime(timezone=True), nullable=True),
+        _synced_at(),
+        sa.PrimaryKeyConstraint("subdomain", "entity"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("amo_sync_state")
+    op.drop_table("amo_companies")
+    op.drop_index("ix_amo_contact_keys_value", table_name="amo_contact_keys")
+    op.drop_table("amo_contact_keys")
+    op.drop_index("ix_amo_contacts_updated_at", table_name="amo_contacts")
+    op.drop_table("amo_contacts")
+    op.drop_index("ix_amo_lead_fields_value", table_name="amo_lead_fields")
+    op.drop_table("amo_lead_fields")
+    op.drop_index("ix_amo_lead_contacts_contact", table_name="amo_lead_contacts")
+    op.drop_table("amo_lead_contacts")
+    op.drop_index("ix_amo_leads_updated_at", table_name="amo_leads")
+    op.drop_index("ix_amo_leads_pipeline", table_name="amo_leads")
+    op.drop_table("amo_leads")
@@ -0,0 +1,300 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Mapping, Optional, Tuple, Union
+
+import orjson
+from loguru import logger
+from redis import asyncio as aioredis
+from redis.exceptions import RedisError
+
+from src.common.config import (
+    AMO_CACHE_LOCAL_TTL,
+    AMO_CACHE_REDIS_TTL,
+    AMO_CACHE_SIZE,
+    REDIS_URL,
+)
+
+INVALIDATION_CHANNEL = "amo_cache:invalidate"
+
+
+class LRUCache:
+    """Ограниченный по размеру LRU-кеш в памяти процесса с TTL записей"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: str) -> Optional[Any]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return None
+
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+
+class AmoCache:
+    """
+    Двухуровневый кеш сущностей amoCRM: LRU в процессе + общий Redis.
+
+    Ключ - subdomain, тип сущности и id. Вместе с сущностью хранится
+    время ее загрузки из amoCRM (fetched_at). Более старая версия сущности
+    (по updated_at) не перезаписывает более новую. Инвалидация по событиям
+    рассылается через Redis pub/sub, чтобы воркеры сбросили локальные копии.
+    Без REDIS_URL работает только локальный уровень.
+
+    min_updated_at в get/get_many - момент, не раньше которого должна быть
+    актуальна копия: подходит сущность, измененная или загруженная после
+    него. Например, контакты сделки запрашиваются с updated_at сделки.
+    Можно передать одно значение на все id или словарь id -> значение.
+    """
+
+    def __init__(
+        self,
+        redis_url: Optional[str] = REDIS_URL,
+        maxsize: int = AMO_CACHE_SIZE,
+        local_ttl: float = AMO_CACHE_LOCAL_TTL,
+        redis_ttl: int = AMO_CACHE_REDIS_TTL,
+    ):
+        self.redis_url = redis_url
+        self.redis_ttl = redis_ttl
+        self.local = LRUCache(maxsize, local_ttl)
+
+        self._redis: Optional[aioredis.Redis] = None
+        self._listener: Optional[asyncio.Task] = None
+
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    async def start(self) -> None:
+        if not self.redis_url or self._redis is not None:
+            return
+
+        self._redis = aioredis.from_url(self.redis_url)
+        self._listener = asyncio.create_task(self._listen_invalidations())
+        logger.info("AmoCRM cache connected to Redis")
+
+    async def close(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+            self._listener = None
+        if self._redis is not None:
+            await self._redis.aclose()
+            self._redis = None
+
+    @staticmethod
+    def key(subdomain: str, entity: str, entity_id: int) -> str:
+        return f"amo:{subdomain}:{entity}:{entity_id}"
+
+    async def get(
+        self,
+        subdomain: str,
+        entity: str,
+        entity_id: int,
+        min_updated_at: Optional[int] = None,
+    ) -> Optional[Dict[str, Any]]:
+        """Сущность из кеша; копия старше min_updated_at считается промахом"""
+
+        found = await self.get_many(subdomain, entity, [entity_id], min_updated_at)
+        return found.get(entity_id)
+
+    async def get_many(
+        self,
+        subdomain: str,
+        entity: str,
+        entity_ids: Iterable[int],
+        min_updated_at: Union[int, Mapping[int, int], None] = None,
+    ) -> Dict[int, Dict[str, Any]]:
+        found: Dict[int, Dict[str, Any]] = {}
+        missing = []
+
+        for entity_id in entity_ids:
+            item = self.local.get(self.key(subdomain, entity, entity_id))
+            if item is not None and _is_fresh(item, min_updated_at, entity_id):
+                found[entity_id] = item[0]
+                self.local_hits += 1
+            else:
+                missing.append(entity_id)
+
+        if missing and self._redis is not None:
+            keys = [self.key(subdomain, entity, entity_id) for entity_id in missing]
+            try:
+                raw_values = await self._redis.mget(keys)
+            except RedisError as e:
+                logger.warning(f"Redis cache read failed: {e}")
+                raw_values = [None] * len(keys)
+
+            still_missing = []
+            for entity_id, key, raw in zip(missing, keys, raw_values):
+                try:
+                    item = _loads(raw) if raw is not None else None
+                except (ValueError, TypeError, KeyError) as e:
+                    # Битая запись - промах: загрузка из amoCRM перезапишет ее
+                    logger.warning(f"Corrupt amo cache entry {key}: {e!r}")
+                    item = None
+                if item is not None and _is_fresh(item, min_updated_at, entity_id):
+                    found[entity_id] = item[0]
+                    self.local.set(key, item)
+                    self.redis_hits += 1
+                else:
+                    still_missing.append(entity_id)
+            missing = still_missing
+
+        self.misses += len(missing)
+        return found
+
+    async def set(
+        self,
+        subdomain: str,
+        entity: str,
+        entity_id: int,
+        value: Dict[str, Any],
+        fetched_at: Optional[float] = None,
+    ) -> None:
+        await self.set_many(subdomain, entity, {entity_id: value}, fetched_at)
+
+    async def set_many(
+        self,
+        subdomain: str,
+        entity: str,
+        values: Dict[int, Dict[str, Any]],
+        fetched_at: Optional[float] = None,
+    ) -> None:
+        """fetched_at - время отправки запроса в amoCRM (по умолчанию сейчас)"""
+
+        if fetched_at is None:
+            fetched_at = time.time()
+
+        to_store = {}
+        for entity_id, value in values.items():
+            key = self.key(subdomain, entity, entity_id)
+            cached = self.local.get(key)
+            # Не затираем более свежую версию устаревшим ответом
+            if cached is not None and _updated_at(cached[0]) > _updated_at(value):
+                continue
+            item = (value, fetched_at)
+            self.local.set(key, item)
+            to_store[key] = item
+
+        if not to_store or self._redis is None:
+            return
+
+        try:
+            async with self._redis.pipeline(transaction=False) as pipe:
+                for key, (value, item_fetched_at) in to_store.items():
+                    pipe.set(
+                        key,
+                        orjson.dumps({"value": value, "fetched_at": item_fetched_at}),
+                        ex=self.redis_ttl,
+                    )
+                await pipe.execute()
+        except RedisError as e:
+            logger.warning(f"Redis cache write failed: {e}")
+
+    async def invalidate(self, subdomain: str, entity: str, entity_id: int) -> None:
+        """Сброс сущности во всех воркерах (например, по вебхуку об изменении)"""
+
+        key = self.key(subdomain, entity, entity_id)
+        self.local.delete(key)
+
+        if self._redis is None:
+            return
+
+        try:
+            await self._redis.delete(key)
+            await self._redis.publish(INVALIDATION_CHANNEL, key)
+        except RedisError as e:
+            logger.warning(f"Redis cache invalidation failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        requests = self.local_hits + self.redis_hits + self.misses
+        return {
+            "local_hits": self.local_hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "hit_ratio": (
+                (self.local_hits + self.redis_hits) / requests if requests else 0.0
+            ),
+            "local_size": len(self.local),
+        }
+
+    async def _listen_invalidations(self) -> None:
+        while True:
+            pubsub = self._redis.pubsub()
+            try:
+                await pubsub.subscribe(INVALIDATION_CHANNEL)
+                async for message in pubsub.listen():
+                    if message.get("type") == "message":
+                        self.local.delete(message["data"].decode())
+            except asyncio.CancelledError:
+                raise
+            except RedisError as e:
+                logger.warning(f"Redis invalidation listener failed: {e}")
+            finally:
+                # Соединение упавшей подписки возвращается в пул до переподписки
+                await asyncio.shield(_close_pubsub(pubsub))
+            await asyncio.sleep(5)
+
+
+def _updated_at(value: Dict[str, Any]) -> int:
+    return value.get("updated_at") or 0
+
+
+def _is_fresh(
+    item: Tuple[Dict[str, Any], float],
+    min_updated_at: Union[int, Mapping[int, int], None],
+    entity_id: int,
+) -> bool:
+    if isinstance(min_updated_at, Mapping):
+        min_updated_at = min_updated_at.get(entity_id)
+    if min_updated_at is None:
+        return True
+
+    value, fetched_at = item
+    return max(_updated_at(value), fetched_at) >= min_updated_at
+
+
+def _loads(raw: bytes) -> Tuple[Dict[str, Any], float]:
+    data = orjson.loads(raw)
+    if not isinstance(data, dict):
+        raise ValueError(f"unexpected cache value type {type(data).__name__}")
+    if "fetched_at" not in data:
+        # Запись старого формата: время загрузки неизвестно
+        return data, 0.0
+    if not isinstance(data["value"], dict):
+        raise ValueError("unexpected cache value format")
+    return data["value"], float(data["fetched_at"])
+
+
+async def _close_pubsub(pubsub) -> None:
+    try:
+        await pubsub.aclose()
+    except RedisError as e:
+        logger.warning(f"Redis pubsub close failed: {e}")
+
+
+amo_cache = AmoCache()
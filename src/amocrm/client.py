@@ -0,0 +1,437 @@
+import asyncio
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+
+import aiohttp
+from aiohttp import ClientResponse
+from fastapi import HTTPException
+from loguru import logger
+from yarl import URL
+
+from src.common.config import (
+    AMO_BREAKER_FAILURES,
+    AMO_BREAKER_RESET_TIMEOUT,
+    AMO_CONNECTION_LIMIT,
+    AMO_CONNECTION_LIMIT_PER_HOST,
+    AMO_MAX_RETRIES,
+    AMO_RATE_BURST,
+    AMO_RATE_LIMIT,
+    AMO_REQUEST_TIMEOUT,
+)
+from src.common.deadline import (
+    DeadlineExceeded,
+    check_deadline,
+    remaining,
+    timeout_for,
+)
+from src.common.metrics import (
+    AMO_BREAKER_OPENED,
+    AMO_BREAKER_REJECTED,
+    AMO_RATE_LIMITED,
+    AMO_REQUEST_LATENCY,
+    AMO_RESPONSES,
+    amo_endpoint,
+)
+from src.common.token_service import get_tokens_from_service, invalidate_tokens
+
+RETRY_STATUSES = {429, 502, 503, 504}
+# Ответы, которые считаются сбоем amoCRM для circuit breaker (429 - нет:
+# это лимит, его соблюдает token bucket)
+BREAKER_FAILURE_STATUSES = {500, 502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+
+
+class TokenBucket:
+    """Token bucket: не больше rate запросов в секунду с запасом capacity"""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    async def acquire(self) -> None:
+        # Блокировка выстраивает ожидающих в очередь (FIFO)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def penalize(self, delay: float) -> None:
+        """Опустошение бакета: следующий запрос уйдет не раньше чем через delay"""
+
+        self._refill()
+        # Зажим, а не вычитание: параллельные 429 не копят штраф
+        self._tokens = min(self._tokens, -delay * self.rate)
+
+
+class CircuitOpenError(HTTPException):
+    """Запрос не отправлен: circuit breaker аккаунта разомкнут"""
+
+    def __init__(self, subdomain: str, retry_after: float):
+        self.subdomain = subdomain
+        self.retry_after = retry_after
+        super().__init__(
+            status_code=503,
+            detail=f"AmoCRM is unavailable for {subdomain}, "
+            f"retry in {retry_after:.0f}s",
+            headers={"Retry-After": str(max(int(retry_after + 0.5), 1))},
+        )
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker аккаунта amoCRM.
+
+    После failures сбоев подряд (сетевые ошибки, 5xx) размыкается на
+    reset_timeout: запросы аккаунта сразу получают CircuitOpenError, не
+    тратя соединения и лимит. Затем пропускается один пробный запрос
+    (half-open): успех замыкает breaker, сбой размыкает снова. Пробный
+    запрос без результата (отмена) через reset_timeout заменяется новым.
+    """
+
+    def __init__(self, failures: int, reset_timeout: float):
+        self.failures = failures
+        self.reset_timeout = reset_timeout
+        self._failed = 0
+        self._opened_at: Optional[float] = None
+        self._probe_at: Optional[float] = None
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if self.retry_after() > 0:
+            return "open"
+        return "half_open"
+
+    def retry_after(self) -> float:
+        """Сколько секунд breaker еще будет разомкнут"""
+
+        if self._opened_at is None:
+            return 0.0
+        return max(self._opened_at + self.reset_timeout - time.monotonic(), 0.0)
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "open":
+            return False
+
+        now = time.monotonic()
+        if self._probe_at is None or now - self._probe_at >= self.reset_timeout:
+            self._probe_at = now
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self._failed = 0
+        self._opened_at = None
+        self._probe_at = None
+
+    def record_failure(self) -> bool:
+        """Учитывает сбой; True - breaker только что разомкнулся"""
+
+        self._failed += 1
+        if self._probe_at is not None or (
+            self._opened_at is None and self._failed >= self.failures
+        ):
+            self._opened_at = time.monotonic()
+            self._probe_at = None
+            return True
+        return False
+
+
+class _RequestContextManager:
+    """Обертка как у aiohttp: поддерживает и await, и async with"""
+
+    def __init__(self, coro):
+        self._coro = coro
+        self._response: Optional[ClientResponse] = None
+
+    def __await__(self):
+        return self._coro.__await__()
+
+    async def __aenter__(self) -> ClientResponse:
+        self._response = await self._coro
+        return self._response
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        if self._response is not None:
+            self._response.release()
+
+
+class AmoClient:
+    """
+    Клиент amoCRM на весь жизненный цикл приложения.
+
+    Одна долгоживущая сессия с пулом соединений, token bucket и circuit
+    breaker на каждый subdomain и повторы с учетом Retry-After и
+    джиттером. Интерфейс
+    get/post/patch совместим с aiohttp.ClientSession, поэтому клиент
+    передается в функции src.amocrm.services вместо сессии.
+    """
+
+    def __init__(
+        self,
+        rate_limit: float = AMO_RATE_LIMIT,
+        burst: int = AMO_RATE_BURST,
+        max_retries: int = AMO_MAX_RETRIES,
+        connection_limit: int = AMO_CONNECTION_LIMIT,
+        connection_limit_per_host: int = AMO_CONNECTION_LIMIT_PER_HOST,
+        timeout: float = AMO_REQUEST_TIMEOUT,
+        breaker_failures: int = AMO_BREAKER_FAILURES,
+        breaker_reset_timeout: float = AMO_BREAKER_RESET_TIMEOUT,
+    ):
+        self.rate_limit = rate_limit
+        self.burst = burst
+        self.max_retries = max_retries
+        self.connection_limit = connection_limit
+        self.connection_limit_per_host = connection_limit_per_host
+        self.timeout = timeout
+        self.breaker_failures = breaker_failures
+        self.breaker_reset_timeout = breaker_reset_timeout
+
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    async def start(self) -> None:
+        if self._session is not None and not self._session.closed:
+            return
+
+        connector = aiohttp.TCPConnector(
+            limit=self.connection_limit,
+            limit_per_host=self.connection_limit_per_host,
+            ttl_dns_cache=300,
+            keepalive_timeout=60,
+            enable_cleanup_closed=True,
+        )
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.timeout, connect=5),
+        )
+        logger.info("AmoCRM client session started")
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            raise RuntimeError("AmoClient is not started")
+        return self._session
+
+    def bucket(self, subdomain: str) -> TokenBucket:
+        bucket = self._buckets.get(subdomain)
+        if bucket is None:
+            bucket = self._buckets[subdomain] = TokenBucket(self.rate_limit, self.burst)
+        return bucket
+
+    def breaker(self, subdomain: str) -> CircuitBreaker:
+        breaker = self._breakers.get(subdomain)
+        if breaker is None:
+            breaker = self._breakers[subdomain] = CircuitBreaker(
+                self.breaker_failures, self.breaker_reset_timeout
+            )
+        return breaker
+
+    def _record_failure(self, subdomain: str, breaker: CircuitBreaker) -> None:
+        if breaker.record_failure():
+            AMO_BREAKER_OPENED.inc()
+            logger.warning(
+                f"AmoCRM circuit breaker opened for {subdomain} "
+                f"for {breaker.reset_timeout:.0f}s"
+            )
+
+    def request(self, method: str, url: str, **kwargs) -> _RequestContextManager:
+        return _RequestContextManager(self._request(method.upper(), url, **kwargs))
+
+    def get(self, url: str, **kwargs) -> _RequestContextManager:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> _RequestContextManager:
+        return self.request("POST", url, **kwargs)
+
+    def patch(self, url: str, **kwargs) -> _RequestContextManager:
+        return self.request("PATCH", url, **kwargs)
+
+    def delete(self, url: str, **kwargs) -> _RequestContextManager:
+        return self.request("DELETE", url, **kwargs)
+
+    async def _request(self, method: str, url: str, **kwargs) -> ClientResponse:
+        subdomain = get_subdomain(url)
+        bucket = self.bucket(subdomain)
+        breaker = self.breaker(subdomain)
+        endpoint = amo_endpoint(URL(url).path)
+
+        attempt = 0
+        auth_refreshed = False
+        while True:
+            check_deadline(f"{method} {endpoint}")
+            # Проверка до лимитера: отказ не тратит место в очереди бакета
+            if not breaker.allow():
+                AMO_BREAKER_REJECTED.inc()
+                raise CircuitOpenError(subdomain, breaker.retry_after())
+
+            await self._acquire(bucket)
+            # Таймаут попытки не выходит за дедлайн запроса
+            timeout = timeout_for(self.timeout)
+            started = time.perf_counter()
+            try:
+                response = await self.session.request(
+                    method,
+                    url,
+                    timeout=aiohttp.ClientTimeout(
+                        total=timeout, connect=min(timeout, 5)
+                    ),
+                    **kwargs,
+                )
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                AMO_RESPONSES.labels(method, endpoint, "error").inc()
+                if timeout < self.timeout and isinstance(e, asyncio.TimeoutError):
+                    # Оборвал дедлайн, а не amoCRM: breaker не трогаем
+                    raise DeadlineExceeded(
+                        f"Deadline exceeded during {method} {endpoint}"
+                    ) from e
+                self._record_failure(subdomain, breaker)
+                delay = self._backoff(attempt)
+                if (
+                    attempt >= self.max_retries
+                    or method not in IDEMPOTENT_METHODS
+                    or not _fits_deadline(delay)
+                ):
+                    if isinstance(e, asyncio.TimeoutError):
+                        # Как и ошибки соединения в services.py: наружу HTTPException
+                        raise HTTPException(
+                            status_code=504,
+                            detail=f"Gateway Timeout - AmoCRM did not respond "
+                            f"to {method} {endpoint}",
+                        ) from e
+                    raise
+                logger.warning(
+                    f"AmoCRM request {method} {url} failed ({e!r}), retry in {delay:.2f}s"
+                )
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+            finally:
+                AMO_REQUEST_LATENCY.labels(method, endpoint).observe(
+                    time.perf_counter() - started
+                )
+
+            AMO_RESPONSES.labels(method, endpoint, response.status).inc()
+            if response.status == 429:
+                AMO_RATE_LIMITED.labels(endpoint).inc()
+            if response.status in BREAKER_FAILURE_STATUSES:
+                self._record_failure(subdomain, breaker)
+            else:
+                breaker.record_success()
+
+            if response.status == 401 and not auth_refreshed and "headers" in kwargs:
+                # Токен отозван или истек раньше exp: сбрасываем кеш и повторяем
+                auth_refreshed = True
+                response.release()
+                invalidate_tokens(subdomain)
+                tokens = await get_tokens_from_service(subdomain)
+                kwargs["headers"] = {
+                    **kwargs["headers"],
+                    **build_auth_header(tokens["access_token"]),
+                }
+                continue
+
+            if response.status not in RETRY_STATUSES or attempt >= self.max_retries:
+                return response
+            # Повтор неидемпотентного запроса безопасен только при 429
+            if response.status != 429 and method not in IDEMPOTENT_METHODS:
+                return response
+
+            delay = _parse_retry_after(response) or self._backoff(attempt)
+            if not _fits_deadline(delay):
+                # Повтор не успеет до дедлайна: отдаем ответ как есть
+                return response
+            response.release()
+            attempt += 1
+
+            if response.status == 429:
+                logger.warning(
+                    f"AmoCRM rate limit for {subdomain}, retry in {delay:.2f}s"
+                )
+                # Притормаживаем все запросы аккаунта, ожидание - в acquire()
+                bucket.penalize(delay)
+            else:
+                logger.warning(
+                    f"AmoCRM returned {response.status} for {method} {url}, "
+                    f"retry in {delay:.2f}s"
+                )
+                await asyncio.sleep(delay)
+
+    @staticmethod
+    async def _acquire(bucket: TokenBucket) -> None:
+        """Ожидание лимитера не дольше остатка до дедлайна"""
+
+        try:
+            await asyncio.wait_for(bucket.acquire(), timeout_for(None))
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded("Deadline exceeded waiting for amoCRM rate limit")
+
+    @staticmethod
+    def _backoff(attempt: int) -> float:
+        """Экспоненциальная задержка с полным джиттером"""
+
+        return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2**attempt))
+
+
+def build_auth_header(access_token: str) -> Dict[str, str]:
+    return {"Authorization": f"Bearer {access_token}"}
+
+
+def get_subdomain(url: str) -> str:
+    host = URL(url).host or ""
+    return host.split(".", 1)[0]
+
+
+def _fits_deadline(delay: float) -> bool:
+    """Успеет ли повтор через delay секунд до дедлайна"""
+
+    left = remaining()
+    return left is None or delay < left
+
+
+def _parse_retry_after(response: ClientResponse) -> Optional[float]:
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(retry_at.timestamp() - time.time(), 0.0)
+
+
+amo_client = AmoClient()
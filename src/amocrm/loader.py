@@ -0,0 +1,186 @@
+import asyncio
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from aiohttp import ClientSession
+from fastapi import HTTPException
+from loguru import logger
+
+from src.amocrm.records import ContactRecord
+from src.amocrm.services import get_entities_by_ids
+
+MAX_BATCH_SIZE = 250
+
+
+class EntityLoader:
+    """
+    Батчинг запросов сущностей amoCRM по id (по образцу DataLoader).
+
+    Все вызовы load() в пределах одного тика event loop собираются,
+    дедуплицируются и отправляются списочными запросами filter[id][]
+    пачками до 250 id. Результат раздается всем ожидающим.
+
+    cache=False - результат не запоминается в загрузчике, read_cache=False -
+    сущности не берутся из amo_cache, а запрашиваются в amoCRM.
+    project - проекция сущности (например, ContactRecord.from_dict): во
+    futures и у вызывающего остается она, а не полный ответ amoCRM.
+
+    min_updated_at в load() - копия из amo_cache старше этого момента
+    запрашивается заново. Для id, который еще ждет отправки, берется
+    наибольшее из переданных значений.
+    """
+
+    def __init__(
+        self,
+        entity: str,
+        subdomain: str,
+        headers: dict,
+        client_session: ClientSession,
+        with_: Optional[str] = None,
+        batch_size: int = MAX_BATCH_SIZE,
+        cache: bool = True,
+        read_cache: bool = True,
+        project: Optional[Callable[[Dict[str, Any]], Any]] = None,
+    ):
+        self.entity = entity
+        self.subdomain = subdomain
+        self.headers = headers
+        self.client_session = client_session
+        self.with_ = with_
+        self.batch_size = min(batch_size, MAX_BATCH_SIZE)
+        self.cache = cache
+        self.read_cache = read_cache
+        self.project = project
+
+        self._futures: Dict[int, asyncio.Future] = {}
+        # id, ждущие отправки -> min_updated_at (0 - любая копия из кеша)
+        self._queue: Dict[int, int] = {}
+        self._dispatch_scheduled = False
+        self.requests_count = 0
+
+    async def load(self, entity_id: int, min_updated_at: Optional[int] = None) -> Any:
+        """Получение одной сущности. Запрос уходит в общем батче."""
+
+        return await asyncio.shield(self.enqueue(entity_id, min_updated_at))
+
+    def enqueue(
+        self, entity_id: int, min_updated_at: Optional[int] = None
+    ) -> asyncio.Future:
+        """Постановка id в ближайший батч без ожидания результата"""
+
+        future = self._futures.get(entity_id)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._futures[entity_id] = future
+            self._queue[entity_id] = 0
+
+            if not self._dispatch_scheduled:
+                self._dispatch_scheduled = True
+                loop.call_soon(self._dispatch)
+
+        if min_updated_at is not None and entity_id in self._queue:
+            self._queue[entity_id] = max(self._queue[entity_id], min_updated_at)
+        return future
+
+    async def load_many(self, entity_ids: Iterable[int]) -> List[Any]:
+        """Получение нескольких сущностей, порядок сохраняется"""
+
+        return await asyncio.gather(*(self.load(entity_id) for entity_id in entity_ids))
+
+    def clear(self, entity_id: Optional[int] = None) -> None:
+        """Сброс закешированного результата (одного id или всех)"""
+
+        if entity_id is None:
+            self._futures = {
+                key: future
+                for key, future in self._futures.items()
+                if not future.done()
+            }
+        elif entity_id in self._futures and self._futures[entity_id].done():
+            del self._futures[entity_id]
+
+    def _dispatch(self) -> None:
+        self._dispatch_scheduled = False
+        min_updated_at, self._queue = self._queue, {}
+        queue = list(min_updated_at)
+
+        for i in range(0, len(queue), self.batch_size):
+            asyncio.create_task(
+                self._load_batch(queue[i : i + self.batch_size], min_updated_at)
+            )
+
+    async def _load_batch(
+        self, entity_ids: List[int], min_updated_at: Dict[int, int]
+    ) -> None:
+        self.requests_count += 1
+        try:
+            entities = await get_entities_by_ids(
+                self.entity,
+                entity_ids,
+                self.subdomain,
+                self.headers,
+                self.client_session,
+                with_=self.with_,
+                read_cache=self.read_cache,
+                min_updated_at=min_updated_at,
+            )
+        except Exception as e:
+            logger.error(f"Failed to load {self.entity} batch: {e}")
+            for entity_id in entity_ids:
+                self._resolve(entity_id, exception=e)
+            return
+
+        for entity_id in entity_ids:
+            entity = entities.get(entity_id)
+            if entity is None:
+                self._resolve(
+                    entity_id,
+                    exception=HTTPException(
+                        status_code=404,
+                        detail=f"{self.entity} with id {entity_id} not found",
+                    ),
+                )
+            elif self.project is not None:
+                self._resolve(entity_id, result=self.project(entity))
+            else:
+                self._resolve(entity_id, result=entity)
+
+    def _resolve(self, entity_id: int, result=None, exception=None) -> None:
+        future = self._futures.get(entity_id)
+        if future is None or future.done():
+            return
+
+        if exception is not None:
+            future.set_exception(exception)
+            # Ошибки не кешируем, следующий load() повторит запрос
+            del self._futures[entity_id]
+        else:
+            future.set_result(result)
+            if not self.cache:
+                del self._futures[entity_id]
+
+
+class AmoLoaders:
+    """Набор загрузчиков сделок, контактов и компаний одного аккаунта"""
+
+    def __init__(self, subdomain: str, headers: dict, client_session: ClientSession):
+        self.leads = EntityLoader(
+            "leads", subdomain, headers, client_session, with_="contacts"
+        )
+        # Для поиска дублей контакту нужны только телефоны, email и имя
+        self.contacts = EntityLoader(
+            "contacts",
+            subdomain,
+            headers,
+            client_session,
+            project=ContactRecord.from_dict,
+        )
+        self.companies = EntityLoader("companies", subdomain, headers, client_session)
+
+    @property
+    def requests_count(self) -> int:
+        return (
+            self.leads.requests_count
+            + self.contacts.requests_count
+            + self.companies.requests_count
+        )
@@ -0,0 +1,105 @@
+"""
+Разбор и нормализация полей сущностей amoCRM.
+
+Телефоны, email и значения кастомных полей приводятся к виду, в котором
+их можно сравнивать между сущностями (проекции records, копия mirror,
+поиск дублей).
+"""
+
+import re
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+DEFAULT_COUNTRY_CODE = "7"
+
+GMAIL_DOMAINS = {"gmail.com", "googlemail.com"}
+YANDEX_DOMAINS = {
+    "yandex.ru",
+    "ya.ru",
+    "yandex.com",
+    "yandex.by",
+    "yandex.kz",
+    "yandex.ua",
+}
+
+_NON_DIGITS = re.compile(r"\D+")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_phone(
+    value: Any, default_country_code: str = DEFAULT_COUNTRY_CODE
+) -> Optional[str]:
+    """Приведение телефона к формату E.164 (+79991234567)"""
+
+    if value is None:
+        return None
+
+    digits = _NON_DIGITS.sub("", str(value))
+    if not digits:
+        return None
+
+    # Российские номера пишут через 8 и без кода страны
+    if len(digits) == 11 and digits[0] == "8" and default_country_code == "7":
+        digits = "7" + digits[1:]
+    elif len(digits) == 10:
+        digits = default_country_code + digits
+
+    if len(digits) < 11 or len(digits) > 15:
+        return None
+
+    return "+" + digits
+
+
+def normalize_email(value: Any) -> Optional[str]:
+    """Приведение email к каноничному виду (регистр, алиасы, +метки)"""
+
+    if value is None:
+        return None
+
+    email = str(value).strip().lower()
+    local, sep, domain = email.rpartition("@")
+    if not sep or not local or not domain:
+        return None
+
+    local = local.split("+", 1)[0]
+
+    if domain in GMAIL_DOMAINS:
+        domain = "gmail.com"
+        local = local.replace(".", "")
+    elif domain in YANDEX_DOMAINS:
+        domain = "yandex.ru"
+        local = local.replace(".", "-")
+
+    if not local:
+        return None
+
+    return f"{local}@{domain}"
+
+
+def normalize_field_value(value: Any) -> Optional[str]:
+    """Нормализация значения произвольного поля для сравнения"""
+
+    if value is None:
+        return None
+
+    normalized = _SPACES.sub(" ", str(value)).strip().lower()
+    return normalized or None
+
+
+def iter_custom_field_values(
+    entity: Dict[str, Any],
+) -> Iterator[Tuple[Optional[int], Optional[str], Any]]:
+    """Обход custom_fields_values сущности: (field_id, field_code, value)"""
+
+    for field in entity.get("custom_fields_values") or []:
+        for item in field.get("values") or []:
+            yield field.get("field_id"), field.get("field_code"), item.get("value")
+
+
+def get_embedded_ids(entity: Dict[str, Any], embedded: str) -> List[int]:
+    """Id вложенных сущностей (_embedded.contacts, _embedded.companies)"""
+
+    return [
+        item["id"]
+        for item in (entity.get("_embedded") or {}).get(embedded) or []
+        if "id" in item
+    ]
@@ -0,0 +1,130 @@
+from typing import Any, Collection, Dict, Optional, Tuple
+
+from src.amocrm.normalize import (
+    get_embedded_ids,
+    iter_custom_field_values,
+    normalize_email,
+    normalize_field_value,
+    normalize_phone,
+)
+
+
+class LeadRecord:
+    """
+    Компактная проекция сделки: только поля, нужные для поиска дублей.
+
+    Вместо полного dict из ответа amoCRM (вложенные _links, _embedded,
+    все кастомные поля) хранятся примитивы и кортежи в __slots__.
+    """
+
+    __slots__ = (
+        "id",
+        "name",
+        "pipeline_id",
+        "status_id",
+        "responsible_user_id",
+        "created_at",
+        "updated_at",
+        "contact_ids",
+        "company_ids",
+        "fields",
+    )
+
+    def __init__(
+        self,
+        id: int,
+        name: Optional[str] = None,
+        pipeline_id: Optional[int] = None,
+        status_id: Optional[int] = None,
+        responsible_user_id: Optional[int] = None,
+        created_at: int = 0,
+        updated_at: int = 0,
+        contact_ids: Tuple[int, ...] = (),
+        company_ids: Tuple[int, ...] = (),
+        fields: Tuple[Tuple[int, str], ...] = (),
+    ):
+        self.id = id
+        self.name = name
+        self.pipeline_id = pipeline_id
+        self.status_id = status_id
+        self.responsible_user_id = responsible_user_id
+        self.created_at = created_at
+        self.updated_at = updated_at
+        self.contact_ids = contact_ids
+        self.company_ids = company_ids
+        self.fields = fields
+
+    def __repr__(self) -> str:
+        return f"LeadRecord(id={self.id}, pipeline_id={self.pipeline_id})"
+
+    @classmethod
+    def from_dict(
+        cls, lead: Dict[str, Any], custom_field_ids: Collection[int] = ()
+    ) -> "LeadRecord":
+        """Проекция сделки; из кастомных полей берутся только custom_field_ids"""
+
+        fields = ()
+        if custom_field_ids:
+            fields = tuple(
+                (field_id, normalized)
+                for field_id, _, value in iter_custom_field_values(lead)
+                if field_id in custom_field_ids
+                and (normalized := normalize_field_value(value))
+            )
+
+        return cls(
+            id=lead["id"],
+            name=lead.get("name"),
+            pipeline_id=lead.get("pipeline_id"),
+            status_id=lead.get("status_id"),
+            responsible_user_id=lead.get("responsible_user_id"),
+            created_at=lead.get("created_at") or 0,
+            updated_at=lead.get("updated_at") or 0,
+            contact_ids=tuple(get_embedded_ids(lead, "contacts")),
+            company_ids=tuple(get_embedded_ids(lead, "companies")),
+            fields=fields,
+        )
+
+
+class ContactRecord:
+    """Компактная проекция контакта: нормализованные телефоны и email"""
+
+    __slots__ = ("id", "name", "updated_at", "phones", "emails")
+
+    def __init__(
+        self,
+        id: int,
+        name: Optional[str] = None,
+        updated_at: int = 0,
+        phones: Tuple[str, ...] = (),
+        emails: Tuple[str, ...] = (),
+    ):
+        self.id = id
+        self.name = name
+        self.updated_at = updated_at
+        self.phones = phones
+        self.emails = emails
+
+    def __repr__(self) -> str:
+        return f"ContactRecord(id={self.id})"
+
+    @classmethod
+    def from_dict(cls, contact: Dict[str, Any]) -> "ContactRecord":
+        phones, emails = set(), set()
+        for _, field_code, value in iter_custom_field_values(contact):
+            if field_code == "PHONE":
+                phone = normalize_phone(value)
+                if phone:
+                    phones.add(phone)
+            elif field_code == "EMAIL":
+                email = normalize_email(value)
+                if email:
+                    emails.add(email)
+
+        return cls(
+            id=contact["id"],
+            name=contact.get("name"),
+            updated_at=contact.get("updated_at") or 0,
+            phones=tuple(sorted(phones)),
+            emails=tuple(sorted(emails)),
+        )
@@ -1,116 +1,416 @@
 from loguru import logger
 
-from typing import AsyncGenerator, Dict, Any
+from typing import AsyncGenerator, Callable, Dict, Any, Optional, Set, Tuple
 
 from aiohttp import ClientSession
 from fastapi import HTTPException
 
+import asyncio
 import json
+import time
 from typing import List
 
 import aiohttp
+import orjson
 
+from src.amocrm.cache import amo_cache
+from src.amocrm.client import AmoClient, amo_client, build_auth_header
+from src.common.config import LEADS_PAGE_LIMIT, LEADS_PREFETCH_PAGES
 
-async def get_headers(subdomain: str, access_token: str) -> Dict:
+
+def build_headers(access_token: str) -> Dict[str, str]:
     """Получение headers для запросов"""
 
-    headers = {
-        "Host": subdomain + ".amocrm.ru",
-        "Content - Length": "0",
-        "Content - Type": "application / json",
-        "Authorization": "Bearer " + access_token,
+    return {
+        **build_auth_header(access_token),
+        "Content-Type": "application/json",
+        "Accept": "application/json",
     }
 
-    return headers
-
 
-async def get_client_session() -> AsyncGenerator[aiohttp.ClientSession, None]:
-    """Асинхронная ссесия для запросов к амо"""
+async def get_client_session() -> AsyncGenerator[AmoClient, None]:
+    """Общий клиент amoCRM для запросов (сессия и лимиты на все приложение)"""
 
-    async with aiohttp.ClientSession() as session:
-        yield session
+    await amo_client.start()
+    yield amo_client
 
 
-async def get_leads_by_filter_async(
-    client_session: ClientSession,
-    subdomain: str,
-    headers: dict,
-    pipeline_id: int,
+def _build_leads_filter(
+    pipeline_id: Optional[int],
     statuses_ids: List[int] = None,
     responsible_user_id: int = None,
-) -> List[dict]:
-    """Асинхронное получение сделок с помощью фильтра"""
+    updated_from: int = None,
+) -> Dict[str, Any]:
+    """Параметры фильтра для списка сделок"""
 
     """
     FILTERS:
         filter[responsible_user_id] - по ответственному
         filter[pipeline_id] - по воронке
         filter[status][] - по статусам
+        filter[updated_at][from] - измененные начиная с timestamp
     """
 
-    params = {"filter[pipeline_id]": pipeline_id}
+    params: Dict[str, Any] = {}
+    if pipeline_id is not None:
+        params["filter[pipeline_id]"] = pipeline_id
     if statuses_ids:
         for i, status_id in enumerate(statuses_ids):
             params[f"filter[status][{i}]"] = status_id
     if responsible_user_id:
         params["filter[responsible_user_id]"] = responsible_user_id
+    if updated_from:
+        params["filter[updated_at][from]"] = updated_from
+
+    return params
 
-    url = f"https://{subdomain}.amocrm.ru/api/v4/leads?with=contacts"
+
+async def _fetch_page(
+    client_session: ClientSession,
+    url: str,
+    headers: dict,
+    params: Dict[str, Any],
+    page: int,
+    limit: int,
+    project: Optional[Callable[[dict], Any]] = None,
+    entity: str = "leads",
+) -> Tuple[List[Any], bool]:
+    """Получение одной страницы списка сущностей. Возвращает сущности и признак следующей страницы.
+
+    С project сущности сразу заменяются проекцией, полный JSON страницы
+    освобождается до того, как страница попадет в окно предзагрузки.
+    """
+
+    page_params = {**params, "page": page, "limit": limit}
 
     try:
-        # Выполняем запрос к API
-        async with client_session.get(url, params=params, headers=headers) as response:
+        async with client_session.get(
+            url, params=page_params, headers=headers
+        ) as response:
             if response.status == 200:
-                # Пытаемся прочитать JSON-ответ
-                response_json = await response.json()
+                response_json = orjson.loads(await response.read())
 
-                # Извлекаем список сделок из ответа JSON
-                leads = response_json.get("_embedded", {}).get("leads", [])
-                return leads
+                items = response_json.get("_embedded", {}).get(entity, [])
+                has_next = "next" in response_json.get("_links", {})
+                if project is not None:
+                    items = [project(item) for item in items]
+                return items, has_next
 
             elif response.status == 204:
-                logger.warning(
-                    f"No content returned (204) for pipeline {pipeline_id}. No leads available."
-                )
-                return []
+                # Страница за пределами выборки
+                return [], False
             else:
-                # Обрабатываем случаи, когда API вернул ошибочный статус
                 error_message = await response.text()
                 logger.error(
-                    f"Error fetching leads (status {response.status}): {error_message}",
+                    f"Error fetching {entity} page {page} (status {response.status}): {error_message}",
                     exception=True,
                 )
                 raise HTTPException(
                     status_code=response.status,
-                    detail=f"Failed to fetch leads: {error_message}",
+                    detail=f"Failed to fetch {entity}: {error_message}",
                 )
 
+    except HTTPException:
+        raise
     except aiohttp.ClientError as client_err:
-        # Обработка ошибок, связанных с сетью
         logger.error(f"Network or client error occurred: {client_err}", exception=True)
         raise HTTPException(
             status_code=502, detail="Bad Gateway - Error connecting to AmoCRM"
         )
-    except Exception as e:
-        # Обрабатываем любые другие ошибки
-        logger.error(f"Unexpected error occurred while fetching leads", exception=True)
+    except Exception:
+        logger.error(
+            f"Unexpected error occurred while fetching {entity} page {page}",
+            exception=True,
+        )
         raise HTTPException(
-            status_code=500, detail="Unexpected error occurred while fetching leads"
+            status_code=500, detail=f"Unexpected error occurred while fetching {entity}"
+        )
+
+
+async def iter_entities(
+    client_session: ClientSession,
+    subdomain: str,
+    headers: dict,
+    entity: str,
+    params: Optional[Dict[str, Any]] = None,
+    limit: int = LEADS_PAGE_LIMIT,
+    prefetch: int = LEADS_PREFETCH_PAGES,
+    project: Optional[Callable[[dict], Any]] = None,
+) -> AsyncGenerator[Any, None]:
+    """Постраничный обход списка сущностей (leads, contacts, companies, events).
+
+    Следующие `prefetch` страниц запрашиваются параллельно, пока потребитель
+    обрабатывает текущую. Сущности отдаются в порядке страниц, в памяти
+    держится не больше окна предзагрузки. project (например,
+    LeadRecord.from_dict) превращает каждую сущность в компактную запись.
+    """
+
+    url = f"https://{subdomain}.amocrm.ru/api/v4/{entity}"
+    params = params or {}
+    window = max(prefetch, 1)
+
+    pending: Dict[int, asyncio.Task] = {}
+    next_page = 1
+
+    def schedule_next_page() -> None:
+        nonlocal next_page
+        pending[next_page] = asyncio.create_task(
+            _fetch_page(
+                client_session,
+                url,
+                headers,
+                params,
+                next_page,
+                limit,
+                project,
+                entity,
+            )
+        )
+        next_page += 1
+
+    for _ in range(window):
+        schedule_next_page()
+
+    current_page = 1
+    try:
+        while current_page in pending:
+            items, has_next = await pending.pop(current_page)
+
+            if has_next:
+                # Держим окно предзагрузки заполненным до отдачи сущностей
+                while next_page <= current_page + window:
+                    schedule_next_page()
+
+            for item in items:
+                yield item
+
+            if not has_next:
+                break
+            current_page += 1
+    finally:
+        for task in pending.values():
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending.values(), return_exceptions=True)
+
+
+async def iter_entities_by_updated_at(
+    client_session: ClientSession,
+    subdomain: str,
+    headers: dict,
+    entity: str,
+    params: Optional[Dict[str, Any]] = None,
+    updated_from: Optional[int] = None,
+    limit: int = LEADS_PAGE_LIMIT,
+    project: Optional[Callable[[dict], Any]] = None,
+) -> AsyncGenerator[Any, None]:
+    """Обход списка сущностей по возрастанию updated_at с курсором.
+
+    Следующая страница запрашивается с filter[updated_at][from], равным
+    последнему updated_at предыдущей, а не по номеру: удаление или
+    изменение сущности во время обхода не сдвигает непрочитанные, и они
+    не пропускаются. Сущности на границе страниц приходят повторно.
+    Если вся страница пришлась на один updated_at, он дочитывается
+    постранично. Страницы запрашиваются последовательно.
+    """
+
+    url = f"https://{subdomain}.amocrm.ru/api/v4/{entity}"
+    params = {**(params or {}), "order[updated_at]": "asc"}
+
+    def keyed(item: dict) -> Tuple[int, Any]:
+        return item.get("updated_at") or 0, item if project is None else project(item)
+
+    cursor = updated_from
+    while True:
+        page_params = dict(params)
+        if cursor is not None:
+            page_params["filter[updated_at][from]"] = cursor
+        items, has_next = await _fetch_page(
+            client_session, url, headers, page_params, 1, limit, keyed, entity
+        )
+        for _, item in items:
+            yield item
+        if not has_next or not items:
+            return
+
+        last = items[-1][0]
+        if cursor is not None and last <= cursor:
+            # Страница целиком из одного updated_at: курсором его не пройти
+            async for item in iter_entities(
+                client_session,
+                subdomain,
+                headers,
+                entity,
+                {
+                    **params,
+                    "filter[updated_at][from]": cursor,
+                    "filter[updated_at][to]": cursor,
+                },
+                limit=limit,
+                project=project,
+            ):
+                yield item
+            last = cursor + 1
+        cursor = last
+
+
+def iter_leads_by_filter(
+    client_session: ClientSession,
+    subdomain: str,
+    headers: dict,
+    pipeline_id: int,
+    statuses_ids: List[int] = None,
+    responsible_user_id: int = None,
+    limit: int = LEADS_PAGE_LIMIT,
+    prefetch: int = LEADS_PREFETCH_PAGES,
+    project: Optional[Callable[[dict], Any]] = None,
+    updated_from: int = None,
+) -> AsyncGenerator[Any, None]:
+    """Постраничный обход всех сделок воронки по фильтру (с контактами).
+
+    updated_from ограничивает выборку сделками, измененными с этого timestamp.
+    """
+
+    params = _build_leads_filter(
+        pipeline_id, statuses_ids, responsible_user_id, updated_from
+    )
+    params["with"] = "contacts"
+    return iter_entities(
+        client_session,
+        subdomain,
+        headers,
+        "leads",
+        params,
+        limit=limit,
+        prefetch=prefetch,
+        project=project,
+    )
+
+
+def iter_leads_by_updated_at(
+    client_session: ClientSession,
+    subdomain: str,
+    headers: dict,
+    pipeline_id: Optional[int] = None,
+    statuses_ids: List[int] = None,
+    responsible_user_id: int = None,
+    project: Optional[Callable[[dict], Any]] = None,
+    updated_from: int = None,
+) -> AsyncGenerator[Any, None]:
+    """Обход сделок (с контактами) по возрастанию updated_at с курсором.
+
+    В отличие от iter_leads_by_filter страницы идут последовательно, зато
+    сделка, ушедшая из выборки во время обхода, не сдвигает страницы
+    (см. iter_entities_by_updated_at). pipeline_id=None - все воронки.
+    """
+
+    params = _build_leads_filter(pipeline_id, statuses_ids, responsible_user_id)
+    params["with"] = "contacts"
+    return iter_entities_by_updated_at(
+        client_session,
+        subdomain,
+        headers,
+        "leads",
+        params,
+        updated_from=updated_from,
+        project=project,
+    )
+
+
+async def get_deleted_lead_ids(
+    client_session: ClientSession,
+    subdomain: str,
+    headers: dict,
+    created_from: int,
+    limit: int = 100,
+) -> Set[int]:
+    """Id сделок, удаленных с created_from (по событиям lead_deleted/restored).
+
+    Удаленные сделки не приходят в списках, удаление видно только по
+    событиям. Сделка, восстановленная после удаления, в ответ не попадает.
+    """
+
+    params = {
+        "filter[type]": "lead_deleted,lead_restored",
+        "filter[created_at][from]": created_from,
+    }
+    events = [
+        event
+        async for event in iter_entities(
+            client_session,
+            subdomain,
+            headers,
+            "events",
+            params,
+            limit=limit,
+            project=lambda event: (
+                event.get("created_at") or 0,
+                event["type"],
+                event["entity_id"],
+            ),
         )
+    ]
+
+    # Итог - последнее событие сделки
+    deleted: Dict[int, bool] = {}
+    for _, event_type, lead_id in sorted(events):
+        deleted[lead_id] = event_type == "lead_deleted"
+    return {lead_id for lead_id, is_deleted in deleted.items() if is_deleted}
+
+
+async def get_leads_by_filter_async(
+    client_session: ClientSession,
+    subdomain: str,
+    headers: dict,
+    pipeline_id: int,
+    statuses_ids: List[int] = None,
+    responsible_user_id: int = None,
+) -> List[dict]:
+    """Асинхронное получение всех сделок с помощью фильтра"""
+
+    return [
+        lead
+        async for lead in iter_leads_by_filter(
+            client_session,
+            subdomain,
+            headers,
+            pipeline_id,
+            statuses_ids=statuses_ids,
+            responsible_user_id=responsible_user_id,
+        )
+    ]
 
 
 async def get_lead_by_id(
-    lead_id: int, subdomain: str, headers: dict, client_session: ClientSession
+    lead_id: int,
+    subdomain: str,
+    headers: dict,
+    client_session: ClientSession,
+    read_cache: bool = True,
+    min_updated_at: Optional[int] = None,
 ) -> Dict[str, Any]:
-    """Получение объекта сделки по id сделки."""
+    """
+    Получение объекта сделки по id сделки.
+
+    read_cache и min_updated_at - как в get_entities_by_ids.
+    """
 
     url = f"https://{subdomain}.amocrm.ru/api/v4/leads/{lead_id}?with=contacts"
 
+    cached = (
+        await amo_cache.get(subdomain, "leads", lead_id, min_updated_at)
+        if read_cache
+        else None
+    )
+    if cached is not None:
+        return cached
+
     try:
         async with client_session.get(url, headers=headers) as response:
             if response.status == 200:
                 try:
                     data = await response.json()
+                    await amo_cache.set(subdomain, "leads", lead_id, data)
                     return data
                 except Exception as json_err:
                     logger.error(
@@ -136,6 +436,8 @@ async def get_lead_by_id(
                     detail=f"Failed to fetch lead with id {lead_id}. Error: {error_message}",
                 )
 
+    except HTTPException:
+        raise
     except aiohttp.ClientError as client_err:
         logger.error(
             f"Network error while fetching lead with id {lead_id}: {client_err}",
@@ -154,17 +456,35 @@ async def get_lead_by_id(
 
 
 async def get_contact_by_id(
-    contact_id: int, subdomain: str, headers: dict, client_session: ClientSession
+    contact_id: int,
+    subdomain: str,
+    headers: dict,
+    client_session: ClientSession,
+    read_cache: bool = True,
+    min_updated_at: Optional[int] = None,
 ) -> Dict[str, Any]:
-    """Получение объекта контакта по id контакта"""
+    """
+    Получение объекта контакта по id контакта.
+
+    read_cache и min_updated_at - как в get_entities_by_ids.
+    """
 
     url = f"https://{subdomain}.amocrm.ru/api/v4/contacts/{contact_id}"
 
+    cached = (
+        await amo_cache.get(subdomain, "contacts", contact_id, min_updated_at)
+        if read_cache
+        else None
+    )
+    if cached is not None:
+        return cached
+
     try:
         async with client_session.get(url, headers=headers) as response:
             if response.status == 200:
                 try:
                     data = await response.json()
+                    await amo_cache.set(subdomain, "contacts", contact_id, data)
                     return data
                 except Exception as json_err:
                     logger.error(
@@ -185,6 +505,8 @@ async def get_contact_by_id(
                     detail=f"Failed to fetch contact with id {contact_id}. Error: {error_message}",
                 )
 
+    except HTTPException:
+        raise
     except aiohttp.ClientError as client_err:
         logger.error(
             f"Network error while fetching contact with id {contact_id}: {client_err}",
@@ -205,32 +527,54 @@ async def get_contact_by_id(
 async def get_all_contacts(
     subdomain: str, headers: dict, client_session: ClientSession
 ) -> List[Dict[str, int]]:
-    """Получение всех контактов"""
+    """Получение всех контактов (постранично)"""
+
+    return [
+        contact
+        async for contact in iter_entities(
+            client_session,
+            subdomain,
+            headers,
+            "contacts",
+            project=lambda contact: {
+                "id": contact["id"],
+                "responsible_user_id": contact.get("responsible_user_id"),
+            },
+        )
+    ]
+
 
-    url = f"https://{subdomain}.amocrm.ru/api/v4/contacts"
+async def get_company_by_id(
+    company_id: int,
+    subdomain: str,
+    headers: dict,
+    client_session: ClientSession,
+    read_cache: bool = True,
+    min_updated_at: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Получение объкта компании по id.
+
+    read_cache и min_updated_at - как в get_entities_by_ids.
+    """
+
+    url = f"https://{subdomain}.amocrm.ru/api/v4/companies/{company_id}"
+
+    cached = (
+        await amo_cache.get(subdomain, "companies", company_id, min_updated_at)
+        if read_cache
+        else None
+    )
+    if cached is not None:
+        return cached
 
     try:
-        # Выполняем запрос к API
         async with client_session.get(url, headers=headers) as response:
             if response.status == 200:
                 try:
                     data = await response.json()
-                    contacts = [
-                        {
-                            "id": contact["id"],
-                            "responsible_user_id": contact["responsible_user_id"],
-                        }
-                        for contact in data["_embedded"]["contacts"]
-                    ]
-                    return contacts
-                except KeyError as key_err:
-                    logger.error(
-                        f"Missing expected key in response data: {key_err}",
-                        exception=True,
-                    )
-                    raise HTTPException(
-                        status_code=500, detail="Unexpected response format from server"
-                    )
+                    await amo_cache.set(subdomain, "companies", company_id, data)
+                    return data
                 except Exception as json_err:
                     logger.error(
                         f"Failed to parse JSON from response: {json_err}",
@@ -242,17 +586,20 @@ async def get_all_contacts(
             else:
                 error_message = await response.text()
                 logger.error(
-                    f"Error fetching contacts (status {response.status}): {error_message}",
+                    f"Error fetching company (status {response.status}): {error_message}",
                     exception=True,
                 )
                 raise HTTPException(
                     status_code=response.status,
-                    detail=f"Failed to fetch contacts. Error: {error_message}",
+                    detail=f"Failed to fetch company with id {company_id}. Error: {error_message}",
                 )
 
+    except HTTPException:
+        raise
     except aiohttp.ClientError as client_err:
         logger.error(
-            f"Network error while fetching contacts: {client_err}", exception=True
+            f"Network error while fetching company with id {company_id}: {client_err}",
+            exception=True,
         )
         raise HTTPException(
             status_code=502, detail="Bad Gateway - Error connecting to AmoCRM"
@@ -260,46 +607,77 @@ async def get_all_contacts(
 
     except Exception as e:
         logger.error(
-            f"Unexpected error occurred while fetching contacts: {e}", exception=True
+            f"Unexpected error while fetching company with id {company_id}: {e}",
+            exception=True,
         )
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
-async def get_company_by_id(
-    company_id: int, subdomain: str, headers: dict, client_session: ClientSession
-) -> Dict[str, Any]:
-    """Получение объкта компании по id"""
+async def get_entities_by_ids(
+    entity: str,
+    entity_ids: List[int],
+    subdomain: str,
+    headers: dict,
+    client_session: ClientSession,
+    with_: Optional[str] = None,
+    read_cache: bool = True,
+    min_updated_at: Optional[Dict[int, int]] = None,
+) -> Dict[int, Dict[str, Any]]:
+    """
+    Получение сущностей (leads, contacts, companies) списком по filter[id][].
 
-    url = f"https://{subdomain}.amocrm.ru/api/v4/companies/{company_id}"
+    read_cache=False - все сущности запрашиваются в amoCRM (свежие версии
+    при этом попадают в кеш), например перед изменением сущности.
+    min_updated_at - id -> момент, копия старше которого в кеше не
+    подходит (см. AmoCache).
+    """
 
+    cached = (
+        await amo_cache.get_many(subdomain, entity, entity_ids, min_updated_at)
+        if read_cache
+        else {}
+    )
+    entity_ids = [entity_id for entity_id in entity_ids if entity_id not in cached]
+    if not entity_ids:
+        return cached
+
+    url = f"https://{subdomain}.amocrm.ru/api/v4/{entity}"
+
+    params: List[Tuple[str, Any]] = [("limit", len(entity_ids))]
+    params.extend(("filter[id][]", entity_id) for entity_id in entity_ids)
+    if with_:
+        params.append(("with", with_))
+
+    # Ответ актуален на момент запроса, а не на момент его разбора
+    fetched_at = time.time()
     try:
-        async with client_session.get(url, headers=headers) as response:
+        async with client_session.get(url, params=params, headers=headers) as response:
             if response.status == 200:
-                try:
-                    data = await response.json()
-                    return data
-                except Exception as json_err:
-                    logger.error(
-                        f"Failed to parse JSON from response: {json_err}",
-                        exception=True,
-                    )
-                    raise HTTPException(
-                        status_code=500, detail="Failed to parse server response"
-                    )
+                data = orjson.loads(await response.read())
+                entities = {
+                    item["id"]: item
+                    for item in data.get("_embedded", {}).get(entity, [])
+                }
+                await amo_cache.set_many(subdomain, entity, entities, fetched_at)
+                return {**cached, **entities}
+            elif response.status == 204:
+                return cached
             else:
                 error_message = await response.text()
                 logger.error(
-                    f"Error fetching company (status {response.status}): {error_message}",
+                    f"Error fetching {entity} batch (status {response.status}): {error_message}",
                     exception=True,
                 )
                 raise HTTPException(
                     status_code=response.status,
-                    detail=f"Failed to fetch company with id {company_id}. Error: {error_message}",
+                    detail=f"Failed to fetch {entity}. Error: {error_message}",
                 )
 
+    except HTTPException:
+        raise
     except aiohttp.ClientError as client_err:
         logger.error(
-            f"Network error while fetching company with id {company_id}: {client_err}",
+            f"Network error while fetching {entity} batch: {client_err}",
             exception=True,
         )
         raise HTTPException(
@@ -308,7 +686,126 @@ async def get_company_by_id(
 
     except Exception as e:
         logger.error(
-            f"Unexpected error while fetching company with id {company_id}: {e}",
+            f"Unexpected error while fetching {entity} batch: {e}",
             exception=True,
         )
         raise HTTPException(status_code=500, detail="Internal server error")
+
+
+async def _send_json(
+    method: str,
+    url: str,
+    payload: Any,
+    headers: dict,
+    client_session: ClientSession,
+) -> Any:
+    """Отправка изменяющего запроса (PATCH/POST) с JSON-телом"""
+
+    try:
+        async with client_session.request(
+            method, url, data=orjson.dumps(payload), headers=headers
+        ) as response:
+            if response.status in (200, 201, 202):
+                body = await response.read()
+                return orjson.loads(body) if body else {}
+            elif response.status == 204:
+                return {}
+            else:
+                error_message = await response.text()
+                logger.error(
+                    f"Error in {method} {url} (status {response.status}): {error_message}",
+                )
+                raise HTTPException(
+                    status_code=response.status,
+                    detail=f"AmoCRM rejected {method} {url}. Error: {error_message}",
+                )
+
+    except HTTPException:
+        raise
+    except aiohttp.ClientError as client_err:
+        logger.error(f"Network error in {method} {url}: {client_err}")
+        raise HTTPException(
+            status_code=502, detail="Bad Gateway - Error connecting to AmoCRM"
+        )
+
+
+async def patch_leads(
+    leads: List[Dict[str, Any]],
+    subdomain: str,
+    headers: dict,
+    client_session: ClientSession,
+) -> Any:
+    """Пакетное изменение сделок (до 50 сделок за запрос)"""
+
+    url = f"https://{subdomain}.amocrm.ru/api/v4/leads"
+    return await _send_json("PATCH", url, leads, headers, client_session)
+
+
+async def link_leads(
+    links: List[Dict[str, Any]],
+    subdomain: str,
+    headers: dict,
+    client_session: ClientSession,
+) -> Any:
+    """Пакетная привязка сущностей (контактов, компаний) к сделкам"""
+
+    url = f"https://{subdomain}.amocrm.ru/api/v4/leads/link"
+    return await _send_json("POST", url, links, headers, client_session)
+
+
+async def add_leads_notes(
+    notes: List[Dict[str, Any]],
+    subdomain: str,
+    headers: dict,
+    client_session: ClientSession,
+) -> Any:
+    """Пакетное добавление примечаний к сделкам"""
+
+    url = f"https://{subdomain}.amocrm.ru/api/v4/leads/notes"
+    return await _send_json("POST", url, notes, headers, client_session)
+
+
+async def get_notes_by_lead_ids(
+    lead_ids: List[int],
+    subdomain: str,
+    headers: dict,
+    client_session: ClientSession,
+) -> List[Dict[str, Any]]:
+    """Получение всех примечаний сделок (постранично, по filter[entity_id][])"""
+
+    url = f"https://{subdomain}.amocrm.ru/api/v4/leads/notes"
+    params: List[Tuple[str, Any]] = [("limit", 250)]
+    params.extend(("filter[entity_id][]", lead_id) for lead_id in lead_ids)
+
+    notes: List[Dict[str, Any]] = []
+    page = 1
+    while True:
+        try:
+            async with client_session.get(
+                url, params=[*params, ("page", page)], headers=headers
+            ) as response:
+                if response.status == 204:
+                    return notes
+                if response.status != 200:
+                    error_message = await response.text()
+                    logger.error(
+                        f"Error fetching notes (status {response.status}): {error_message}",
+                    )
+                    raise HTTPException(
+                        status_code=response.status,
+                        detail=f"Failed to fetch notes. Error: {error_message}",
+                    )
+                data = orjson.loads(await response.read())
+
+        except HTTPException:
+            raise
+        except aiohttp.ClientError as client_err:
+            logger.error(f"Network error while fetching notes: {client_err}")
+            raise HTTPException(
+                status_code=502, detail="Bad Gateway - Error connecting to AmoCRM"
+            )
+
+        notes.extend(data.get("_embedded", {}).get("notes", []))
+        if "next" not in data.get("_links", {}):
+            return notes
+        page += 1
@@ -20,3 +20,93 @@ RMQ_HOST = os.environ.get("RMQ_HOST")
 RMQ_PORT = os.environ.get("RMQ_PORT")
 RMQ_VHOST = os.environ.get("RMQ_VHOST")
 RMQ_QUEUE = os.environ.get("RMQ_QUEUE")
+
+LEADS_PAGE_LIMIT = int(os.environ.get("LEADS_PAGE_LIMIT", 250))
+LEADS_PREFETCH_PAGES = int(os.environ.get("LEADS_PREFETCH_PAGES", 3))
+
+AMO_RATE_LIMIT = float(os.environ.get("AMO_RATE_LIMIT", 7))
+AMO_RATE_BURST = int(os.environ.get("AMO_RATE_BURST", 7))
+AMO_MAX_RETRIES = int(os.environ.get("AMO_MAX_RETRIES", 5))
+AMO_CONNECTION_LIMIT = int(os.environ.get("AMO_CONNECTION_LIMIT", 100))
+AMO_CONNECTION_LIMIT_PER_HOST = int(os.environ.get("AMO_CONNECTION_LIMIT_PER_HOST", 20))
+AMO_REQUEST_TIMEOUT = float(os.environ.get("AMO_REQUEST_TIMEOUT", 30))
+AMO_BREAKER_FAILURES = int(os.environ.get("AMO_BREAKER_FAILURES", 5))
+AMO_BREAKER_RESET_TIMEOUT = float(os.environ.get("AMO_BREAKER_RESET_TIMEOUT", 30))
+
+AMO_CACHE_SIZE = int(os.environ.get("AMO_CACHE_SIZE", 50000))
+AMO_CACHE_LOCAL_TTL = float(os.environ.get("AMO_CACHE_LOCAL_TTL", 60))
+AMO_CACHE_REDIS_TTL = int(os.environ.get("AMO_CACHE_REDIS_TTL", 3600))
+
+TOKEN_REFRESH_MARGIN = float(os.environ.get("TOKEN_REFRESH_MARGIN", 60))
+TOKEN_DEFAULT_TTL = float(os.environ.get("TOKEN_DEFAULT_TTL", 600))
+
+RPC_TIMEOUT = float(os.environ.get("RPC_TIMEOUT", 10))
+
+# Дедлайн HTTP-запроса без заголовка X-Deadline / X-Request-Timeout (0 - нет)
+HTTP_REQUEST_TIMEOUT = float(os.environ.get("HTTP_REQUEST_TIMEOUT", 0))
+
+RMQ_PREFETCH_COUNT = int(os.environ.get("RMQ_PREFETCH_COUNT", 20))
+RMQ_CONCURRENCY = int(os.environ.get("RMQ_CONCURRENCY", 10))
+RMQ_DRAIN_TIMEOUT = float(os.environ.get("RMQ_DRAIN_TIMEOUT", 30))
+
+# Повторы через очереди задержки: BASE_DELAY * MULTIPLIER ** n секунд
+RMQ_RETRY_MAX_ATTEMPTS = int(os.environ.get("RMQ_RETRY_MAX_ATTEMPTS", 5))
+RMQ_RETRY_BASE_DELAY = float(os.environ.get("RMQ_RETRY_BASE_DELAY", 5))
+RMQ_RETRY_MULTIPLIER = float(os.environ.get("RMQ_RETRY_MULTIPLIER", 4))
+
+# Воркеры очереди (python -m src.worker): 0 - по одному на ядро
+WORKER_PROCESSES = int(os.environ.get("WORKER_PROCESSES", 0))
+WORKER_RESTART_DELAY = float(os.environ.get("WORKER_RESTART_DELAY", 1))
+WORKER_MAX_RESTART_DELAY = float(os.environ.get("WORKER_MAX_RESTART_DELAY", 30))
+WORKER_MIN_UPTIME = float(os.environ.get("WORKER_MIN_UPTIME", 10))
+WORKER_STOP_TIMEOUT = float(
+    os.environ.get("WORKER_STOP_TIMEOUT", RMQ_DRAIN_TIMEOUT + 10)
+)
+# Порт метрик первого воркера, у следующих +1 (0 - без метрик)
+WORKER_METRICS_PORT = int(os.environ.get("WORKER_METRICS_PORT", 0))
+
+RMQ_PUBLISHER_CHANNELS = int(os.environ.get("RMQ_PUBLISHER_CHANNELS", 2))
+RMQ_PUBLISH_BATCH_SIZE = int(os.environ.get("RMQ_PUBLISH_BATCH_SIZE", 100))
+RMQ_PUBLISH_BATCH_INTERVAL = float(os.environ.get("RMQ_PUBLISH_BATCH_INTERVAL", 0.005))
+RMQ_PUBLISHER_CLOSE_TIMEOUT = float(os.environ.get("RMQ_PUBLISHER_CLOSE_TIMEOUT", 5))
+
+ELASTICSEARCH_HOST = os.environ.get("ELASTICSEARCH_HOST", "http://91.197.98.62:9200")
+ELASTICSEARCH_INDEX = os.environ.get("ELASTICSEARCH_INDEX", "allocations-logs")
+LOG_BATCH_SIZE = int(os.environ.get("LOG_BATCH_SIZE", 500))
+LOG_FLUSH_INTERVAL = float(os.environ.get("LOG_FLUSH_INTERVAL", 2))
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", 10000))
+LOG_FALLBACK_PATH = os.environ.get(
+    "LOG_FALLBACK_PATH", "logs/elasticsearch_fallback.log"
+)
+
+MERGE_BATCH_SIZE = int(os.environ.get("MERGE_BATCH_SIZE", 50))
+MERGE_CONCURRENCY = int(os.environ.get("MERGE_CONCURRENCY", 5))
+
+SCAN_INTERVAL = float(os.environ.get("SCAN_INTERVAL", 900))
+SCAN_JITTER = float(os.environ.get("SCAN_JITTER", 60))
+SCAN_CONCURRENCY = int(os.environ.get("SCAN_CONCURRENCY", 3))
+
+WEBHOOK_BATCH_WINDOW = float(os.environ.get("WEBHOOK_BATCH_WINDOW", 0.3))
+WEBHOOK_BATCH_SIZE = int(os.environ.get("WEBHOOK_BATCH_SIZE", 250))
+# Повтор пачки, упавшей на загрузке сделок: DELAY * 2 ** n секунд
+WEBHOOK_RETRY_ATTEMPTS = int(os.environ.get("WEBHOOK_RETRY_ATTEMPTS", 3))
+WEBHOOK_RETRY_DELAY = float(os.environ.get("WEBHOOK_RETRY_DELAY", 5))
+
+# 0 - кластеризация в event loop, >0 - в пуле процессов из стольких воркеров
+CLUSTER_WORKERS = int(os.environ.get("CLUSTER_WORKERS", 0))
+CLUSTER_POOL_MIN_LEADS = int(os.environ.get("CLUSTER_POOL_MIN_LEADS", 50000))
+
+# Название или кластер названий больше доли сущностей (но не меньше 5)
+# или больше лимита - шаблон ("Заявка с сайта"), а не признак дубля
+FUZZY_MAX_NAME_FREQUENCY = int(os.environ.get("FUZZY_MAX_NAME_FREQUENCY", 20))
+FUZZY_MAX_NAME_SHARE = float(os.environ.get("FUZZY_MAX_NAME_SHARE", 0.05))
+
+INDEX_SNAPSHOT_DIR = os.environ.get("INDEX_SNAPSHOT_DIR", "snapshots")
+# Изменения индекса вне сканов (вебхуки, /check) пишутся в снимок с задержкой
+INDEX_SNAPSHOT_DELAY = float(os.environ.get("INDEX_SNAPSHOT_DELAY", 30))
+
+MIRROR_SYNC_INTERVAL = float(os.environ.get("MIRROR_SYNC_INTERVAL", 300))
+MIRROR_SYNC_JITTER = float(os.environ.get("MIRROR_SYNC_JITTER", 30))
+MIRROR_SYNC_CONCURRENCY = int(os.environ.get("MIRROR_SYNC_CONCURRENCY", 2))
+MIRROR_SYNC_OVERLAP = int(os.environ.get("MIRROR_SYNC_OVERLAP", 60))
+MIRROR_COPY_BATCH_SIZE = int(os.environ.get("MIRROR_COPY_BATCH_SIZE", 5000))
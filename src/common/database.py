@@ -1,8 +1,11 @@
+from typing import Any, Iterable, Sequence, Tuple
+
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import NullPool
 from src.common.config import DB_HOST, DB_NAME, DB_PASS, DB_PORT, DB_USER
+from src.common.metrics import instrument_pool
 
 DATABASE_URL = f"postgresql+asyncpg://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 Base = declarative_base()
@@ -17,6 +20,7 @@ engine = create_async_engine(
     pool_recycle=1800,
     pool_pre_ping=True
 )
+instrument_pool(engine)
 
 async_session_maker = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
@@ -25,3 +29,17 @@ async def get_async_session() -> AsyncSession:
     async with async_session_maker() as session:
         yield session
 
+
+async def copy_records(
+    session: AsyncSession,
+    table: str,
+    columns: Sequence[str],
+    records: Iterable[Tuple[Any, ...]],
+) -> None:
+    """COPY строк в таблицу через соединение asyncpg текущей транзакции сессии"""
+
+    connection = await session.connection()
+    raw_connection = await connection.get_raw_connection()
+    await raw_connection.driver_connection.copy_records_to_table(
+        table, records=records, columns=columns
+    )
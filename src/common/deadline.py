@@ -0,0 +1,167 @@
+"""
+Дедлайн обработки запроса.
+
+Дедлайн - абсолютное время (unix timestamp), к которому ответ еще
+кому-то нужен. Он приходит в заголовке сообщения RabbitMQ или HTTP-запроса
+(x-deadline - timestamp, x-request-timeout - секунды от отправки),
+хранится в contextvar и ограничивает таймауты всех вызовов по пути:
+RPC за токенами, запросы к amoCRM, ожидание лимитера и повторов.
+Работа, которая заведомо не успеет, не начинается (DeadlineExceeded).
+"""
+
+import contextvars
+import time
+from contextlib import contextmanager
+from typing import Iterator, Mapping, Optional
+
+from fastapi import HTTPException
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+
+DEADLINE_HEADER = "x-deadline"
+TIMEOUT_HEADER = "x-request-timeout"
+
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar(
+    "deadline", default=None
+)
+
+
+class DeadlineExceeded(HTTPException):
+    """Дедлайн запроса истек: продолжать работу бессмысленно"""
+
+    def __init__(self, detail: str = "Deadline exceeded"):
+        super().__init__(status_code=504, detail=detail)
+
+
+def get_deadline() -> Optional[float]:
+    return _deadline.get()
+
+
+def remaining() -> Optional[float]:
+    """Сколько секунд осталось до дедлайна (None - дедлайна нет)"""
+
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return max(deadline - time.time(), 0.0)
+
+
+def expired() -> bool:
+    left = remaining()
+    return left is not None and left <= 0
+
+
+def check_deadline(what: str = "request") -> None:
+    """DeadlineExceeded, если дедлайн уже прошел"""
+
+    if expired():
+        raise DeadlineExceeded(f"Deadline exceeded before {what}")
+
+
+def timeout_for(default: Optional[float]) -> Optional[float]:
+    """Таймаут вызова: default, но не дольше остатка до дедлайна"""
+
+    left = remaining()
+    if left is None:
+        return default
+    if left <= 0:
+        raise DeadlineExceeded()
+    return left if default is None else min(default, left)
+
+
+@contextmanager
+def deadline_scope(deadline: Optional[float]) -> Iterator[Optional[float]]:
+    """Дедлайн на время блока; вложенный дедлайн не может быть позже внешнего"""
+
+    current = _deadline.get()
+    if deadline is None or (current is not None and current < deadline):
+        deadline = current
+
+    token = _deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _deadline.reset(token)
+
+
+def detached_context() -> contextvars.Context:
+    """
+    Копия контекста без дедлайна.
+
+    Для фоновых задач, которые запускаются из запроса, но живут дольше
+    него (общий RPC за токенами, микробатчи вебхуков).
+    """
+
+    context = contextvars.copy_context()
+    context.run(_deadline.set, None)
+    return context
+
+
+def deadline_from_headers(
+    headers: Optional[Mapping], sent_at: Optional[float] = None
+) -> Optional[float]:
+    """
+    Дедлайн из заголовков: x-deadline (timestamp) или x-request-timeout
+    (секунды от sent_at, по умолчанию - от текущего момента).
+    """
+
+    if not headers:
+        return None
+
+    deadline = _parse_float(headers.get(DEADLINE_HEADER))
+    if deadline is not None:
+        return deadline
+
+    timeout = _parse_float(headers.get(TIMEOUT_HEADER))
+    if timeout is not None:
+        return (time.time() if sent_at is None else sent_at) + timeout
+    return None
+
+
+def deadline_headers() -> dict:
+    """Заголовок для исходящего сообщения, если у текущей работы есть дедлайн"""
+
+    deadline = _deadline.get()
+    return {} if deadline is None else {DEADLINE_HEADER: deadline}
+
+
+def _parse_float(value) -> Optional[float]:
+    if value is None:
+        return None
+    if isinstance(value, bytes):
+        value = value.decode()
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class DeadlineMiddleware:
+    """
+    ASGI middleware: дедлайн HTTP-запроса из заголовков X-Deadline /
+    X-Request-Timeout, иначе default_timeout секунд (0 - без дедлайна).
+    Запрос с уже истекшим дедлайном сразу получает 504.
+    """
+
+    def __init__(self, app, default_timeout: float = 0):
+        self.app = app
+        self.default_timeout = default_timeout
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        deadline = deadline_from_headers(Headers(scope=scope))
+        if deadline is None and self.default_timeout > 0:
+            deadline = time.time() + self.default_timeout
+
+        if deadline is not None and deadline <= time.time():
+            response = JSONResponse(
+                {"detail": "Deadline exceeded before request"}, status_code=504
+            )
+            await response(scope, receive, send)
+            return
+
+        with deadline_scope(deadline):
+            await self.app(scope, receive, send)
@@ -1,36 +1,173 @@
+import json
+import os
+import threading
+import urllib.error
+import urllib.request
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
 from loguru import logger
-from elasticsearch import AsyncElasticsearch
-import asyncio
 
-ELASTICSEARCH_HOST = "http://91.197.98.62:9200"
-es_client = AsyncElasticsearch([ELASTICSEARCH_HOST])
+from src.common.config import (
+    ELASTICSEARCH_HOST,
+    ELASTICSEARCH_INDEX,
+    LOG_BATCH_SIZE,
+    LOG_FALLBACK_PATH,
+    LOG_FLUSH_INTERVAL,
+    LOG_QUEUE_SIZE,
+)
+
+WARNING_LEVEL_NO = 30
 
 
-async def elasticsearch_handler(message):
+class ElasticsearchBulkSink:
     """
-    Асинхронный обработчик для отправки логов в Elasticsearch.
+    Буферизованная отправка логов в Elasticsearch через _bulk API.
+
+    Запись в sink только кладет документ в ограниченную очередь, отправка
+    идет в отдельном потоке пачками по размеру или по интервалу. При
+    переполнении вытесняются самые старые записи, а когда очередь заполнена
+    больше чем на high_watermark, записи ниже WARNING сэмплируются.
+    Пачки, которые не удалось отправить, пишутся в локальный файл.
     """
-    log_record = message.record
-    log_data = {
-        "@timestamp": log_record["time"].isoformat(),
-        "log.level": log_record["level"].name,
-        "message": log_record["message"],
-        "module": log_record["module"],
-        "function": log_record["function"],
-        "line": log_record["line"],
-    }
-    try:
-        # Асинхронная отправка данных в Elasticsearch
-        await es_client.index(index="allocations-logs", document=log_data)
-    except Exception as e:
-        print(f"Error sending log to Elasticsearch: {e}")
+
+    def __init__(
+        self,
+        host: str = ELASTICSEARCH_HOST,
+        index: str = ELASTICSEARCH_INDEX,
+        batch_size: int = LOG_BATCH_SIZE,
+        flush_interval: float = LOG_FLUSH_INTERVAL,
+        max_queue: int = LOG_QUEUE_SIZE,
+        fallback_path: Optional[str] = LOG_FALLBACK_PATH,
+        high_watermark: float = 0.8,
+        sample_rate: int = 10,
+        timeout: float = 5,
+    ):
+        self.url = host.rstrip("/") + "/_bulk"
+        self.index = index
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fallback_path = fallback_path
+        self.high_watermark = int(max_queue * high_watermark)
+        self.sample_rate = sample_rate
+        self.timeout = timeout
+
+        self._queue: Deque[Dict] = deque(maxlen=max_queue)
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._sampled = 0
+
+        self.sent = 0
+        self.dropped = 0
+        self.failed = 0
+
+        self._thread = threading.Thread(
+            target=self._run, name="elasticsearch-log-sink", daemon=True
+        )
+        self._thread.start()
+
+    def write(self, message) -> None:
+        log_record = message.record
+
+        if (
+            len(self._queue) >= self.high_watermark
+            and log_record["level"].no < WARNING_LEVEL_NO
+        ):
+            self._sampled += 1
+            if self._sampled % self.sample_rate:
+                self.dropped += 1
+                return
+
+        if len(self._queue) == self._queue.maxlen:
+            self.dropped += 1
+
+        self._queue.append(
+            {
+                "@timestamp": log_record["time"].isoformat(),
+                "log.level": log_record["level"].name,
+                "message": log_record["message"],
+                "module": log_record["module"],
+                "function": log_record["function"],
+                "line": log_record["line"],
+            }
+        )
+        if len(self._queue) >= self.batch_size:
+            self._wakeup.set()
+
+    def stop(self) -> None:
+        """Отправка остатка и остановка потока (вызывается loguru при удалении sink)"""
+
+        self._stopped.set()
+        self._wakeup.set()
+        self._thread.join(timeout=self.timeout * 2)
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self._flush()
+        self._flush()
+
+    def _flush(self) -> None:
+        while self._queue:
+            batch = []
+            while self._queue and len(batch) < self.batch_size:
+                batch.append(self._queue.popleft())
+            self._send(batch)
+
+    def _send(self, batch: List[Dict]) -> None:
+        action = json.dumps({"index": {"_index": self.index}})
+        payload = "".join(
+            f"{action}\n{json.dumps(doc, ensure_ascii=False, default=str)}\n"
+            for doc in batch
+        ).encode("utf-8")
+
+        request = urllib.request.Request(
+            self.url,
+            data=payload,
+            headers={"Content-Type": "application/x-ndjson"},
+            method="POST",
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                result = json.loads(response.read() or b"{}")
+            if result.get("errors"):
+                failed = [
+                    doc
+                    for doc, item in zip(batch, result.get("items", []))
+                    if item.get("index", {}).get("error")
+                ]
+                self.sent += len(batch) - len(failed)
+                self._fallback(failed, "bulk item errors")
+            else:
+                self.sent += len(batch)
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            self._fallback(batch, repr(e))
+
+    def _fallback(self, batch: List[Dict], reason: str) -> None:
+        if not batch:
+            return
+
+        self.failed += len(batch)
+        if not self.fallback_path:
+            return
+
+        try:
+            directory = os.path.dirname(self.fallback_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.fallback_path, "a", encoding="utf-8") as file:
+                for doc in batch:
+                    file.write(json.dumps(doc, ensure_ascii=False, default=str) + "\n")
+        except OSError as e:
+            print(f"Error writing log fallback ({reason}): {e}")
 
 
 def setup_logging():
     """
-    Установка асинхронного обработчика loguru для Elasticsearch.
+    Установка буферизованного обработчика loguru для Elasticsearch.
     """
     logger.remove()
 
-    logger.add(elasticsearch_handler, level="INFO", enqueue=True)
+    logger.add(ElasticsearchBulkSink(), level="INFO")
     logger.info("Logging setup complete.")
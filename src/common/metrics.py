@@ -0,0 +1,96 @@
+import re
+import time
+from typing import Optional
+
+from prometheus_client import Counter, Gauge, Histogram
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+_ID_RE = re.compile(r"/\d+(?=/|$)")
+
+AMO_REQUEST_LATENCY = Histogram(
+    "amocrm_request_duration_seconds",
+    "Длительность одной попытки запроса к amoCRM",
+    ["method", "endpoint"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30),
+)
+AMO_RESPONSES = Counter(
+    "amocrm_responses_total",
+    "Ответы amoCRM по статусам (error - сетевая ошибка)",
+    ["method", "endpoint", "status"],
+)
+AMO_RATE_LIMITED = Counter(
+    "amocrm_rate_limited_total",
+    "Ответы amoCRM 429 Too Many Requests",
+    ["endpoint"],
+)
+AMO_BREAKER_OPENED = Counter(
+    "amocrm_circuit_breaker_opened_total",
+    "Размыкания circuit breaker аккаунтов amoCRM",
+)
+AMO_BREAKER_REJECTED = Counter(
+    "amocrm_circuit_breaker_rejected_total",
+    "Запросы, отклоненные разомкнутым circuit breaker без обращения к amoCRM",
+)
+
+RMQ_QUEUE_WAIT = Histogram(
+    "rmq_message_queue_wait_seconds",
+    "Время от публикации сообщения до начала обработки",
+    ["queue"],
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300),
+)
+RMQ_HANDLING_TIME = Histogram(
+    "rmq_message_handling_seconds",
+    "Время обработки сообщения",
+    ["queue"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300),
+)
+RMQ_MESSAGES = Counter(
+    "rmq_messages_total",
+    "Обработанные сообщения по результату",
+    ["queue", "outcome"],
+)
+
+RPC_DURATION = Histogram(
+    "rpc_request_duration_seconds",
+    "Время RPC-запроса до получения ответа",
+    ["routing_key", "outcome"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+
+DB_POOL_CHECKED_OUT = Gauge(
+    "db_pool_checked_out_connections", "Соединения, выданные из пула"
+)
+DB_POOL_OVERFLOW = Gauge(
+    "db_pool_overflow_connections", "Соединения сверх pool_size (max_overflow)"
+)
+DB_POOL_CHECKOUTS = Counter("db_pool_checkouts_total", "Выдачи соединений из пула")
+
+
+def amo_endpoint(path: str) -> str:
+    """Путь запроса без id, чтобы метки не разрастались: /api/v4/leads/{id}"""
+
+    return _ID_RE.sub("/{id}", path)
+
+
+def observe_queue_wait(queue: str, timestamp: Optional[object]) -> None:
+    """Учитывает ожидание в очереди, если издатель проставил timestamp"""
+
+    if timestamp is None:
+        return
+    published_at = (
+        timestamp.timestamp() if hasattr(timestamp, "timestamp") else timestamp
+    )
+    RMQ_QUEUE_WAIT.labels(queue).observe(max(time.time() - published_at, 0.0))
+
+
+def instrument_pool(engine: AsyncEngine) -> None:
+    """Метрики пула соединений SQLAlchemy"""
+
+    pool = engine.sync_engine.pool
+    DB_POOL_CHECKED_OUT.set_function(pool.checkedout)
+    DB_POOL_OVERFLOW.set_function(lambda: max(pool.overflow(), 0))
+
+    @event.listens_for(engine.sync_engine, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        DB_POOL_CHECKOUTS.inc()
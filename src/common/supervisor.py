@@ -0,0 +1,164 @@
+"""
+Супервизор процессов-воркеров.
+
+Запускает N дочерних процессов через fork и перезапускает упавшие.
+Родитель импортирует только стандартную библиотеку и loguru и не
+запускает потоков: форк процесса с потоками (логи, пулы соединений)
+небезопасен, поэтому все тяжелое создается уже в дочернем процессе.
+Воркер, упавший вскоре после старта, перезапускается с растущей
+задержкой, чтобы ошибка конфигурации не превращалась в цикл форков.
+"""
+
+import multiprocessing
+import os
+import signal
+import time
+from multiprocessing.connection import wait
+from typing import Callable, Dict, Optional
+
+from loguru import logger
+
+from src.common.config import (
+    WORKER_MAX_RESTART_DELAY,
+    WORKER_MIN_UPTIME,
+    WORKER_RESTART_DELAY,
+    WORKER_STOP_TIMEOUT,
+)
+
+
+class Supervisor:
+    """
+    target(index) выполняется в каждом из workers процессов.
+
+    SIGTERM/SIGINT родителю пересылается воркерам (они дорабатывают
+    текущие сообщения), через stop_timeout оставшиеся убиваются SIGKILL.
+    """
+
+    def __init__(
+        self,
+        target: Callable[[int], None],
+        workers: int,
+        restart_delay: float = WORKER_RESTART_DELAY,
+        max_restart_delay: float = WORKER_MAX_RESTART_DELAY,
+        min_uptime: float = WORKER_MIN_UPTIME,
+        stop_timeout: float = WORKER_STOP_TIMEOUT,
+    ):
+        self.target = target
+        self.workers = workers
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.min_uptime = min_uptime
+        self.stop_timeout = stop_timeout
+
+        self._context = multiprocessing.get_context("fork")
+        self._processes: Dict[int, multiprocessing.Process] = {}
+        self._started_at: Dict[int, float] = {}
+        self._failures: Dict[int, int] = {}
+        self._restart_at: Dict[int, float] = {}
+        self._stopping = False
+
+    def run(self) -> None:
+        """Блокирующий цикл: запуск, перезапуск и остановка воркеров"""
+
+        previous = {
+            sig: signal.signal(sig, self._on_signal)
+            for sig in (signal.SIGTERM, signal.SIGINT)
+        }
+        try:
+            for index in range(self.workers):
+                self._spawn(index)
+            logger.info(f"Supervisor {os.getpid()} started {self.workers} workers")
+
+            while not self._stopping:
+                self._restart_due()
+                sentinels = [process.sentinel for process in self._processes.values()]
+                # Ожидание с таймаутом: сигнал и перезапуски по расписанию
+                # проверяются хотя бы раз в секунду
+                wait(sentinels, timeout=self._wait_timeout())
+                self._reap()
+        finally:
+            self._stop()
+            for sig, handler in previous.items():
+                signal.signal(sig, handler)
+
+    def _on_signal(self, signum, frame) -> None:
+        # Без логирования: обработчик может прервать запись лога под локом
+        self._stopping = True
+
+    def _spawn(self, index: int) -> None:
+        process = self._context.Process(
+            target=_run_child, args=(self.target, index), name=f"worker-{index}"
+        )
+        process.start()
+        self._processes[index] = process
+        self._started_at[index] = time.monotonic()
+        logger.info(f"Started worker {index} (pid {process.pid})")
+
+    def _reap(self) -> None:
+        """Упавшие воркеры планируются на перезапуск"""
+
+        now = time.monotonic()
+        for index, process in list(self._processes.items()):
+            if process.is_alive():
+                continue
+
+            process.join()
+            del self._processes[index]
+            if self._stopping:
+                continue
+
+            # Воркер проработал дольше min_uptime: задержка начинается заново
+            if now - self._started_at[index] >= self.min_uptime:
+                self._failures[index] = 0
+            failures = self._failures.get(index, 0)
+            delay = min(self.restart_delay * 2**failures, self.max_restart_delay)
+            self._failures[index] = failures + 1
+            self._restart_at[index] = now + delay
+            logger.error(
+                f"Worker {index} (pid {process.pid}) exited with code "
+                f"{process.exitcode}, restart in {delay:.1f}s"
+            )
+
+    def _restart_due(self) -> None:
+        now = time.monotonic()
+        for index, restart_at in list(self._restart_at.items()):
+            if restart_at <= now:
+                del self._restart_at[index]
+                self._spawn(index)
+
+    def _wait_timeout(self) -> float:
+        timeout = 1.0
+        if self._restart_at:
+            timeout = min(timeout, min(self._restart_at.values()) - time.monotonic())
+        return max(timeout, 0.0)
+
+    def _stop(self) -> None:
+        logger.info(f"Stopping {len(self._processes)} workers")
+        self._stopping = True
+        self._restart_at.clear()
+        for process in self._processes.values():
+            if process.is_alive():
+                process.terminate()
+
+        deadline = time.monotonic() + self.stop_timeout
+        for index, process in self._processes.items():
+            process.join(max(deadline - time.monotonic(), 0))
+            if process.is_alive():
+                logger.warning(f"Worker {index} did not stop in time, killing")
+                process.kill()
+                process.join()
+        self._processes.clear()
+        logger.info("Supervisor stopped")
+
+
+def _run_child(target: Callable[[int], None], index: int) -> None:
+    # Обработчики сигналов родителя воркеру не нужны: свои он ставит сам
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    target(index)
+
+
+def default_workers(workers: Optional[int] = None) -> int:
+    """Число воркеров: workers, а при 0/None - по одному на ядро"""
+
+    return workers or os.cpu_count() or 1
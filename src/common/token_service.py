@@ -1,21 +1,116 @@
-from src.common.config import CLIENT_ID
+import asyncio
+import time
+from typing import Dict, Optional, Tuple
+
+import jwt
+from src.common.config import CLIENT_ID, TOKEN_DEFAULT_TTL, TOKEN_REFRESH_MARGIN
+from src.common.deadline import DeadlineExceeded, detached_context, timeout_for
 from src.rabbitmq.rpc_consumer import send_rpc_request_and_wait_for_reply
 from loguru import logger
 from fastapi import HTTPException
 
 
-async def get_tokens_from_service(subdomain: str) -> dict:
-    """Получение токенов через RabbitMQ."""
-    try:
-        # Отправляем RPC запрос и ждем ответа
+class TokenCache:
+    """
+    Кеш токенов по subdomain.
+
+    Токен живет до exp из JWT. За refresh_margin секунд до истечения
+    запускается фоновое обновление, а параллельные промахи по одному
+    subdomain ждут один общий RPC-запрос.
+    """
+
+    def __init__(
+        self,
+        refresh_margin: float = TOKEN_REFRESH_MARGIN,
+        default_ttl: float = TOKEN_DEFAULT_TTL,
+    ):
+        self.refresh_margin = refresh_margin
+        self.default_ttl = default_ttl
+        self._tokens: Dict[str, Tuple[dict, float]] = {}
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+    async def get(self, subdomain: str) -> dict:
+        cached = self._tokens.get(subdomain)
+        now = time.time()
+
+        if cached is not None:
+            tokens, expires_at = cached
+            if now < expires_at:
+                if now >= expires_at - self.refresh_margin:
+                    self._refresh(subdomain)
+                return tokens
+
+        # Общий RPC живет без дедлайна вызвавшего: его ждут и другие запросы
+        try:
+            return await asyncio.wait_for(
+                asyncio.shield(self._refresh(subdomain)), timeout_for(None)
+            )
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded(f"Deadline exceeded waiting for {subdomain} tokens")
+
+    def invalidate(self, subdomain: str) -> None:
+        self._tokens.pop(subdomain, None)
+
+    def _refresh(self, subdomain: str) -> asyncio.Task:
+        task = self._inflight.get(subdomain)
+        if task is None:
+            task = asyncio.create_task(
+                self._fetch(subdomain), context=detached_context()
+            )
+            self._inflight[subdomain] = task
+            task.add_done_callback(lambda done: self._on_refreshed(subdomain, done))
+        return task
+
+    def _on_refreshed(self, subdomain: str, task: asyncio.Task) -> None:
+        self._inflight.pop(subdomain, None)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(
+                f"Token refresh for {subdomain} failed: {task.exception()!r}"
+            )
+
+    async def _fetch(self, subdomain: str) -> dict:
         tokens = await send_rpc_request_and_wait_for_reply(
             subdomain=subdomain, client_id=CLIENT_ID
         )
         if not tokens["access_token"] or not tokens["refresh_token"]:
             logger.error(f"Invalid tokens received: {tokens}")
             raise HTTPException(status_code=500, detail="Invalid tokens received")
+
+        expires_at = _get_expiration(tokens["access_token"])
+        if expires_at is None:
+            expires_at = time.time() + self.default_ttl
+
+        self._tokens[subdomain] = (tokens, expires_at)
         return tokens
 
+
+def _get_expiration(access_token: str) -> Optional[float]:
+    """exp из JWT без проверки подписи (токен проверяет сам amoCRM)"""
+
+    try:
+        payload = jwt.decode(access_token, options={"verify_signature": False})
+    except jwt.PyJWTError:
+        return None
+
+    exp = payload.get("exp")
+    return float(exp) if exp else None
+
+
+token_cache = TokenCache()
+
+
+async def get_tokens_from_service(subdomain: str) -> dict:
+    """Получение токенов через RabbitMQ (с кешем до истечения токена)."""
+    try:
+        return await token_cache.get(subdomain)
+
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         logger.exception(f"Error during token retrieval: {e}")
         raise HTTPException(status_code=500, detail="Error during token retrieval")
+
+
+def invalidate_tokens(subdomain: str) -> None:
+    """Сброс закешированных токенов (например, после 401 от amoCRM)."""
+    token_cache.invalidate(subdomain)
@@ -0,0 +1,270 @@
+import re
+from typing import (
+    Dict,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+from zlib import crc32
+
+from src.common.config import FUZZY_MAX_NAME_FREQUENCY, FUZZY_MAX_NAME_SHARE
+from src.dublicate_widget.utils import UnionFind
+
+DEFAULT_THRESHOLD = 0.6
+DEFAULT_NUM_PERM = 24
+DEFAULT_BANDS = 8
+SHINGLE_SIZE = 3
+MAX_BUCKET_SIZE = 200
+# Ниже этого числа сущностей название не считается частым при любой доле
+MIN_FREQUENCY_LIMIT = 5
+
+_MAX_HASH = 0xFFFFFFFF
+
+LEGAL_FORMS = {
+    "ооо",
+    "оао",
+    "зао",
+    "пао",
+    "ао",
+    "нао",
+    "ип",
+    "чп",
+    "тоо",
+    "нко",
+    "ано",
+    "гуп",
+    "муп",
+    "фгуп",
+    "llc",
+    "ltd",
+    "inc",
+    "corp",
+    "gmbh",
+    "co",
+}
+
+_NOT_WORD = re.compile(r"[^\w]+")
+_DEFAULT_NAMES = re.compile(
+    r"^(сделка|контакт|компания|lead|contact|company)\s*#?\s*\d*$"
+)
+
+
+def normalize_name(value: Optional[str]) -> Optional[str]:
+    """
+    Нормализация названия для нечеткого сравнения.
+
+    Убираются регистр, пунктуация, кавычки и организационно-правовые формы,
+    слова сортируются: "ООО «Ромашка»" и "Ромашка ООО" дают "ромашка".
+    Автоматические названия вида "Сделка #123" отбрасываются.
+    """
+
+    if not value:
+        return None
+
+    text = str(value).lower().replace("ё", "е")
+    if _DEFAULT_NAMES.match(text.strip()):
+        return None
+
+    words = [
+        word
+        for word in _NOT_WORD.sub(" ", text).replace("_", " ").split()
+        if word not in LEGAL_FORMS
+    ]
+    if not words:
+        return None
+
+    return " ".join(sorted(words))
+
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> Set[str]:
+    """Символьные n-граммы строки (с границами слов)"""
+
+    padded = f" {text} "
+    if len(padded) <= size:
+        return {padded}
+    return {padded[i : i + size] for i in range(len(padded) - size + 1)}
+
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    if not a or not b:
+        return 0.0
+    intersection = len(a & b)
+    return intersection / (len(a) + len(b) - intersection)
+
+
+def minhash_signature(
+    text: str, num_perm: int = DEFAULT_NUM_PERM, size: int = SHINGLE_SIZE
+) -> List[int]:
+    """
+    MinHash-подпись по шинглам строки с одной перестановкой (one permutation hashing).
+
+    Каждый шингл хешируется один раз и попадает в одну из num_perm корзин,
+    в корзине хранится минимум, поэтому подпись стоит O(числа шинглов),
+    а не O(шинглов * num_perm). Пустые корзины заполняются от ближайшей
+    непустой справа (densification). Строка кодируется в UTF-32 один раз,
+    шинглы берутся срезами байт фиксированной ширины.
+    """
+
+    data = f" {text} ".encode("utf-32-le")
+    width = size * 4
+    bins = [_MAX_HASH] * num_perm
+    for i in range(0, max(len(data) - width, 0) + 1, 4):
+        value = crc32(data[i : i + width])
+        index = value % num_perm
+        if value < bins[index]:
+            bins[index] = value
+
+    if _MAX_HASH in bins:
+        start = next((i for i, value in enumerate(bins) if value != _MAX_HASH), None)
+        if start is None:
+            return bins
+
+        source, distance = bins[start], 0
+        for i in range(start - 1, start - num_perm, -1):
+            value = bins[i]
+            if value == _MAX_HASH:
+                distance += 1
+                bins[i] = (source + distance * 0x9E3779B1) & _MAX_HASH
+            else:
+                source, distance = value, 0
+
+    return bins
+
+
+class FuzzyMatcher:
+    """
+    Нечеткий поиск похожих названий через MinHash и LSH-бандинг.
+
+    Кандидаты - названия, совпавшие хотя бы в одной полосе подписи,
+    поэтому работа субквадратична. Кандидаты проверяются точным
+    коэффициентом Жаккара по шинглам и отсекаются по порогу.
+    Одинаковые после нормализации названия обрабатываются один раз.
+
+    Частые названия (как стоп-слова по document frequency) в кластеры
+    не попадают: название или кластер больше frequency_limit сущностей -
+    шаблон вроде "Заявка с сайта" или "Заявка с сайта 123", а не дубль.
+    """
+
+    def __init__(
+        self,
+        threshold: float = DEFAULT_THRESHOLD,
+        num_perm: int = DEFAULT_NUM_PERM,
+        bands: int = DEFAULT_BANDS,
+        shingle_size: int = SHINGLE_SIZE,
+        max_bucket_size: int = MAX_BUCKET_SIZE,
+        max_frequency: int = FUZZY_MAX_NAME_FREQUENCY,
+        max_share: float = FUZZY_MAX_NAME_SHARE,
+    ):
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.shingle_size = shingle_size
+        self.max_bucket_size = max_bucket_size
+        self.max_frequency = max_frequency
+        self.max_share = max_share
+
+        self._names: Dict[str, List[Hashable]] = {}
+
+    def __len__(self) -> int:
+        return sum(len(entity_ids) for entity_ids in self._names.values())
+
+    @property
+    def frequency_limit(self) -> int:
+        """Наибольшее число сущностей с одним названием или в одном кластере"""
+
+        share_limit = max(int(self.max_share * len(self)), MIN_FREQUENCY_LIMIT)
+        return min(self.max_frequency, share_limit)
+
+    def add(self, entity_id: Hashable, name: Optional[str]) -> None:
+        normalized = normalize_name(name)
+        if normalized:
+            self._names.setdefault(normalized, []).append(entity_id)
+
+    def candidate_pairs(
+        self, names: Optional[Iterable[str]] = None
+    ) -> Iterator[Tuple[str, str]]:
+        """
+        Пары различных нормализованных названий из общих LSH-корзин
+        (всех названий или только names).
+
+        Полоса составляется из корзин через шаг bands (band, band + bands, ...),
+        а не из соседних: соседние пустые корзины заполнены от одного шингла
+        и дали бы ложные совпадения полос.
+        """
+
+        buckets: Dict[Tuple[int, ...], Union[str, List[str]]] = {}
+        bands = self.bands
+
+        for name in self._names if names is None else names:
+            signature = minhash_signature(name, self.num_perm, self.shingle_size)
+            for band in range(bands):
+                key = (band, *signature[band::bands])
+                bucket = buckets.get(key)
+                # Одиночная корзина хранит строку, список заводится при коллизии
+                if bucket is None:
+                    buckets[key] = name
+                elif isinstance(bucket, str):
+                    buckets[key] = [bucket, name]
+                elif len(bucket) < self.max_bucket_size:
+                    bucket.append(name)
+
+        seen: Set[Tuple[str, str]] = set()
+        for bucket in buckets.values():
+            if isinstance(bucket, str):
+                continue
+            for i, first in enumerate(bucket):
+                for second in bucket[i + 1 :]:
+                    pair = (first, second) if first < second else (second, first)
+                    if pair not in seen:
+                        seen.add(pair)
+                        yield pair
+
+    def matches(
+        self, names: Optional[Iterable[str]] = None
+    ) -> Iterator[Tuple[str, str, float]]:
+        """Пары названий со сходством не ниже порога"""
+
+        shingle_cache: Dict[str, Set[str]] = {}
+
+        def get_shingles(name: str) -> Set[str]:
+            cached = shingle_cache.get(name)
+            if cached is None:
+                cached = shingle_cache[name] = shingles(name, self.shingle_size)
+            return cached
+
+        for first, second in self.candidate_pairs(names):
+            score = jaccard(get_shingles(first), get_shingles(second))
+            if score >= self.threshold:
+                yield first, second, score
+
+    def clusters(self) -> List[List[Hashable]]:
+        """Группы сущностей с совпадающими или похожими названиями"""
+
+        limit = self.frequency_limit
+        names = [
+            name for name, entity_ids in self._names.items() if len(entity_ids) <= limit
+        ]
+
+        union_find = UnionFind()
+        for name in names:
+            union_find.add(name)
+        for first, second, _ in self.matches(names):
+            union_find.union(first, second)
+
+        grouped: Dict[Hashable, List[Hashable]] = {}
+        for name in names:
+            grouped.setdefault(union_find.find(name), []).extend(self._names[name])
+
+        return [
+            entity_ids
+            for entity_ids in grouped.values()
+            if 1 < len(entity_ids) <= limit
+        ]
@@ -0,0 +1,88 @@
+"""
+Обработчики сообщений очереди воркера.
+
+Сообщение - JSON с полем action и полями схемы соответствующего
+эндпоинта: {"action": "get", "subdomain": ..., "pipeline_id": ...}.
+Результат уходит ответом в reply_to (см. process_message).
+"""
+
+from typing import Any, Awaitable, Callable, Dict
+
+from fastapi import HTTPException
+from pydantic import ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.amocrm.client import amo_client
+from src.amocrm.services import build_headers
+from src.common.token_service import get_tokens_from_service
+from src.dublicate_widget.schemas import CreateDuplicateSchema, GetDuplicateSchema
+from src.dublicate_widget.services import duplicate_leads, merge_duplicate_groups
+from src.mirror.repository import get_sync_state
+
+
+async def get_duplicates(data: Dict[str, Any], session: AsyncSession) -> list:
+    """Поиск дублей, как GET /duplicate_leads/get"""
+
+    params = GetDuplicateSchema.model_validate(data)
+    headers = None
+    if params.source == "mirror":
+        if "leads" not in await get_sync_state(session, params.subdomain):
+            raise HTTPException(
+                status_code=409, detail="amoCRM mirror is not synced yet"
+            )
+    else:
+        tokens = await get_tokens_from_service(params.subdomain)
+        headers = build_headers(tokens["access_token"])
+
+    return await duplicate_leads(
+        amo_client,
+        params.subdomain,
+        headers,
+        params.pipeline_id,
+        session=session if params.source == "mirror" else None,
+        statuses_ids=params.statuses_ids,
+        responsible_user_id=params.responsible_user_id,
+        custom_field_ids=params.custom_field_ids,
+        fuzzy=params.fuzzy,
+        fuzzy_threshold=params.fuzzy_threshold,
+    )
+
+
+async def merge_duplicates(data: Dict[str, Any], session: AsyncSession) -> dict:
+    """Склейка групп дублей, как POST /duplicate_leads/post"""
+
+    params = CreateDuplicateSchema.model_validate(data)
+    tokens = await get_tokens_from_service(params.subdomain)
+    headers = build_headers(tokens["access_token"])
+
+    results = await merge_duplicate_groups(
+        amo_client,
+        params.subdomain,
+        headers,
+        [group.model_dump() for group in params.groups],
+        close_status_id=params.close_status_id,
+    )
+    failed = sum(1 for result in results if result["status"] == "failed")
+    return {"merged": len(results) - failed, "failed": failed, "groups": results}
+
+
+HANDLERS: Dict[str, Callable[[Dict[str, Any], AsyncSession], Awaitable[Any]]] = {
+    "get": get_duplicates,
+    "post": merge_duplicates,
+}
+
+
+async def handle_message(data: Dict[str, Any], session: AsyncSession) -> Any:
+    """process_func для start_consumer: выбор обработчика по action"""
+
+    handler = HANDLERS.get(data.get("action"))
+    if handler is None:
+        raise HTTPException(
+            status_code=400, detail=f"Unknown action: {data.get('action')}"
+        )
+
+    try:
+        return await handler(data, session)
+    except ValidationError as e:
+        # Повтор не исправит неверное сообщение: 4xx уходит сразу в DLQ
+        raise HTTPException(status_code=422, detail=str(e))
@@ -0,0 +1,330 @@
+"""
+Компактный индекс ключей совпадения воронки и его снимок на диске.
+
+Ключ (вид, значение) интернируется в целочисленный id. Для каждого
+ключа хранится id сделки (int), пока сделка одна, и array('q') - когда
+их несколько. Ключи сделки - array('i') id ключей. Снимок - плоские
+массивы int64 и отсортированный блок ключей. Файл открывается через
+mmap без разбора, поиск ключа - бинарный поиск по отсортированным ключам.
+"""
+
+import mmap
+import os
+import struct
+from array import array
+from bisect import bisect_left
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+from src.dublicate_widget.utils import MatchKey
+
+MAGIC = b"DUPIDX01"
+# magic, high_water_mark, fingerprint, ключей, id в блоках, сделок, ключей сделок, байт ключей
+HEADER = struct.Struct("<8sqqqqqqq")
+KEY_SEPARATOR = b"\x1f"
+ALIGN = 8
+
+Posting = Union[int, array]
+
+
+def encode_key(key: MatchKey) -> bytes:
+    # bytes в UTF-8 компактнее str, особенно для кириллицы
+    return key[0].encode("utf-8") + KEY_SEPARATOR + key[1].encode("utf-8")
+
+
+def decode_key(encoded: bytes) -> MatchKey:
+    kind, _, value = encoded.partition(KEY_SEPARATOR)
+    return kind.decode("utf-8"), value.decode("utf-8")
+
+
+class CompactKeyIndex:
+    """Индекс ключ -> сделки и сделка -> ключи на целочисленных массивах"""
+
+    def __init__(self):
+        self._key_ids: Dict[bytes, int] = {}
+        self._keys: List[bytes] = []
+        self._postings: List[Optional[Posting]] = []
+        self._lead_keys: Dict[int, array] = {}
+        self.created_at: Dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._lead_keys)
+
+    def __contains__(self, lead_id: int) -> bool:
+        return lead_id in self._lead_keys
+
+    def _intern(self, key: MatchKey) -> int:
+        encoded = encode_key(key)
+        key_id = self._key_ids.get(encoded)
+        if key_id is None:
+            key_id = self._key_ids[encoded] = len(self._keys)
+            self._keys.append(encoded)
+            self._postings.append(None)
+        return key_id
+
+    def _leads(self, key_id: int) -> Iterable[int]:
+        posting = self._postings[key_id]
+        if posting is None:
+            return ()
+        if isinstance(posting, int):
+            return (posting,)
+        return posting
+
+    def set(self, lead_id: int, keys: Iterable[MatchKey], created_at: int = 0) -> None:
+        """Заменяет ключи сделки"""
+
+        self.discard(lead_id)
+        key_ids = array("i", sorted({self._intern(key) for key in keys}))
+        for key_id in key_ids:
+            posting = self._postings[key_id]
+            if posting is None:
+                self._postings[key_id] = lead_id
+            elif isinstance(posting, int):
+                self._postings[key_id] = array("q", (posting, lead_id))
+            else:
+                posting.append(lead_id)
+        self._lead_keys[lead_id] = key_ids
+        self.created_at[lead_id] = created_at
+
+    def discard(self, lead_id: int) -> Set[int]:
+        """Убирает сделку. Возвращает сделки, с которыми у нее были общие ключи"""
+
+        key_ids = self._lead_keys.pop(lead_id, None)
+        if key_ids is None:
+            return set()
+        self.created_at.pop(lead_id, None)
+
+        neighbours: Set[int] = set()
+        for key_id in key_ids:
+            posting = self._postings[key_id]
+            if isinstance(posting, int):
+                self._postings[key_id] = None
+                continue
+            posting.remove(lead_id)
+            neighbours.update(posting)
+            if len(posting) == 1:
+                self._postings[key_id] = posting[0]
+        return neighbours
+
+    def keys_of(self, lead_id: int) -> List[MatchKey]:
+        return [
+            decode_key(self._keys[key_id])
+            for key_id in self._lead_keys.get(lead_id, ())
+        ]
+
+    def candidates(self, keys: Iterable[MatchKey]) -> Set[int]:
+        """Сделки, у которых есть хотя бы один из ключей"""
+
+        found: Set[int] = set()
+        for key in keys:
+            key_id = self._key_ids.get(encode_key(key))
+            if key_id is not None:
+                found.update(self._leads(key_id))
+        return found
+
+    def neighbours(self, lead_id: int) -> Set[int]:
+        """Сделки с общими ключами (без самой сделки)"""
+
+        found: Set[int] = set()
+        for key_id in self._lead_keys.get(lead_id, ()):
+            found.update(self._leads(key_id))
+        found.discard(lead_id)
+        return found
+
+    def blocks(self) -> Iterator[Tuple[MatchKey, List[int]]]:
+        """Блоки, в которых больше одной сделки (как DuplicateIndex.blocks)"""
+
+        for key_id, posting in enumerate(self._postings):
+            if isinstance(posting, array):
+                yield decode_key(self._keys[key_id]), posting.tolist()
+
+    def write_snapshot(
+        self, path: str, high_water_mark: Optional[int] = None, fingerprint: int = 0
+    ) -> None:
+        """Атомарно записывает снимок индекса (временный файл + rename)"""
+
+        live = [
+            (encoded, key_id)
+            for key_id, encoded in enumerate(self._keys)
+            if self._postings[key_id] is not None
+        ]
+        live.sort()
+        renumber = {key_id: number for number, (_, key_id) in enumerate(live)}
+
+        key_offsets = array("q", [0])
+        posting_offsets = array("q", [0])
+        postings = array("q")
+        for encoded, key_id in live:
+            key_offsets.append(key_offsets[-1] + len(encoded))
+            postings.extend(self._leads(key_id))
+            posting_offsets.append(len(postings))
+        keys_blob = b"".join(encoded for encoded, _ in live)
+
+        lead_ids = array("q", sorted(self._lead_keys))
+        created_at = array("q", (self.created_at.get(i, 0) for i in lead_ids))
+        lead_key_offsets = array("q", [0])
+        lead_keys = array("q")
+        for lead_id in lead_ids:
+            lead_keys.extend(renumber[key_id] for key_id in self._lead_keys[lead_id])
+            lead_key_offsets.append(len(lead_keys))
+
+        header = HEADER.pack(
+            MAGIC,
+            -1 if high_water_mark is None else high_water_mark,
+            fingerprint,
+            len(live),
+            len(postings),
+            len(lead_ids),
+            len(lead_keys),
+            len(keys_blob),
+        )
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as file:
+            file.write(header)
+            for section in (
+                key_offsets,
+                posting_offsets,
+                postings,
+                lead_ids,
+                created_at,
+                lead_key_offsets,
+                lead_keys,
+            ):
+                section.tofile(file)
+            file.write(keys_blob)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def from_snapshot(cls, snapshot: "IndexSnapshot") -> "CompactKeyIndex":
+        index = cls()
+        index._keys = [
+            snapshot.key_bytes(number) for number in range(snapshot.keys_count)
+        ]
+        index._key_ids = {encoded: key_id for key_id, encoded in enumerate(index._keys)}
+        for key_id in range(snapshot.keys_count):
+            start, end = snapshot.posting_offsets[key_id : key_id + 2]
+            if end - start == 1:
+                index._postings.append(snapshot.postings[start])
+            else:
+                index._postings.append(array("q", snapshot.postings[start:end]))
+        for number, lead_id in enumerate(snapshot.lead_ids):
+            start, end = snapshot.lead_key_offsets[number : number + 2]
+            index._lead_keys[lead_id] = array("i", snapshot.lead_keys[start:end])
+            index.created_at[lead_id] = snapshot.created_at[number]
+        return index
+
+
+class IndexSnapshot:
+    """Снимок индекса, открытый через mmap (только чтение, без загрузки в память)"""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (
+            magic,
+            high_water_mark,
+            self.fingerprint,
+            self.keys_count,
+            postings_count,
+            leads_count,
+            lead_keys_count,
+            keys_blob_size,
+        ) = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC:
+            self._mmap.close()
+            raise ValueError(f"Not a duplicate index snapshot: {path}")
+        self.high_water_mark = None if high_water_mark < 0 else high_water_mark
+
+        view = memoryview(self._mmap)
+        offset = HEADER.size
+        sections = []
+        for count in (
+            self.keys_count + 1,
+            self.keys_count + 1,
+            postings_count,
+            leads_count,
+            leads_count,
+            leads_count + 1,
+            lead_keys_count,
+        ):
+            sections.append(view[offset : offset + count * ALIGN].cast("q"))
+            offset += count * ALIGN
+        (
+            self.key_offsets,
+            self.posting_offsets,
+            self.postings,
+            self.lead_ids,
+            self.created_at,
+            self.lead_key_offsets,
+            self.lead_keys,
+        ) = sections
+        self._keys_start = offset
+        self._keys_end = offset + keys_blob_size
+
+    def __len__(self) -> int:
+        return len(self.lead_ids)
+
+    def __contains__(self, lead_id: int) -> bool:
+        return self._lead_number(lead_id) is not None
+
+    def close(self) -> None:
+        for section in (
+            self.key_offsets,
+            self.posting_offsets,
+            self.postings,
+            self.lead_ids,
+            self.created_at,
+            self.lead_key_offsets,
+            self.lead_keys,
+        ):
+            section.release()
+        self._mmap.close()
+
+    def key_bytes(self, number: int) -> bytes:
+        start = self._keys_start + self.key_offsets[number]
+        end = self._keys_start + self.key_offsets[number + 1]
+        return self._mmap[start:end]
+
+    def _key_number(self, key: MatchKey) -> Optional[int]:
+        target = encode_key(key)
+        low, high = 0, self.keys_count
+        while low < high:
+            middle = (low + high) // 2
+            if self.key_bytes(middle) < target:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.keys_count and self.key_bytes(low) == target:
+            return low
+        return None
+
+    def _lead_number(self, lead_id: int) -> Optional[int]:
+        number = bisect_left(self.lead_ids, lead_id)
+        if number < len(self.lead_ids) and self.lead_ids[number] == lead_id:
+            return number
+        return None
+
+    def _leads(self, key_number: int) -> Iterable[int]:
+        start, end = self.posting_offsets[key_number : key_number + 2]
+        return self.postings[start:end]
+
+    def candidates(self, keys: Iterable[MatchKey]) -> Set[int]:
+        found: Set[int] = set()
+        for key in keys:
+            number = self._key_number(key)
+            if number is not None:
+                found.update(self._leads(number))
+        return found
+
+    def neighbours(self, lead_id: int) -> Set[int]:
+        number = self._lead_number(lead_id)
+        if number is None:
+            return set()
+        found: Set[int] = set()
+        start, end = self.lead_key_offsets[number : number + 2]
+        for key_number in self.lead_keys[start:end]:
+            found.update(self._leads(key_number))
+        found.discard(lead_id)
+        return found
@@ -0,0 +1,87 @@
+from sqlalchemy import (
+    BigInteger,
+    Boolean,
+    Column,
+    DateTime,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    Text,
+    func,
+)
+from sqlalchemy.dialects.postgresql import ARRAY
+
+from src.common.database import Base
+
+
+class ScanRun(Base):
+    """Запуск поиска дублей по воронке"""
+
+    __tablename__ = "scan_runs"
+
+    id = Column(BigInteger, primary_key=True)
+    subdomain = Column(String(255), nullable=False)
+    pipeline_id = Column(BigInteger, nullable=False)
+    incremental = Column(Boolean, nullable=False, default=False)
+    status = Column(String(16), nullable=False, default="running")
+    started_at = Column(
+        DateTime(timezone=True), nullable=False, server_default=func.now()
+    )
+    finished_at = Column(DateTime(timezone=True))
+    leads_count = Column(Integer)
+    groups_count = Column(Integer)
+    high_water_mark = Column(BigInteger)
+    error = Column(Text)
+
+    __table_args__ = (Index("ix_scan_runs_tenant", "subdomain", "pipeline_id", "id"),)
+
+
+class ScanState(Base):
+    """High-water mark инкрементальных сканов воронки (максимальный updated_at)"""
+
+    __tablename__ = "scan_state"
+
+    subdomain = Column(String(255), primary_key=True)
+    pipeline_id = Column(BigInteger, primary_key=True)
+    high_water_mark = Column(BigInteger)
+    updated_at = Column(
+        DateTime(timezone=True), nullable=False, server_default=func.now()
+    )
+
+
+class DuplicateGroup(Base):
+    """Группа дублей; ключ - основная сделка группы в воронке"""
+
+    __tablename__ = "duplicate_groups"
+
+    subdomain = Column(String(255), primary_key=True)
+    pipeline_id = Column(BigInteger, primary_key=True)
+    primary_lead_id = Column(BigInteger, primary_key=True)
+    matched_by = Column(ARRAY(Text), nullable=False)
+    size = Column(Integer, nullable=False)
+    scan_run_id = Column(BigInteger, ForeignKey("scan_runs.id", ondelete="SET NULL"))
+    updated_at = Column(
+        DateTime(timezone=True), nullable=False, server_default=func.now()
+    )
+
+
+class DuplicateGroupMember(Base):
+    """Сделка в группе дублей; сделка воронки входит не более чем в одну группу"""
+
+    __tablename__ = "duplicate_group_members"
+
+    subdomain = Column(String(255), primary_key=True)
+    pipeline_id = Column(BigInteger, primary_key=True)
+    lead_id = Column(BigInteger, primary_key=True)
+    primary_lead_id = Column(BigInteger, nullable=False)
+    scan_run_id = Column(BigInteger, ForeignKey("scan_runs.id", ondelete="SET NULL"))
+
+    __table_args__ = (
+        Index(
+            "ix_duplicate_group_members_group",
+            "subdomain",
+            "pipeline_id",
+            "primary_lead_id",
+        ),
+    )
@@ -0,0 +1,150 @@
+"""
+Кластеризация дублей в пуле процессов.
+
+Блоки индекса шардируются по хешу ключа, каждый шард объединяется
+union-find в отдельном процессе, компоненты шардов объединяются в
+группы тоже в пуле: в event loop остается только раскладка блоков
+по шардам с передачей управления циклу. Блоки передаются плоскими
+массивами id (array('q')) со смещениями - они сериализуются одним
+куском байт, без pickle каждого int. Пул включается CLUSTER_WORKERS > 0 и только для воронок от
+CLUSTER_POOL_MIN_LEADS сделок: на маленьких передача данных дороже
+самой кластеризации.
+"""
+
+import asyncio
+import multiprocessing
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from src.common.config import CLUSTER_POOL_MIN_LEADS, CLUSTER_WORKERS
+from src.dublicate_widget.fuzzy import FuzzyMatcher
+from src.dublicate_widget.utils import (
+    Block,
+    DuplicateIndex,
+    index_blocks,
+    iter_groups_from_blocks,
+    union_blocks,
+)
+
+# Признаки, id сделок подряд и границы блоков в этом массиве
+PackedBlocks = Tuple[List[Tuple[str, ...]], array, array]
+
+# Сколько блоков раскладывать по шардам между передачами управления циклу
+YIELD_EVERY = 10000
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def get_executor() -> Optional[ProcessPoolExecutor]:
+    """Общий пул процессов (None, если пул выключен)"""
+
+    global _executor
+    if _executor is None and CLUSTER_WORKERS > 0:
+        # spawn: форк процесса с потоками (логи, пулы соединений) небезопасен
+        _executor = ProcessPoolExecutor(
+            max_workers=CLUSTER_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _executor
+
+
+def shutdown_executor() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def use_pool(leads_count: int) -> bool:
+    return CLUSTER_WORKERS > 0 and leads_count >= CLUSTER_POOL_MIN_LEADS
+
+
+def pack_blocks(blocks: Iterable[Block]) -> PackedBlocks:
+    kinds: List[Tuple[str, ...]] = []
+    lead_ids = array("q")
+    offsets = array("q", [0])
+    for block_kinds, block_lead_ids in blocks:
+        kinds.append(tuple(block_kinds))
+        lead_ids.extend(block_lead_ids)
+        offsets.append(len(lead_ids))
+    return kinds, lead_ids, offsets
+
+
+def unpack_blocks(packed: PackedBlocks) -> Iterable[Block]:
+    kinds, lead_ids, offsets = packed
+    for number, block_kinds in enumerate(kinds):
+        yield block_kinds, lead_ids[offsets[number] : offsets[number + 1]].tolist()
+
+
+def merge_shard(packed: PackedBlocks) -> PackedBlocks:
+    """Компоненты шарда блоков (выполняется в процессе пула)"""
+
+    return pack_blocks(union_blocks(unpack_blocks(packed)))
+
+
+def group_shards(
+    shards: List[PackedBlocks],
+    created_at: Dict[int, int],
+    after: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """Группы дублей из компонент шардов (выполняется в процессе пула)"""
+
+    components = (block for shard in shards for block in unpack_blocks(shard))
+    return list(iter_groups_from_blocks(components, created_at, after))
+
+
+def fuzzy_clusters(matcher: FuzzyMatcher) -> List[List[Any]]:
+    """Кластеры похожих названий (выполняется в процессе пула)"""
+
+    return matcher.clusters()
+
+
+async def shard_blocks(index: DuplicateIndex, shards: int) -> List[PackedBlocks]:
+    """Блоки индекса по шардам, сразу в упакованном виде"""
+
+    buckets: List[PackedBlocks] = [
+        ([], array("q"), array("q", [0])) for _ in range(shards)
+    ]
+    for number, ((kind, value), lead_ids) in enumerate(index.blocks()):
+        kinds, bucket_lead_ids, offsets = buckets[hash(value) % shards]
+        kinds.append((kind.split(":", 1)[0],))
+        bucket_lead_ids.extend(lead_ids)
+        offsets.append(len(bucket_lead_ids))
+        if number % YIELD_EVERY == YIELD_EVERY - 1:
+            await asyncio.sleep(0)
+    return [bucket for bucket in buckets if bucket[0]]
+
+
+async def group_duplicates(
+    index: DuplicateIndex,
+    created_at: Dict[int, int],
+    after: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """Группы дублей: в пуле процессов для больших воронок, иначе в цикле"""
+
+    executor = get_executor() if use_pool(len(created_at)) else None
+    if executor is None:
+        return list(iter_groups_from_blocks(index_blocks(index), created_at, after))
+
+    loop = asyncio.get_running_loop()
+    shards = await shard_blocks(index, CLUSTER_WORKERS)
+    merged = await asyncio.gather(
+        *(loop.run_in_executor(executor, merge_shard, shard) for shard in shards)
+    )
+    # Компоненты разных шардов пересекаются по сделкам: их объединение
+    # и сортировка групп - тоже O(сделок), поэтому не в event loop
+    return await loop.run_in_executor(
+        executor, group_shards, list(merged), created_at, after
+    )
+
+
+async def cluster_names(matcher: FuzzyMatcher) -> List[List[Any]]:
+    """Кластеры FuzzyMatcher: в пуле процессов для больших наборов, иначе в цикле"""
+
+    executor = get_executor() if use_pool(len(matcher)) else None
+    if executor is None:
+        return matcher.clusters()
+    return await asyncio.get_running_loop().run_in_executor(
+        executor, fuzzy_clusters, matcher
+    )
@@ -0,0 +1,193 @@
+"""
+Хранение результатов поиска дублей в Postgres.
+
+Группы пишутся пачкой: COPY (asyncpg copy_records_to_table) во временные
+staging-таблицы и затем несколько set-based запросов upsert/delete,
+вместо INSERT на каждую строку через ORM.
+"""
+
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import func, select, text, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.common.database import copy_records
+from src.dublicate_widget.models import ScanRun, ScanState
+
+STAGING_TABLES = """
+DROP TABLE IF EXISTS pg_temp.staging_duplicate_groups, pg_temp.staging_duplicate_members;
+CREATE TEMP TABLE staging_duplicate_groups (
+    primary_lead_id bigint PRIMARY KEY,
+    matched_by text[] NOT NULL,
+    size integer NOT NULL
+) ON COMMIT DROP;
+CREATE TEMP TABLE staging_duplicate_members (
+    lead_id bigint PRIMARY KEY,
+    primary_lead_id bigint
+) ON COMMIT DROP;
+"""
+
+# Группы, которых коснулось сохранение: при полном скане - все группы воронки,
+# при инкрементальном - прежние группы сделок из staging
+TOUCHED_FULL = """
+    SELECT DISTINCT primary_lead_id FROM duplicate_groups
+    WHERE subdomain = :subdomain AND pipeline_id = :pipeline_id
+"""
+TOUCHED_INCREMENTAL = """
+    SELECT DISTINCT m.primary_lead_id
+    FROM duplicate_group_members m
+    JOIN staging_duplicate_members s ON s.lead_id = m.lead_id
+    WHERE m.subdomain = :subdomain AND m.pipeline_id = :pipeline_id
+"""
+
+DELETE_STALE_MEMBERS = """
+DELETE FROM duplicate_group_members m
+WHERE m.subdomain = :subdomain AND m.pipeline_id = :pipeline_id
+  AND m.primary_lead_id IN ({touched})
+  AND NOT EXISTS (
+      SELECT 1 FROM staging_duplicate_members s
+      WHERE s.lead_id = m.lead_id AND s.primary_lead_id IS NOT NULL
+  )
+"""
+
+DELETE_STALE_GROUPS = """
+DELETE FROM duplicate_groups g
+WHERE g.subdomain = :subdomain AND g.pipeline_id = :pipeline_id
+  AND g.primary_lead_id IN ({touched})
+  AND NOT EXISTS (
+      SELECT 1 FROM staging_duplicate_groups s
+      WHERE s.primary_lead_id = g.primary_lead_id
+  )
+"""
+
+UPSERT_GROUPS = """
+INSERT INTO duplicate_groups
+    (subdomain, pipeline_id, primary_lead_id, matched_by, size, scan_run_id, updated_at)
+SELECT :subdomain, :pipeline_id, primary_lead_id, matched_by, size, :scan_run_id, now()
+FROM staging_duplicate_groups
+ON CONFLICT (subdomain, pipeline_id, primary_lead_id) DO UPDATE
+SET matched_by = EXCLUDED.matched_by,
+    size = EXCLUDED.size,
+    scan_run_id = EXCLUDED.scan_run_id,
+    updated_at = EXCLUDED.updated_at
+WHERE (duplicate_groups.matched_by, duplicate_groups.size)
+    IS DISTINCT FROM (EXCLUDED.matched_by, EXCLUDED.size)
+"""
+
+UPSERT_MEMBERS = """
+INSERT INTO duplicate_group_members
+    (subdomain, pipeline_id, lead_id, primary_lead_id, scan_run_id)
+SELECT :subdomain, :pipeline_id, lead_id, primary_lead_id, :scan_run_id
+FROM staging_duplicate_members
+WHERE primary_lead_id IS NOT NULL
+ON CONFLICT (subdomain, pipeline_id, lead_id) DO UPDATE
+SET primary_lead_id = EXCLUDED.primary_lead_id,
+    scan_run_id = EXCLUDED.scan_run_id
+WHERE duplicate_group_members.primary_lead_id <> EXCLUDED.primary_lead_id
+"""
+
+
+async def save_duplicate_groups(
+    session: AsyncSession,
+    subdomain: str,
+    pipeline_id: int,
+    groups: List[Dict[str, Any]],
+    scan_run_id: Optional[int] = None,
+    lead_ids: Optional[Iterable[int]] = None,
+) -> None:
+    """
+    Сохраняет группы дублей воронки (без commit).
+
+    lead_ids=None - результат полного скана: группы воронки заменяются
+    целиком. Иначе сохранение инкрементальное: lead_ids - сделки, чьи
+    группы пересчитаны; их прежние группы, которых нет в groups, удаляются.
+    """
+
+    for statement in STAGING_TABLES.split(";"):
+        if statement.strip():
+            await session.execute(text(statement))
+
+    members: Dict[int, Optional[int]] = dict.fromkeys(lead_ids or (), None)
+    for group in groups:
+        for lead_id in group["lead_ids"]:
+            members[lead_id] = group["primary_lead_id"]
+
+    await copy_records(
+        session,
+        "staging_duplicate_groups",
+        ("primary_lead_id", "matched_by", "size"),
+        (
+            (group["primary_lead_id"], group["matched_by"], len(group["lead_ids"]))
+            for group in groups
+        ),
+    )
+    await copy_records(
+        session,
+        "staging_duplicate_members",
+        ("lead_id", "primary_lead_id"),
+        members.items(),
+    )
+
+    touched = TOUCHED_FULL if lead_ids is None else TOUCHED_INCREMENTAL
+    params = {
+        "subdomain": subdomain,
+        "pipeline_id": pipeline_id,
+        "scan_run_id": scan_run_id,
+    }
+    # Сначала удаление: оно опирается на прежние primary_lead_id участников
+    for statement in (DELETE_STALE_MEMBERS, DELETE_STALE_GROUPS):
+        await session.execute(text(statement.format(touched=touched)), params)
+    await session.execute(text(UPSERT_GROUPS), params)
+    await session.execute(text(UPSERT_MEMBERS), params)
+
+
+async def start_scan_run(
+    session: AsyncSession, subdomain: str, pipeline_id: int, incremental: bool
+) -> int:
+    scan_run = ScanRun(
+        subdomain=subdomain, pipeline_id=pipeline_id, incremental=incremental
+    )
+    session.add(scan_run)
+    await session.flush()
+    return scan_run.id
+
+
+async def finish_scan_run(
+    session: AsyncSession, scan_run_id: int, status: str, **values
+) -> None:
+    await session.execute(
+        update(ScanRun)
+        .where(ScanRun.id == scan_run_id)
+        .values(status=status, finished_at=func.now(), **values)
+    )
+
+
+async def get_high_water_mark(
+    session: AsyncSession, subdomain: str, pipeline_id: int
+) -> Optional[int]:
+    return await session.scalar(
+        select(ScanState.high_water_mark).where(
+            ScanState.subdomain == subdomain, ScanState.pipeline_id == pipeline_id
+        )
+    )
+
+
+async def save_high_water_mark(
+    session: AsyncSession,
+    subdomain: str,
+    pipeline_id: int,
+    high_water_mark: Optional[int],
+) -> None:
+    statement = insert(ScanState).values(
+        subdomain=subdomain, pipeline_id=pipeline_id, high_water_mark=high_water_mark
+    )
+    await session.execute(
+        statement.on_conflict_do_update(
+            index_elements=[ScanState.subdomain, ScanState.pipeline_id],
+            set_={
+                "high_water_mark": statement.excluded.high_water_mark,
+                "updated_at": func.now(),
+            },
+        )
+    )
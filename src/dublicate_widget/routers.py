@@ -1,22 +1,244 @@
-from fastapi import APIRouter, HTTPException
+from typing import Optional, Tuple
 
+import orjson
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.amocrm.client import AmoClient
+from src.amocrm.services import build_headers, get_client_session, get_lead_by_id
+from src.common.database import get_async_session
+from src.common.token_service import get_tokens_from_service
 from src.dublicate_widget.schemas import (
+    CheckLeadSchema,
+    CheckLeadSchemaResponse,
     GetDuplicateSchema,
     CreateDuplicateSchema,
+    CreateDuplicateSchemaResponse,
     GetDuplicateSchemaResponse,
+    ScanSubscribeSchema,
+    ScanSubscribeSchemaResponse,
+)
+from src.dublicate_widget.scanner import scan_scheduler
+from src.dublicate_widget.webhooks import parse_webhook, webhook_batcher
+from src.dublicate_widget.services import (
+    duplicate_leads,
+    merge_duplicate_groups,
+    stream_duplicate_leads,
 )
-from src.dublicate_widget.services import duplicate_leads
+from src.mirror.repository import get_sync_state
 
 router = APIRouter(prefix="/duplicate_leads", tags=["Managers"])
 
 
+async def _search_source(
+    data: GetDuplicateSchema, session: AsyncSession
+) -> Tuple[Optional[dict], Optional[AsyncSession]]:
+    """Заголовки amoCRM или сессия копии аккаунта - в зависимости от data.source"""
+
+    if data.source == "mirror":
+        # Пустая копия дала бы пустой список дублей вместо ошибки
+        if "leads" not in await get_sync_state(session, data.subdomain):
+            raise HTTPException(
+                status_code=409, detail="amoCRM mirror is not synced yet"
+            )
+        return None, session
+
+    tokens = await get_tokens_from_service(data.subdomain)
+    return build_headers(tokens["access_token"]), None
+
+
 @router.get("/get", response_model=list[GetDuplicateSchemaResponse])
-async def get_leads_to_gluing(data: GetDuplicateSchema):
+async def get_leads_to_gluing(
+    data: GetDuplicateSchema,
+    client_session: AmoClient = Depends(get_client_session),
+    session: AsyncSession = Depends(get_async_session),
+):
     """Получение сделок, которые являются дублями"""
 
-    leds_to_gluing = await duplicate_leads()
+    headers, mirror_session = await _search_source(data, session)
+
+    leads_to_gluing = await duplicate_leads(
+        client_session,
+        data.subdomain,
+        headers,
+        data.pipeline_id,
+        session=mirror_session,
+        statuses_ids=data.statuses_ids,
+        responsible_user_id=data.responsible_user_id,
+        custom_field_ids=data.custom_field_ids,
+        fuzzy=data.fuzzy,
+        fuzzy_threshold=data.fuzzy_threshold,
+    )
+    return leads_to_gluing
+
+
+@router.get("/get/stream")
+async def stream_leads_to_gluing(
+    data: GetDuplicateSchema,
+    cursor: Optional[int] = None,
+    client_session: AmoClient = Depends(get_client_session),
+    session: AsyncSession = Depends(get_async_session),
+):
+    """
+    Потоковая выдача групп дублей в NDJSON (одна группа на строку).
+
+    cursor - primary_lead_id последней полученной группы: выдача
+    продолжится со следующей группы.
+
+    Ограничение: поток не уменьшает память поиска. Индекс воронки и все
+    группы (O(сделок в группах)) строятся до первой строки ответа, поток
+    лишь не собирает ответ одним JSON. Продолжение по cursor повторяет
+    поиск целиком.
+    """
+
+    headers, mirror_session = await _search_source(data, session)
+
+    groups = stream_duplicate_leads(
+        client_session,
+        data.subdomain,
+        headers,
+        data.pipeline_id,
+        cursor=cursor,
+        session=mirror_session,
+        statuses_ids=data.statuses_ids,
+        responsible_user_id=data.responsible_user_id,
+        custom_field_ids=data.custom_field_ids,
+        fuzzy=data.fuzzy,
+        fuzzy_threshold=data.fuzzy_threshold,
+    )
+
+    # Сканирование идет до первой группы: ошибки amoCRM успевают стать
+    # HTTP-ошибкой, а не оборванным потоком; запросы к копии тоже
+    # заканчиваются до ответа, пока сессия зависимости открыта
+    first_group = await anext(groups, None)
+
+    async def ndjson():
+        if first_group is None:
+            return
+        yield orjson.dumps(first_group) + b"\n"
+        async for group in groups:
+            yield orjson.dumps(group) + b"\n"
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+
+@router.post("/post", response_model=CreateDuplicateSchemaResponse)
+async def glue_duplicate_leads(
+    data: CreateDuplicateSchema,
+    client_session: AmoClient = Depends(get_client_session),
+):
+    """Склейка групп дублей в основные сделки"""
+
+    tokens = await get_tokens_from_service(data.subdomain)
+    headers = build_headers(tokens["access_token"])
+
+    results = await merge_duplicate_groups(
+        client_session,
+        data.subdomain,
+        headers,
+        [group.model_dump() for group in data.groups],
+        close_status_id=data.close_status_id,
+    )
+    failed = sum(1 for result in results if result["status"] == "failed")
+    return {"merged": len(results) - failed, "failed": failed, "groups": results}
+
+
+@router.post("/scan", response_model=ScanSubscribeSchemaResponse)
+async def subscribe_to_scans(data: ScanSubscribeSchema):
+    """Подписка воронки на периодический инкрементальный поиск дублей"""
+
+    tenant = scan_scheduler.register(
+        data.subdomain,
+        data.pipeline_id,
+        statuses_ids=data.statuses_ids,
+        responsible_user_id=data.responsible_user_id,
+        custom_field_ids=data.custom_field_ids,
+    )
+    return {
+        "subdomain": tenant.subdomain,
+        "pipeline_id": tenant.pipeline_id,
+        "interval": scan_scheduler.interval,
+        "high_water_mark": tenant.high_water_mark,
+    }
+
+
+@router.delete("/scan")
+async def unsubscribe_from_scans(subdomain: str, pipeline_id: int):
+    """Отключение периодического поиска дублей для воронки"""
+
+    if scan_scheduler.get(subdomain, pipeline_id) is None:
+        raise HTTPException(status_code=404, detail="Scan is not scheduled")
+    scan_scheduler.unregister(subdomain, pipeline_id)
+    return {"status": "ok"}
+
+
+@router.post("/webhook")
+async def amocrm_webhook(request: Request):
+    """
+    Вебхук amoCRM о добавлении/изменении/удалении сделок, контактов и компаний.
+
+    Отвечает сразу, проверка сделок на дубли идет микробатчами в фоне.
+    Измененные контакты и компании сбрасываются из кеша amoCRM.
+    """
+
+    subdomain, leads, related = parse_webhook(await request.body())
+    if subdomain and related:
+        await webhook_batcher.invalidate(subdomain, related)
+    if subdomain and leads:
+        webhook_batcher.add(subdomain, leads)
+    return {"status": "ok"}
+
+
+@router.post("/check", response_model=CheckLeadSchemaResponse)
+async def check_lead(
+    data: CheckLeadSchema,
+    client_session: AmoClient = Depends(get_client_session),
+):
+    """
+    Проверка одной сделки на дубли по индексу воронки.
+
+    Воронка должна быть подписана на сканы (POST /duplicate_leads/scan),
+    фильтр берется из подписки. Сделка из индекса (или снимка после
+    перезапуска) проверяется без запросов к amoCRM; новая сделка
+    догружается и добавляется в индекс.
+    """
+
+    tenant = scan_scheduler.get(data.subdomain, data.pipeline_id)
+    if tenant is None:
+        raise HTTPException(status_code=409, detail="Scan is not scheduled")
+
+    duplicates = tenant.duplicates_of(data.lead_id)
+    source = "index"
+    if duplicates is None:
+        if tenant.high_water_mark is None:
+            raise HTTPException(
+                status_code=409, detail="Duplicate index is not built yet"
+            )
+
+        tokens = await get_tokens_from_service(data.subdomain)
+        headers = build_headers(tokens["access_token"])
+        lead = tenant.project(
+            # Копия из кеша могла устареть: статус и поля нужны актуальные
+            await get_lead_by_id(
+                data.lead_id,
+                data.subdomain,
+                headers,
+                client_session,
+                read_cache=False,
+            )
+        )
+        if not tenant.matches(lead):
+            raise HTTPException(status_code=404, detail="Lead is not in the pipeline")
 
+        async with tenant.lock:
+            await tenant.apply_many(client_session, headers, [lead])
+        tenant.schedule_snapshot()
+        duplicates = tenant.duplicates_of(data.lead_id) or set()
+        source = "amocrm"
 
-@router.post("/post", response_model=CreateDuplicateSchema)
-async def get_managers(subdomain: str):
-    pass
+    return {
+        "lead_id": data.lead_id,
+        "duplicate_lead_ids": sorted(duplicates),
+        "source": source,
+    }
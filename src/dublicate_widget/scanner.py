@@ -0,0 +1,597 @@
+import asyncio
+import os
+import random
+import time
+import zlib
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Set, Tuple
+
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from aiohttp import ClientSession
+from loguru import logger
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.amocrm.client import amo_client
+from src.amocrm.loader import AmoLoaders
+from src.amocrm.records import LeadRecord
+from src.amocrm.services import (
+    build_headers,
+    get_deleted_lead_ids,
+    iter_leads_by_updated_at,
+)
+from src.common.config import (
+    INDEX_SNAPSHOT_DELAY,
+    INDEX_SNAPSHOT_DIR,
+    SCAN_CONCURRENCY,
+    SCAN_INTERVAL,
+    SCAN_JITTER,
+)
+from src.common.database import async_session_maker
+from src.common.deadline import detached_context
+from src.common.token_service import get_tokens_from_service
+from src.dublicate_widget.key_index import CompactKeyIndex, IndexSnapshot
+from src.dublicate_widget.parallel import group_duplicates
+from src.dublicate_widget.repository import (
+    finish_scan_run,
+    get_high_water_mark,
+    save_duplicate_groups,
+    save_high_water_mark,
+    start_scan_run,
+)
+from src.dublicate_widget.services import _gather_existing, _link_embedded
+from src.dublicate_widget.utils import (
+    DuplicateIndex,
+    MatchKey,
+    contact_match_keys,
+    iter_duplicate_groups,
+    lead_match_keys,
+)
+
+TenantKey = Tuple[str, int]
+
+
+class TenantScan:
+    """
+    Индекс дублей воронки одного аккаунта, обновляемый по updated_at.
+
+    Первый запуск сканирует всю воронку, следующие - только сделки,
+    измененные с high-water mark (максимального updated_at прошлого
+    скана). Сделки обходятся курсором по updated_at, поэтому ушедшая
+    из выборки во время обхода сделка не сдвигает страницы. Измененные
+    сделки запрашиваются без фильтра воронки: сделки, которые больше не
+    подходят под фильтр (другая воронка, статус, ответственный), и
+    удаленные (по событиям amoCRM) убираются из индекса. Проверяются
+    только группы, связанные с затронутыми сделками.
+
+    После скана индекс сохраняется снимком (CompactKeyIndex.write_snapshot),
+    изменения по вебхукам и /check - отложенным снимком (schedule_snapshot).
+    После перезапуска снимок открывается через mmap: на вопрос «есть ли
+    у сделки дубли» он отвечает сразу, а сканы продолжаются с его
+    high-water mark (не дальше сохраненного в базе) без полного
+    пересканирования.
+    """
+
+    def __init__(
+        self,
+        subdomain: str,
+        pipeline_id: int,
+        statuses_ids: Optional[List[int]] = None,
+        responsible_user_id: Optional[int] = None,
+        custom_field_ids: Optional[List[int]] = None,
+    ):
+        self.subdomain = subdomain
+        self.pipeline_id = pipeline_id
+        self.statuses_ids = statuses_ids
+        self.responsible_user_id = responsible_user_id
+        self.custom_field_ids = frozenset(custom_field_ids or ())
+        # Сканы, вебхуки и запись снимка меняют/читают индекс по очереди
+        self.lock = asyncio.Lock()
+        self.snapshot: Optional[IndexSnapshot] = None
+        self._snapshot_timer: Optional[asyncio.TimerHandle] = None
+        self._snapshot_task: Optional[asyncio.Task] = None
+        self.reset()
+
+    @property
+    def key(self) -> TenantKey:
+        return self.subdomain, self.pipeline_id
+
+    @property
+    def created_at(self) -> Dict[int, int]:
+        return self.index.created_at
+
+    @property
+    def fingerprint(self) -> int:
+        """Отпечаток фильтра: снимок с другим фильтром не подходит"""
+
+        return zlib.crc32(
+            repr(
+                (
+                    sorted(self.statuses_ids or ()),
+                    self.responsible_user_id,
+                    sorted(self.custom_field_ids),
+                )
+            ).encode()
+        )
+
+    @property
+    def snapshot_path(self) -> str:
+        return os.path.join(
+            INDEX_SNAPSHOT_DIR, f"{self.subdomain}_{self.pipeline_id}.idx"
+        )
+
+    def reset(self) -> None:
+        self.close_snapshot()
+        self.index = CompactKeyIndex()
+        self.high_water_mark: Optional[int] = None
+        self.scanned_count = 0
+        # Граница из снимка еще не сверена с сохраненной в базе
+        self.restored = False
+
+    def restore(self) -> bool:
+        """Открывает снимок индекса, если он есть и снят с тем же фильтром"""
+
+        try:
+            snapshot = IndexSnapshot(self.snapshot_path)
+        except (OSError, ValueError):
+            return False
+
+        if snapshot.fingerprint != self.fingerprint:
+            snapshot.close()
+            return False
+
+        self.reset()
+        self.snapshot = snapshot
+        self.high_water_mark = snapshot.high_water_mark
+        self.restored = True
+        logger.info(
+            f"Restored duplicate index snapshot for {self.subdomain}, "
+            f"pipeline {self.pipeline_id}: {len(snapshot)} leads"
+        )
+        return True
+
+    def close_snapshot(self) -> None:
+        if self.snapshot is not None:
+            self.snapshot.close()
+            self.snapshot = None
+
+    def materialize(self) -> None:
+        """Переносит снимок в изменяемый индекс перед первым обновлением"""
+
+        if self.snapshot is not None:
+            index = CompactKeyIndex.from_snapshot(self.snapshot)
+            self.close_snapshot()
+            self.index = index
+
+    async def save_snapshot(self) -> None:
+        # Снимок после скана включает и отложенные изменения
+        self.cancel_snapshot()
+        async with self.lock:
+            # Снимок открыт и не менялся, а сброшенный индекс сохранять нечего
+            if self.snapshot is not None or self.high_water_mark is None:
+                return
+            os.makedirs(INDEX_SNAPSHOT_DIR, exist_ok=True)
+            await asyncio.to_thread(
+                self.index.write_snapshot,
+                self.snapshot_path,
+                self.high_water_mark,
+                self.fingerprint,
+            )
+
+    def schedule_snapshot(self, delay: float = INDEX_SNAPSHOT_DELAY) -> None:
+        """
+        Отложенный снимок после изменения индекса вне скана.
+
+        Инкрементальный скан не видит удаленные и ушедшие из воронки сделки:
+        без снимка после перезапуска они вернулись бы в индекс из прошлого.
+        Изменения за delay секунд пишутся одним снимком.
+        """
+
+        if self._snapshot_timer is None:
+            self._snapshot_timer = asyncio.get_running_loop().call_later(
+                delay, self._start_snapshot, context=detached_context()
+            )
+
+    def cancel_snapshot(self) -> None:
+        if self._snapshot_timer is not None:
+            self._snapshot_timer.cancel()
+            self._snapshot_timer = None
+
+    async def flush_snapshot(self) -> None:
+        """Сразу пишет отложенный снимок (при остановке приложения)"""
+
+        if self._snapshot_timer is not None:
+            await self._save_snapshot_logged()
+        elif self._snapshot_task is not None:
+            await asyncio.gather(self._snapshot_task, return_exceptions=True)
+
+    def _start_snapshot(self) -> None:
+        self._snapshot_timer = None
+        self._snapshot_task = asyncio.create_task(self._save_snapshot_logged())
+
+    async def _save_snapshot_logged(self) -> None:
+        try:
+            await self.save_snapshot()
+        except Exception as e:
+            logger.warning(f"Failed to save duplicate index snapshot: {e}")
+
+    def duplicates_of(self, lead_id: int) -> Optional[Set[int]]:
+        """Сделки с общими ключами; None - сделки нет в индексе"""
+
+        if self.snapshot is not None:
+            if lead_id not in self.snapshot:
+                return None
+            return self.snapshot.neighbours(lead_id)
+        if lead_id not in self.index:
+            return None
+        return self.index.neighbours(lead_id)
+
+    async def scan(
+        self, client_session: ClientSession, headers: dict
+    ) -> Tuple[List[Dict[str, Any]], Optional[List[int]]]:
+        """
+        Обновляет индекс. Полный скан возвращает все группы и None,
+        инкрементальный - группы затронутых сделок и id этих сделок.
+        """
+
+        async with self.lock:
+            updated_from = self.high_water_mark
+            incremental = updated_from is not None
+            high_water_mark = updated_from or 0
+            left: Set[int] = set()
+
+            if incremental:
+                # Без фильтра: сделка, ушедшая из воронки, тоже должна прийти
+                leads = iter_leads_by_updated_at(
+                    client_session,
+                    self.subdomain,
+                    headers,
+                    project=self.project,
+                    updated_from=updated_from,
+                )
+            else:
+                leads = iter_leads_by_updated_at(
+                    client_session,
+                    self.subdomain,
+                    headers,
+                    self.pipeline_id,
+                    statuses_ids=self.statuses_ids,
+                    responsible_user_id=self.responsible_user_id,
+                    project=self.project,
+                )
+
+            async def changed_leads() -> AsyncIterator[LeadRecord]:
+                nonlocal high_water_mark
+                async for lead in leads:
+                    high_water_mark = max(high_water_mark, lead.updated_at or 0)
+                    if self.matches(lead):
+                        left.discard(lead.id)
+                        yield lead
+                    else:
+                        left.add(lead.id)
+
+            affected = set(await self.apply(client_session, headers, changed_leads()))
+            if incremental:
+                # События запрашиваются после сделок: удаление во время обхода
+                # не окажется раньше новой границы
+                left |= await get_deleted_lead_ids(
+                    client_session, self.subdomain, headers, updated_from
+                )
+                for lead_id in left:
+                    if lead_id in self.index:
+                        affected.add(lead_id)
+                        affected.update(self.discard(lead_id))
+                lead_ids = list(affected)
+                groups = self.affected_groups(lead_ids)
+            else:
+                groups = await group_duplicates(self.index, self.created_at)
+                lead_ids = None
+
+            # Границу сдвигаем только после успешного скана: упавший скан повторится
+            self.high_water_mark = high_water_mark or None
+            return groups, lead_ids
+
+    def project(self, lead: Dict[str, Any]) -> LeadRecord:
+        return LeadRecord.from_dict(lead, self.custom_field_ids)
+
+    def matches(self, lead: LeadRecord) -> bool:
+        """Подходит ли сделка под фильтр воронки"""
+
+        return (
+            lead.pipeline_id == self.pipeline_id
+            and (not self.statuses_ids or lead.status_id in self.statuses_ids)
+            and (
+                not self.responsible_user_id
+                or lead.responsible_user_id == self.responsible_user_id
+            )
+        )
+
+    async def apply(
+        self,
+        client_session: ClientSession,
+        headers: dict,
+        leads: AsyncIterator[LeadRecord],
+    ) -> List[int]:
+        """
+        Переиндексирует сделки (вызывать под self.lock). Контакты
+        догружаются батчами по мере поступления сделок. Возвращает id
+        затронутых сделок: измененных и их прежних соседей по блокам,
+        чьи группы тоже могли распасться.
+
+        Если контакт не загрузился не из-за удаления (429, 5xx, breaker),
+        поднимается ошибка до изменения индекса: сделка без ключей
+        контактов потеряла бы их до полного пересканирования.
+        """
+
+        self.materialize()
+        loaders = AmoLoaders(self.subdomain, headers, client_session)
+        changed: Dict[int, Set[MatchKey]] = {}
+        created_at: Dict[int, int] = {}
+        contact_leads: Dict[int, List[int]] = {}
+        contact_tasks: List[asyncio.Task] = []
+
+        async for lead in leads:
+            created_at[lead.id] = lead.created_at
+            changed[lead.id] = lead_match_keys(lead)
+            _link_embedded(
+                loaders.contacts,
+                lead.contact_ids,
+                lead.id,
+                contact_leads,
+                contact_tasks,
+                lead.updated_at,
+            )
+
+        for contact in await _gather_existing(contact_tasks):
+            keys = contact_match_keys(contact)
+            for lead_id in contact_leads.get(contact.id, ()):
+                changed[lead_id].update(keys)
+
+        self.scanned_count = len(changed)
+        affected = set(changed)
+        for lead_id, keys in changed.items():
+            affected.update(self.index.discard(lead_id))
+            self.index.set(lead_id, keys, created_at[lead_id])
+        return list(affected)
+
+    async def apply_many(
+        self,
+        client_session: ClientSession,
+        headers: dict,
+        leads: Iterable[LeadRecord],
+    ) -> List[int]:
+        """apply() для уже загруженных сделок"""
+
+        async def iterate() -> AsyncIterator[LeadRecord]:
+            for lead in leads:
+                yield lead
+
+        return await self.apply(client_session, headers, iterate())
+
+    def discard(self, lead_id: int) -> Set[int]:
+        """
+        Убирает сделку из индекса (удалена или больше не подходит под фильтр).
+        Возвращает сделки, с которыми у нее были общие ключи.
+        """
+
+        self.materialize()
+        return self.index.discard(lead_id)
+
+    def affected_groups(self, lead_ids: Iterable[int]) -> List[Dict[str, Any]]:
+        """Группы дублей, в которые входят указанные сделки"""
+
+        component: Set[int] = set()
+        stack = list(lead_ids)
+        while stack:
+            lead_id = stack.pop()
+            if lead_id in component:
+                continue
+            component.add(lead_id)
+            stack.extend(self.index.neighbours(lead_id) - component)
+
+        # Компонента замкнута по общим ключам, группы внутри нее те же, что в полном индексе
+        sub_index = DuplicateIndex()
+        for lead_id in sorted(component):
+            sub_index.add(lead_id, self.index.keys_of(lead_id))
+        return list(iter_duplicate_groups(sub_index, self.created_at))
+
+
+class ScanScheduler:
+    """
+    Периодические инкрементальные сканы аккаунтов на APScheduler.
+
+    У каждой воронки свое interval-задание со случайным сдвигом первого
+    запуска и джиттером, поэтому сканы разных аккаунтов не совпадают
+    по времени. Одновременно идет не больше concurrency сканов; очередь
+    к семафору FIFO, а max_instances=1 не дает одному аккаунту встать
+    в нее дважды.
+    """
+
+    def __init__(
+        self,
+        interval: float = SCAN_INTERVAL,
+        jitter: float = SCAN_JITTER,
+        concurrency: int = SCAN_CONCURRENCY,
+    ):
+        self.interval = interval
+        self.jitter = jitter
+        self._scheduler = AsyncIOScheduler(timezone=timezone.utc)
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._tenants: Dict[TenantKey, TenantScan] = {}
+
+    def start(self) -> None:
+        if not self._scheduler.running:
+            self._scheduler.start()
+
+    def shutdown(self) -> None:
+        if self._scheduler.running:
+            self._scheduler.shutdown(wait=False)
+
+    async def flush_snapshots(self) -> None:
+        """Отложенные снимки всех воронок (после остановки вебхуков)"""
+
+        for tenant in list(self._tenants.values()):
+            await tenant.flush_snapshot()
+
+    @staticmethod
+    def job_id(key: TenantKey) -> str:
+        return f"duplicate_scan:{key[0]}:{key[1]}"
+
+    def get(self, subdomain: str, pipeline_id: int) -> Optional[TenantScan]:
+        return self._tenants.get((subdomain, pipeline_id))
+
+    def tenants(self, subdomain: str) -> List[TenantScan]:
+        """Все подписанные воронки аккаунта"""
+
+        return [tenant for key, tenant in self._tenants.items() if key[0] == subdomain]
+
+    def register(self, subdomain: str, pipeline_id: int, **search_params) -> TenantScan:
+        """Подписывает воронку на периодические сканы (повторный вызов - обновляет фильтр)"""
+
+        tenant = TenantScan(subdomain, pipeline_id, **search_params)
+        previous = self._tenants.get(tenant.key)
+        if previous is not None and _same_filter(previous, tenant):
+            return previous
+        if previous is not None:
+            previous.cancel_snapshot()
+            previous.close_snapshot()
+
+        tenant.restore()
+        self._tenants[tenant.key] = tenant
+        first_run = datetime.now(timezone.utc) + timedelta(
+            seconds=random.uniform(0, self.jitter)
+        )
+        self._scheduler.add_job(
+            self._run,
+            "interval",
+            seconds=self.interval,
+            jitter=self.jitter,
+            args=[tenant.key],
+            id=self.job_id(tenant.key),
+            replace_existing=True,
+            max_instances=1,
+            coalesce=True,
+            next_run_time=first_run,
+        )
+        logger.info(
+            f"Scheduled duplicate scans for {subdomain}, pipeline {pipeline_id}"
+        )
+        return tenant
+
+    def unregister(self, subdomain: str, pipeline_id: int) -> None:
+        key = (subdomain, pipeline_id)
+        tenant = self._tenants.pop(key, None)
+        if tenant is not None:
+            tenant.cancel_snapshot()
+            tenant.close_snapshot()
+            self._scheduler.remove_job(self.job_id(key))
+
+    async def _run(self, key: TenantKey) -> None:
+        tenant = self._tenants.get(key)
+        if tenant is None:
+            return
+
+        async with self._semaphore:
+            started = time.monotonic()
+            async with async_session_maker() as session:
+                if tenant.restored:
+                    await self._reconcile(session, tenant)
+                incremental = tenant.high_water_mark is not None
+                scan_run_id = await start_scan_run(
+                    session, tenant.subdomain, tenant.pipeline_id, incremental
+                )
+                await session.commit()
+
+                try:
+                    tokens = await get_tokens_from_service(tenant.subdomain)
+                    headers = build_headers(tokens["access_token"])
+                    groups, lead_ids = await tenant.scan(amo_client, headers)
+                except Exception as e:
+                    # Индекс и граница не сдвинулись: следующий скан продолжит
+                    # с той же границы, без полного пересканирования
+                    await self._fail_run(session, tenant, scan_run_id, e)
+                    return
+
+                try:
+                    await save_duplicate_groups(
+                        session,
+                        tenant.subdomain,
+                        tenant.pipeline_id,
+                        groups,
+                        scan_run_id,
+                        lead_ids,
+                    )
+                    await save_high_water_mark(
+                        session,
+                        tenant.subdomain,
+                        tenant.pipeline_id,
+                        tenant.high_water_mark,
+                    )
+                    await finish_scan_run(
+                        session,
+                        scan_run_id,
+                        "done",
+                        leads_count=tenant.scanned_count,
+                        groups_count=len(groups),
+                        high_water_mark=tenant.high_water_mark,
+                    )
+                    await session.commit()
+                except Exception as e:
+                    # Индекс ушел вперед сохраненного: следующий скан - полный
+                    async with tenant.lock:
+                        tenant.reset()
+                    await self._fail_run(session, tenant, scan_run_id, e)
+                    return
+
+        await tenant._save_snapshot_logged()
+
+        logger.info(
+            f"{'Incremental' if incremental else 'Full'} duplicate scan for "
+            f"{tenant.subdomain}, pipeline {tenant.pipeline_id}: "
+            f"{len(groups)} groups in {time.monotonic() - started:.1f}s"
+        )
+
+    @staticmethod
+    async def _reconcile(session: AsyncSession, tenant: TenantScan) -> None:
+        """
+        Сверка границы снимка с сохраненной в базе (первый скан после restore).
+
+        Группы в базе актуальны на сохраненную границу: если снимок ушел
+        дальше (упала запись в базу), скан продолжается с границы базы,
+        а без сохраненной границы - полный.
+        """
+
+        persisted = await get_high_water_mark(
+            session, tenant.subdomain, tenant.pipeline_id
+        )
+        await session.commit()
+        async with tenant.lock:
+            if not tenant.restored:
+                return
+            tenant.restored = False
+            if persisted is None:
+                tenant.reset()
+            elif tenant.high_water_mark is not None:
+                tenant.high_water_mark = min(tenant.high_water_mark, persisted)
+
+    @staticmethod
+    async def _fail_run(
+        session: AsyncSession, tenant: TenantScan, scan_run_id: int, error: Exception
+    ) -> None:
+        await session.rollback()
+        logger.error(
+            f"Duplicate scan failed for {tenant.subdomain}, "
+            f"pipeline {tenant.pipeline_id}: {error}"
+        )
+        await finish_scan_run(session, scan_run_id, "failed", error=str(error))
+        await session.commit()
+
+
+def _same_filter(a: TenantScan, b: TenantScan) -> bool:
+    return (
+        a.statuses_ids == b.statuses_ids
+        and a.responsible_user_id == b.responsible_user_id
+        and a.custom_field_ids == b.custom_field_ids
+    )
+
+
+scan_scheduler = ScanScheduler()
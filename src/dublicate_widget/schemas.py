@@ -1,14 +1,72 @@
-from pydantic import BaseModel
+from typing import List, Literal, Optional
+
+from pydantic import BaseModel, Field
 
 
 class GetDuplicateSchemaResponse(BaseModel):
-    pass
+    primary_lead_id: int
+    lead_ids: List[int]
+    matched_by: List[str]
 
 
 class GetDuplicateSchema(BaseModel):
     subdomain: str
     pipeline_id: int
+    statuses_ids: Optional[List[int]] = None
+    responsible_user_id: Optional[int] = None
+    custom_field_ids: List[int] = []
+    fuzzy: bool = False
+    fuzzy_threshold: float = Field(default=0.6, gt=0, le=1)
+    # mirror - поиск по копии аккаунта в Postgres (src.mirror) без запросов к amoCRM
+    source: Literal["amocrm", "mirror"] = "amocrm"
+
+
+class MergeGroupSchema(BaseModel):
+    primary_lead_id: int
+    lead_ids: List[int]
 
 
 class CreateDuplicateSchema(BaseModel):
-    pass
+    subdomain: str
+    groups: List[MergeGroupSchema]
+    close_status_id: int = 143
+
+
+class MergeGroupResultSchema(BaseModel):
+    primary_lead_id: int
+    merged_lead_ids: List[int]
+    status: str
+    error: Optional[str] = None
+
+
+class CreateDuplicateSchemaResponse(BaseModel):
+    merged: int
+    failed: int
+    groups: List[MergeGroupResultSchema]
+
+
+class ScanSubscribeSchema(BaseModel):
+    subdomain: str
+    pipeline_id: int
+    statuses_ids: Optional[List[int]] = None
+    responsible_user_id: Optional[int] = None
+    custom_field_ids: List[int] = []
+
+
+class ScanSubscribeSchemaResponse(BaseModel):
+    subdomain: str
+    pipeline_id: int
+    interval: float
+    high_water_mark: Optional[int] = None
+
+
+class CheckLeadSchema(BaseModel):
+    subdomain: str
+    pipeline_id: int
+    lead_id: int
+
+
+class CheckLeadSchemaResponse(BaseModel):
+    lead_id: int
+    duplicate_lead_ids: List[int]
+    source: str
@@ -1,6 +1,696 @@
-from src.amocrm.services import get_leads_by_filter_async
+import asyncio
+from functools import partial
+from typing import (
+    Any,
+    AsyncGenerator,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+)
+
 from aiohttp import ClientSession
+from fastapi import HTTPException
+from loguru import logger
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.amocrm.cache import amo_cache
+from src.amocrm.loader import AmoLoaders, EntityLoader
+from src.amocrm.normalize import get_embedded_ids
+from src.amocrm.records import LeadRecord
+from src.amocrm.services import (
+    add_leads_notes,
+    get_notes_by_lead_ids,
+    iter_leads_by_filter,
+    link_leads,
+    patch_leads,
+)
+from src.common.config import MERGE_BATCH_SIZE, MERGE_CONCURRENCY
+from src.dublicate_widget.fuzzy import DEFAULT_THRESHOLD, FuzzyMatcher
+from src.dublicate_widget.parallel import cluster_names, group_duplicates, use_pool
+from src.dublicate_widget.utils import (
+    DuplicateIndex,
+    contact_match_keys,
+    index_blocks,
+    iter_duplicate_groups,
+    lead_match_keys,
+    union_blocks,
+)
+
+
+def _link_embedded(
+    loader: EntityLoader,
+    entity_ids: Iterable[int],
+    lead_id: int,
+    entity_leads: Dict[int, List[int]],
+    tasks: List[asyncio.Task],
+    min_updated_at: Optional[int] = None,
+) -> None:
+    """
+    Запоминает связь сделки с вложенными сущностями и ставит их в загрузку.
+
+    min_updated_at - updated_at сделки: копия сущности из кеша, загруженная
+    до последнего изменения сделки, запрашивается заново.
+    """
+
+    for entity_id in entity_ids:
+        if entity_id not in entity_leads:
+            entity_leads[entity_id] = []
+            # Сущности одной страницы уходят одним батчем, пока грузятся следующие
+            tasks.append(asyncio.create_task(loader.load(entity_id, min_updated_at)))
+        else:
+            loader.enqueue(entity_id, min_updated_at)
+        entity_leads[entity_id].append(lead_id)
+
+
+def _is_not_found(error: BaseException) -> bool:
+    """Сущность удалена в amoCRM (в отличие от временной ошибки загрузки)"""
+
+    return isinstance(error, HTTPException) and error.status_code == 404
+
+
+async def _gather_loaded(tasks: List[asyncio.Task]) -> List[Any]:
+    entities = []
+    for entity in await asyncio.gather(*tasks, return_exceptions=True):
+        if isinstance(entity, BaseException):
+            logger.warning(f"Entity skipped during duplicate search: {entity}")
+            continue
+        entities.append(entity)
+    return entities
+
+
+async def _gather_existing(tasks: List[asyncio.Task]) -> List[Any]:
+    """
+    Как _gather_loaded, но пропускаются только удаленные сущности (404).
+    Любая другая ошибка загрузки поднимается: неполные данные нельзя
+    применять к индексу.
+    """
+
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException) and not _is_not_found(result):
+            raise result
+    return [result for result in results if not isinstance(result, BaseException)]
+
+
+async def _index_fuzzy_clusters(
+    index: DuplicateIndex,
+    kind: str,
+    matcher: FuzzyMatcher,
+    entity_leads: Optional[Dict[int, List[int]]] = None,
+) -> None:
+    """Добавляет в индекс ключ кластера похожих названий для каждой сделки"""
+
+    for cluster_no, entity_ids in enumerate(await cluster_names(matcher)):
+        key = (kind, str(cluster_no))
+        for entity_id in entity_ids:
+            lead_ids = (
+                [entity_id] if entity_leads is None else entity_leads.get(entity_id, ())
+            )
+            for lead_id in lead_ids:
+                index.add(lead_id, (key,))
+
+
+async def _index_lead_name_clusters(
+    index: DuplicateIndex, matcher: FuzzyMatcher
+) -> None:
+    """
+    Ключи кластеров похожих названий сделок, только подтверждающие.
+
+    Название сделки само по себе не доказывает дубль: ключ получают только
+    сделки кластера, уже связанные ключами контактов и полей (одна
+    компонента индекса). Новых групп он не создает, а добавляет lead_name
+    в matched_by. Вызывать до ключей названий контактов и компаний.
+    """
+
+    clusters = await cluster_names(matcher)
+    if not clusters:
+        return
+
+    component_of: Dict[int, int] = {}
+    for number, (_, lead_ids) in enumerate(union_blocks(index_blocks(index))):
+        for lead_id in lead_ids:
+            component_of[lead_id] = number
+
+    for cluster_no, lead_ids in enumerate(clusters):
+        by_component: Dict[int, List[int]] = {}
+        for lead_id in lead_ids:
+            if lead_id in component_of:
+                by_component.setdefault(component_of[lead_id], []).append(lead_id)
+
+        for component, confirmed in by_component.items():
+            if len(confirmed) > 1:
+                key = ("lead_name", f"{cluster_no}:{component}")
+                for lead_id in confirmed:
+                    index.add(lead_id, (key,))
+
+
+async def build_duplicate_index(
+    client_session: ClientSession,
+    subdomain: str,
+    headers: dict,
+    pipeline_id: int,
+    statuses_ids: Optional[List[int]] = None,
+    responsible_user_id: Optional[int] = None,
+    custom_field_ids: Optional[List[int]] = None,
+    fuzzy: bool = False,
+    fuzzy_threshold: float = DEFAULT_THRESHOLD,
+) -> Tuple[DuplicateIndex, Dict[int, int]]:
+    """
+    Индекс ключей совпадения сделок воронки и created_at сделок.
+
+    Сделки индексируются по контактам, телефонам и email контактов,
+    а также по выбранным полям сделки, и объединяются в группы
+    через union-find без попарного сравнения. С fuzzy=True дополнительно
+    сравниваются названия контактов и компаний (MinHash-LSH), а похожие
+    названия сделок только подтверждают уже найденные совпадения.
+    """
+
+    index = DuplicateIndex()
+    loaders = AmoLoaders(subdomain, headers, client_session)
+
+    created_at: Dict[int, int] = {}
+    contact_leads: Dict[int, List[int]] = {}
+    company_leads: Dict[int, List[int]] = {}
+    contact_tasks: List[asyncio.Task] = []
+    company_tasks: List[asyncio.Task] = []
+
+    lead_names = FuzzyMatcher(threshold=fuzzy_threshold)
+    contact_names = FuzzyMatcher(threshold=fuzzy_threshold)
+    company_names = FuzzyMatcher(threshold=fuzzy_threshold)
+
+    project = partial(
+        LeadRecord.from_dict, custom_field_ids=frozenset(custom_field_ids or ())
+    )
+    async for lead in iter_leads_by_filter(
+        client_session,
+        subdomain,
+        headers,
+        pipeline_id,
+        statuses_ids=statuses_ids,
+        responsible_user_id=responsible_user_id,
+        project=project,
+    ):
+        created_at[lead.id] = lead.created_at
+        index.add(lead.id, lead_match_keys(lead))
+
+        _link_embedded(
+            loaders.contacts,
+            lead.contact_ids,
+            lead.id,
+            contact_leads,
+            contact_tasks,
+            lead.updated_at,
+        )
+        if fuzzy:
+            lead_names.add(lead.id, lead.name)
+            _link_embedded(
+                loaders.companies,
+                lead.company_ids,
+                lead.id,
+                company_leads,
+                company_tasks,
+                lead.updated_at,
+            )
+
+    for contact in await _gather_loaded(contact_tasks):
+        keys = contact_match_keys(contact)
+        for lead_id in contact_leads.get(contact.id, ()):
+            index.add(lead_id, keys)
+        if fuzzy:
+            contact_names.add(contact.id, contact.name)
+
+    if fuzzy:
+        for company in await _gather_loaded(company_tasks):
+            company_names.add(company["id"], company.get("name"))
+
+        await _index_lead_name_clusters(index, lead_names)
+        await _index_fuzzy_clusters(index, "contact_name", contact_names, contact_leads)
+        await _index_fuzzy_clusters(index, "company_name", company_names, company_leads)
+
+    logger.info(
+        f"Indexed {len(created_at)} leads for {subdomain}, pipeline {pipeline_id} "
+        f"({loaders.requests_count} batch requests, "
+        f"cache hit ratio {amo_cache.stats()['hit_ratio']:.2f})"
+    )
+    return index, created_at
+
+
+async def build_mirror_duplicate_index(
+    session: AsyncSession,
+    subdomain: str,
+    pipeline_id: int,
+    statuses_ids: Optional[List[int]] = None,
+    responsible_user_id: Optional[int] = None,
+    custom_field_ids: Optional[List[int]] = None,
+    fuzzy: bool = False,
+    fuzzy_threshold: float = DEFAULT_THRESHOLD,
+) -> Tuple[DuplicateIndex, Dict[int, int]]:
+    """
+    То же, что build_duplicate_index, но по копии аккаунта в Postgres.
+
+    Блоки ключей собираются агрегацией по индексам копии, в индекс
+    попадают только ключи двух и более сделок. Запросов к amoCRM нет,
+    данные свежи на момент последней синхронизации (src.mirror).
+    """
+
+    # Импорт здесь: репозиторий копии тянет engine БД, а остальным
+    # пользователям модуля (поиск по amoCRM, бенчмарки) база не нужна
+    from src.mirror.repository import (
+        iter_company_names,
+        iter_contact_names,
+        iter_duplicate_blocks,
+        iter_pipeline_leads,
+    )
+
+    index = DuplicateIndex()
+    created_at: Dict[int, int] = {}
+    filter_params = {
+        "subdomain": subdomain,
+        "pipeline_id": pipeline_id,
+        "statuses_ids": statuses_ids,
+        "responsible_user_id": responsible_user_id,
+    }
+
+    lead_names = FuzzyMatcher(threshold=fuzzy_threshold)
+    async for lead_id, lead_created_at, name in iter_pipeline_leads(
+        session, **filter_params
+    ):
+        created_at[lead_id] = lead_created_at
+        if fuzzy:
+            lead_names.add(lead_id, name)
+
+    async for kind, value, lead_ids in iter_duplicate_blocks(
+        session, custom_field_ids=custom_field_ids or (), **filter_params
+    ):
+        for lead_id in lead_ids:
+            index.add(lead_id, ((kind, value),))
+
+    if fuzzy:
+        await _index_lead_name_clusters(index, lead_names)
+        for kind, rows in (
+            ("contact_name", iter_contact_names(session, **filter_params)),
+            ("company_name", iter_company_names(session, **filter_params)),
+        ):
+            names = FuzzyMatcher(threshold=fuzzy_threshold)
+            entity_leads: Dict[int, List[int]] = {}
+            async for entity_id, name, lead_ids in rows:
+                names.add(entity_id, name)
+                entity_leads[entity_id] = lead_ids
+            await _index_fuzzy_clusters(index, kind, names, entity_leads)
+
+    logger.info(
+        f"Indexed {len(created_at)} leads for {subdomain}, pipeline {pipeline_id} "
+        f"from mirror"
+    )
+    return index, created_at
+
+
+async def _build_index(
+    client_session: ClientSession,
+    subdomain: str,
+    headers: dict,
+    pipeline_id: int,
+    session: Optional[AsyncSession] = None,
+    **search_params,
+) -> Tuple[DuplicateIndex, Dict[int, int]]:
+    """Индекс по копии аккаунта, если передана session, иначе по amoCRM"""
+
+    if session is not None:
+        return await build_mirror_duplicate_index(
+            session, subdomain, pipeline_id, **search_params
+        )
+    return await build_duplicate_index(
+        client_session, subdomain, headers, pipeline_id, **search_params
+    )
+
+
+async def duplicate_leads(
+    client_session: ClientSession,
+    subdomain: str,
+    headers: dict,
+    pipeline_id: int,
+    session: Optional[AsyncSession] = None,
+    **search_params,
+) -> List[Dict[str, Any]]:
+    """
+    Поиск дублей сделок воронки (параметры - как у build_duplicate_index).
+
+    С session поиск идет по копии аккаунта в Postgres без запросов к amoCRM.
+    """
+
+    index, created_at = await _build_index(
+        client_session, subdomain, headers, pipeline_id, session, **search_params
+    )
+    groups = await group_duplicates(index, created_at)
+    logger.info(f"Found {len(groups)} duplicate groups for {subdomain}")
+    return groups
+
+
+async def stream_duplicate_leads(
+    client_session: ClientSession,
+    subdomain: str,
+    headers: dict,
+    pipeline_id: int,
+    cursor: Optional[int] = None,
+    session: Optional[AsyncSession] = None,
+    **search_params,
+) -> AsyncGenerator[Dict[str, Any], None]:
+    """
+    Группы дублей по одной, по возрастанию primary_lead_id.
+
+    Группы union-find окончательны только после индексации последней
+    сделки, поэтому первая группа отдается после сканирования. Потоковой
+    здесь является только выдача: для сортировки по primary_lead_id все
+    компоненты union-find строятся в памяти, то есть память - O(сделок
+    в группах) поверх индекса, как у duplicate_leads. Экономится только
+    ответ: группы не сериализуются одним JSON. cursor - primary_lead_id
+    последней полученной группы для продолжения после обрыва.
+    """
+
+    index, created_at = await _build_index(
+        client_session, subdomain, headers, pipeline_id, session, **search_params
+    )
+    if use_pool(len(created_at)):
+        groups = await group_duplicates(index, created_at, after=cursor)
+    else:
+        groups = iter_duplicate_groups(index, created_at, after=cursor)
+
+    for group in groups:
+        yield group
+        # Отдаем управление циклу, чтобы ответ уходил по мере генерации
+        await asyncio.sleep(0)
+
+
+CLOSED_LOST_STATUS_ID = 143
+
+# Типы примечаний, которые amoCRM позволяет создать через API
+COPYABLE_NOTE_TYPES = {
+    "common",
+    "call_in",
+    "call_out",
+    "service_message",
+    "extended_service_message",
+    "message_cashier",
+    "geolocation",
+    "sms_in",
+    "sms_out",
+}
+
+
+async def _run_batched(
+    items: List[Tuple[int, Any]],
+    send: Callable[[List[Any]], Awaitable[Any]],
+    errors: Dict[int, str],
+    semaphore: asyncio.Semaphore,
+    batch_size: int = MERGE_BATCH_SIZE,
+) -> List[Any]:
+    """
+    Отправка элементов пачками по batch_size параллельно.
+
+    items - пары (id основной сделки группы, элемент запроса). Элементы
+    одной группы попадают в одну пачку, если помещаются в batch_size.
+    Ошибка пачки записывается всем группам, чьи элементы в нее попали.
+    Возвращаются результаты успешных пачек.
+    """
+
+    async def send_chunk(chunk: List[Tuple[int, Any]]) -> Any:
+        async with semaphore:
+            try:
+                return await send([item for _, item in chunk])
+            except Exception as e:
+                detail = getattr(e, "detail", None) or repr(e)
+                for primary_lead_id, _ in chunk:
+                    errors.setdefault(primary_lead_id, str(detail))
+                return None
+
+    by_group: Dict[int, List[Tuple[int, Any]]] = {}
+    for primary_lead_id, item in items:
+        by_group.setdefault(primary_lead_id, []).append((primary_lead_id, item))
+
+    chunks: List[List[Tuple[int, Any]]] = []
+    chunk: List[Tuple[int, Any]] = []
+    for group_items in by_group.values():
+        if chunk and len(chunk) + len(group_items) > batch_size:
+            chunks.append(chunk)
+            chunk = []
+        for group_item in group_items:
+            chunk.append(group_item)
+            if len(chunk) == batch_size:
+                chunks.append(chunk)
+                chunk = []
+    if chunk:
+        chunks.append(chunk)
+
+    results = await asyncio.gather(*(send_chunk(chunk) for chunk in chunks))
+    return [result for result in results if result is not None]
+
+
+async def merge_duplicate_groups(
+    client_session: ClientSession,
+    subdomain: str,
+    headers: dict,
+    groups: List[Dict[str, Any]],
+    close_status_id: int = CLOSED_LOST_STATUS_ID,
+    concurrency: int = MERGE_CONCURRENCY,
+) -> List[Dict[str, Any]]:
+    """
+    Склейка групп дублей в основную сделку.
+
+    На основную сделку переносятся примечания, контакты, компания и теги
+    дублей, после чего дубли закрываются статусом close_status_id.
+    Все изменения идут пакетными запросами по 50 сущностей. Ошибка
+    отмечается у групп из неудачной пачки, такие группы пропускают
+    следующие шаги, остальные склеиваются дальше. Дубли закрываются
+    последним отдельным шагом и только у групп без ошибок на предыдущих,
+    чтобы не потерять данные при сбое. Закрытия группы идут одной пачкой;
+    если дублей в группе больше размера пачки, при сбое часть из них
+    может остаться открытой (группа отмечается ошибкой).
+
+    Сделки читаются из amoCRM в обход кеша: теги заменяются PATCH целиком,
+    и устаревшая версия из кеша стерла бы теги, добавленные после нее.
+    После склейки кеш всех сделок групп сбрасывается.
+    """
+
+    errors: Dict[int, str] = {}
+    semaphore = asyncio.Semaphore(concurrency)
+    duplicates: Dict[int, List[int]] = {}
+    primary_of: Dict[int, int] = {}
+    rejected: List[Dict[str, Any]] = []
+    seen_lead_ids = set()
+    for group in groups:
+        primary_lead_id = group["primary_lead_id"]
+        lead_ids = [
+            lead_id
+            for lead_id in dict.fromkeys(group["lead_ids"])
+            if lead_id != primary_lead_id
+        ]
+        if primary_lead_id in duplicates:
+            # Вторая группа с той же основной сделкой затерла бы первую
+            rejected.append(
+                {
+                    "primary_lead_id": primary_lead_id,
+                    "merged_lead_ids": [],
+                    "status": "failed",
+                    "error": "Duplicate primary_lead_id",
+                }
+            )
+            continue
+        duplicates[primary_lead_id] = lead_ids
+
+        group_lead_ids = {primary_lead_id, *lead_ids}
+        if group_lead_ids & seen_lead_ids:
+            errors[primary_lead_id] = "Lead belongs to several groups"
+            continue
+        seen_lead_ids |= group_lead_ids
+        primary_of.update(dict.fromkeys(lead_ids, primary_lead_id))
+
+    def active_groups() -> List[int]:
+        return [
+            primary_lead_id
+            for primary_lead_id, lead_ids in duplicates.items()
+            if lead_ids and primary_lead_id not in errors
+        ]
+
+    # 1. Сделки групп (списочными запросами по 250, в обход кеша)
+    loader = EntityLoader(
+        "leads",
+        subdomain,
+        headers,
+        client_session,
+        with_="contacts",
+        cache=False,
+        read_cache=False,
+    )
+    lead_ids = [
+        lead_id
+        for primary_lead_id in active_groups()
+        for lead_id in (primary_lead_id, *duplicates[primary_lead_id])
+    ]
+    loaded = await asyncio.gather(
+        *(loader.load(lead_id) for lead_id in lead_ids), return_exceptions=True
+    )
+    leads: Dict[int, Dict[str, Any]] = {}
+    for lead_id, lead in zip(lead_ids, loaded):
+        if isinstance(lead, BaseException):
+            primary_lead_id = primary_of.get(lead_id, lead_id)
+            errors.setdefault(primary_lead_id, f"Lead {lead_id} is not available")
+        else:
+            leads[lead_id] = lead
+
+    # 2. Примечания дублей копируются в основную сделку
+    note_sources = [
+        (primary_lead_id, lead_id)
+        for primary_lead_id in active_groups()
+        for lead_id in duplicates[primary_lead_id]
+    ]
+    notes_pages = await _run_batched(
+        note_sources,
+        lambda ids: get_notes_by_lead_ids(ids, subdomain, headers, client_session),
+        errors,
+        semaphore,
+    )
+    new_notes = [
+        (
+            primary_of[note["entity_id"]],
+            {
+                "entity_id": primary_of[note["entity_id"]],
+                "note_type": note["note_type"],
+                "params": note.get("params") or {},
+            },
+        )
+        for notes in notes_pages
+        for note in notes
+        if note.get("note_type") in COPYABLE_NOTE_TYPES
+        and note.get("entity_id") in primary_of
+        and primary_of[note["entity_id"]] not in errors
+    ]
+    await _run_batched(
+        new_notes,
+        lambda notes: add_leads_notes(notes, subdomain, headers, client_session),
+        errors,
+        semaphore,
+    )
+
+    # 3. Контакты и компания дублей привязываются к основной сделке
+    links = []
+    for primary_lead_id in active_groups():
+        primary = leads[primary_lead_id]
+        linked_contacts = set(get_embedded_ids(primary, "contacts"))
+        has_company = bool(get_embedded_ids(primary, "companies"))
+
+        for lead_id in duplicates[primary_lead_id]:
+            lead = leads[lead_id]
+            for contact_id in get_embedded_ids(lead, "contacts"):
+                if contact_id not in linked_contacts:
+                    linked_contacts.add(contact_id)
+                    links.append(
+                        (
+                            primary_lead_id,
+                            {
+                                "entity_id": primary_lead_id,
+                                "to_entity_id": contact_id,
+                                "to_entity_type": "contacts",
+                            },
+                        )
+                    )
+            company_ids = get_embedded_ids(lead, "companies")
+            if company_ids and not has_company:
+                has_company = True
+                links.append(
+                    (
+                        primary_lead_id,
+                        {
+                            "entity_id": primary_lead_id,
+                            "to_entity_id": company_ids[0],
+                            "to_entity_type": "companies",
+                        },
+                    )
+                )
+    await _run_batched(
+        links,
+        lambda batch: link_leads(batch, subdomain, headers, client_session),
+        errors,
+        semaphore,
+    )
+
+    # 4. Теги дублей объединяются на основной сделке
+    tag_updates = []
+    for primary_lead_id in active_groups():
+        primary_tags = _get_tag_ids(leads[primary_lead_id])
+        tags = dict.fromkeys(primary_tags)
+        for lead_id in duplicates[primary_lead_id]:
+            tags.update(dict.fromkeys(_get_tag_ids(leads[lead_id])))
+        if len(tags) > len(primary_tags):
+            tag_updates.append(
+                (
+                    primary_lead_id,
+                    {
+                        "id": primary_lead_id,
+                        "_embedded": {"tags": [{"id": tag_id} for tag_id in tags]},
+                    },
+                )
+            )
+    await _run_batched(
+        tag_updates,
+        lambda batch: patch_leads(batch, subdomain, headers, client_session),
+        errors,
+        semaphore,
+    )
+
+    # 5. Дубли закрываются только у групп, все данные которых перенесены
+    closes = []
+    for primary_lead_id in active_groups():
+        for lead_id in duplicates[primary_lead_id]:
+            closes.append(
+                (
+                    primary_lead_id,
+                    {
+                        "id": lead_id,
+                        "pipeline_id": leads[lead_id].get("pipeline_id"),
+                        "status_id": close_status_id,
+                    },
+                )
+            )
+    await _run_batched(
+        closes,
+        lambda batch: patch_leads(batch, subdomain, headers, client_session),
+        errors,
+        semaphore,
+    )
+
+    # Сделки изменены (в том числе частично - у упавших групп)
+    await asyncio.gather(
+        *(
+            amo_cache.invalidate(subdomain, "leads", lead_id)
+            for primary_lead_id, lead_ids in duplicates.items()
+            for lead_id in (primary_lead_id, *lead_ids)
+        )
+    )
+
+    results = []
+    for primary_lead_id, lead_ids in duplicates.items():
+        error = errors.get(primary_lead_id)
+        results.append(
+            {
+                "primary_lead_id": primary_lead_id,
+                "merged_lead_ids": [] if error else lead_ids,
+                "status": "failed" if error else "merged",
+                "error": error,
+            }
+        )
+
+    results.extend(rejected)
+
+    logger.info(
+        f"Merged {len(duplicates) - len(errors)} of {len(groups)} duplicate groups "
+        f"for {subdomain}"
+    )
+    return results
 
 
-async def duplicate_leads(subdomain: str, client_session: ClientSession):
-    leads = await get_leads_by_filter_async(client_session, subdomain)
+def _get_tag_ids(lead: Dict[str, Any]) -> List[int]:
+    return get_embedded_ids(lead, "tags")
@@ -0,0 +1,219 @@
+from typing import (
+    Any,
+    Dict,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+
+from src.amocrm.records import ContactRecord, LeadRecord
+
+MatchKey = Tuple[str, str]
+
+
+def lead_match_keys(lead: LeadRecord) -> Set[MatchKey]:
+    """Ключи совпадения самой сделки: контакты и выбранные поля"""
+
+    keys: Set[MatchKey] = {
+        ("contact", str(contact_id)) for contact_id in lead.contact_ids
+    }
+    keys.update((f"field:{field_id}", value) for field_id, value in lead.fields)
+    return keys
+
+
+def contact_match_keys(contact: ContactRecord) -> Set[MatchKey]:
+    """Ключи совпадения контакта: телефоны и email"""
+
+    keys: Set[MatchKey] = {("phone", phone) for phone in contact.phones}
+    keys.update(("email", email) for email in contact.emails)
+    return keys
+
+
+class UnionFind:
+    """Система непересекающихся множеств (сжатие путей + объединение по размеру)"""
+
+    def __init__(self):
+        self._parent: Dict[Hashable, Hashable] = {}
+        self._size: Dict[Hashable, int] = {}
+
+    def add(self, item: Hashable) -> None:
+        if item not in self._parent:
+            self._parent[item] = item
+            self._size[item] = 1
+
+    def find(self, item: Hashable) -> Hashable:
+        self.add(item)
+
+        root = item
+        while self._parent[root] != root:
+            root = self._parent[root]
+
+        while self._parent[item] != root:
+            self._parent[item], item = root, self._parent[item]
+
+        return root
+
+    def union(self, a: Hashable, b: Hashable) -> Hashable:
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a == root_b:
+            return root_a
+
+        if self._size[root_a] < self._size[root_b]:
+            root_a, root_b = root_b, root_a
+
+        self._parent[root_b] = root_a
+        self._size[root_a] += self._size[root_b]
+        return root_a
+
+    def groups(self) -> Dict[Hashable, List[Hashable]]:
+        """Множества из двух и более элементов по корню"""
+
+        groups: Dict[Hashable, List[Hashable]] = {}
+        for item in self._parent:
+            groups.setdefault(self.find(item), []).append(item)
+
+        return {root: items for root, items in groups.items() if len(items) > 1}
+
+
+class DuplicateIndex:
+    """
+    Блокирующий индекс: нормализованный ключ -> id сделок с этим ключом.
+
+    Сделки сравниваются только внутри блока одного ключа, поэтому
+    построение групп линейно по суммарному числу ключей.
+    """
+
+    def __init__(self):
+        self._blocks: Dict[MatchKey, List[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._blocks)
+
+    def add(self, lead_id: int, keys: Iterable[MatchKey]) -> None:
+        for key in keys:
+            lead_ids = self._blocks.setdefault(key, [])
+            if lead_id not in lead_ids[-1:]:
+                lead_ids.append(lead_id)
+
+    def remove(self, lead_id: int, keys: Iterable[MatchKey]) -> None:
+        """Убирает сделку из блоков ключей (при изменении или удалении сделки)"""
+
+        for key in keys:
+            lead_ids = self._blocks.get(key)
+            if lead_ids is None:
+                continue
+            while lead_id in lead_ids:
+                lead_ids.remove(lead_id)
+            if not lead_ids:
+                del self._blocks[key]
+
+    def candidates(self, keys: Iterable[MatchKey]) -> Set[int]:
+        """Сделки, у которых есть хотя бы один из ключей"""
+
+        found: Set[int] = set()
+        for key in keys:
+            found.update(self._blocks.get(key, ()))
+        return found
+
+    def blocks(self) -> Iterator[Tuple[MatchKey, List[int]]]:
+        """Блоки, в которых больше одной сделки"""
+
+        for key, lead_ids in self._blocks.items():
+            if len(lead_ids) > 1:
+                yield key, lead_ids
+
+
+Block = Tuple[Iterable[str], List[int]]
+
+
+def union_blocks(blocks: Iterable[Block]) -> List[Tuple[Set[str], List[int]]]:
+    """
+    Объединение сделок с общими ключами через union-find.
+
+    blocks - пары (признаки совпадения, id сделок блока). Возвращает
+    компоненты в том же виде, поэтому результаты разных наборов блоков
+    можно объединить повторным вызовом.
+    """
+
+    union_find = UnionFind()
+    matched_by: Dict[int, Set[str]] = {}
+
+    for kinds, lead_ids in blocks:
+        first = lead_ids[0]
+        for lead_id in lead_ids[1:]:
+            union_find.union(first, lead_id)
+        matched_by.setdefault(first, set()).update(kinds)
+
+    kinds_by_root: Dict[Hashable, Set[str]] = {}
+    for lead_id, kinds in matched_by.items():
+        kinds_by_root.setdefault(union_find.find(lead_id), set()).update(kinds)
+
+    return [
+        (kinds_by_root.get(root, set()), lead_ids)
+        for root, lead_ids in union_find.groups().items()
+    ]
+
+
+def index_blocks(index: DuplicateIndex) -> Iterator[Block]:
+    """Блоки индекса с признаком совпадения (phone, email, field, ...)"""
+
+    for (kind, _), lead_ids in index.blocks():
+        yield (kind.split(":", 1)[0],), lead_ids
+
+
+def iter_groups_from_blocks(
+    blocks: Iterable[Block],
+    created_at: Dict[int, int],
+    after: Optional[int] = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Группы дублей из блоков.
+
+    Основная сделка группы - самая ранняя по created_at (при равенстве - меньший id).
+    Группы отдаются по возрастанию id основной сделки; after - курсор:
+    группы с primary_lead_id <= after пропускаются. Порядок известен только
+    после объединения всех блоков, поэтому компоненты строятся в памяти
+    целиком до первой группы.
+    """
+
+    def sort_key(lead_id: int) -> Tuple[int, int]:
+        return created_at.get(lead_id, 0), lead_id
+
+    components = union_blocks(blocks)
+    primaries = sorted(
+        (min(lead_ids, key=sort_key), number)
+        for number, (_, lead_ids) in enumerate(components)
+    )
+
+    for primary_lead_id, number in primaries:
+        if after is not None and primary_lead_id <= after:
+            continue
+
+        kinds, lead_ids = components[number]
+        yield {
+            "primary_lead_id": primary_lead_id,
+            "lead_ids": sorted(lead_ids, key=sort_key),
+            "matched_by": sorted(kinds),
+        }
+
+
+def iter_duplicate_groups(
+    index: DuplicateIndex,
+    created_at: Dict[int, int],
+    after: Optional[int] = None,
+) -> Iterator[Dict[str, Any]]:
+    """Объединение сделок с общими ключами индекса в группы дублей"""
+
+    return iter_groups_from_blocks(index_blocks(index), created_at, after)
+
+
+def build_duplicate_groups(
+    index: DuplicateIndex, created_at: Dict[int, int]
+) -> List[Dict[str, Any]]:
+    """Все группы дублей списком"""
+
+    return list(iter_duplicate_groups(index, created_at))
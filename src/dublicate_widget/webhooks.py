@@ -0,0 +1,296 @@
+import asyncio
+import re
+from typing import Any, Dict, List, Optional, Set, Tuple
+from urllib.parse import parse_qsl
+
+from loguru import logger
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.amocrm.cache import amo_cache
+from src.amocrm.client import amo_client
+from src.amocrm.loader import AmoLoaders
+from src.amocrm.services import build_headers
+from src.common.config import (
+    WEBHOOK_BATCH_SIZE,
+    WEBHOOK_BATCH_WINDOW,
+    WEBHOOK_RETRY_ATTEMPTS,
+    WEBHOOK_RETRY_DELAY,
+)
+from src.common.database import async_session_maker
+from src.common.deadline import detached_context
+from src.common.token_service import get_tokens_from_service
+from src.dublicate_widget.repository import save_duplicate_groups
+from src.dublicate_widget.scanner import ScanScheduler, TenantScan, scan_scheduler
+from src.dublicate_widget.services import _is_not_found
+
+# leads[add][0][id]=1&leads[update][0][pipeline_id]=2&account[subdomain]=example
+_ENTITY_FIELD_RE = re.compile(
+    r"^(leads|contacts|companies)\[(\w+)\]\[(\d+)\]\[(\w+)\]$"
+)
+
+
+def parse_webhook(
+    body: bytes,
+) -> Tuple[Optional[str], Dict[int, bool], Dict[str, Set[int]]]:
+    """
+    Разбор form-encoded вебхука amoCRM.
+
+    Возвращает subdomain, события по сделкам: id -> удалена ли сделка,
+    и id измененных контактов и компаний по типу сущности. Повторные
+    события одной сделки схлопываются, удаление побеждает.
+    """
+
+    subdomain = None
+    events: Dict[Tuple[str, str, str], Dict[str, str]] = {}
+    for name, value in parse_qsl(body.decode("utf-8"), keep_blank_values=True):
+        if name == "account[subdomain]":
+            subdomain = value
+            continue
+        match = _ENTITY_FIELD_RE.match(name)
+        if match:
+            entity, action, number, field = match.groups()
+            events.setdefault((entity, action, number), {})[field] = value
+
+    leads: Dict[int, bool] = {}
+    related: Dict[str, Set[int]] = {}
+    for (entity, action, _), fields in events.items():
+        if not fields.get("id", "").isdigit():
+            continue
+        entity_id = int(fields["id"])
+        if entity == "leads":
+            leads[entity_id] = leads.get(entity_id, False) or action == "delete"
+        else:
+            related.setdefault(entity, set()).add(entity_id)
+    return subdomain, leads, related
+
+
+class WebhookBatcher:
+    """
+    Микробатчи событий вебхуков по аккаунтам.
+
+    События копятся до batch_size сделок или window секунд с первого
+    события, повторы одной сделки схлопываются. На окно выполняется одна
+    проверка: сделки догружаются списочными запросами и переиндексируются
+    в подписанных воронках (ScanScheduler). Проверки одного аккаунта
+    идут по очереди. Пачка, в которой сделку не удалось загрузить
+    (429, 5xx, разомкнутый breaker), не применяется и повторяется
+    через retry_delay * 2 ** n секунд, не больше retry_attempts раз.
+    """
+
+    def __init__(
+        self,
+        scheduler: ScanScheduler = scan_scheduler,
+        window: float = WEBHOOK_BATCH_WINDOW,
+        batch_size: int = WEBHOOK_BATCH_SIZE,
+        retry_attempts: int = WEBHOOK_RETRY_ATTEMPTS,
+        retry_delay: float = WEBHOOK_RETRY_DELAY,
+    ):
+        self.scheduler = scheduler
+        self.window = window
+        self.batch_size = batch_size
+        self.retry_attempts = retry_attempts
+        self.retry_delay = retry_delay
+        self._buffers: Dict[str, Dict[int, bool]] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._retries: Set[asyncio.TimerHandle] = set()
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    def add(self, subdomain: str, leads: Dict[int, bool]) -> None:
+        buffer = self._buffers.setdefault(subdomain, {})
+        for lead_id, deleted in leads.items():
+            buffer[lead_id] = buffer.get(lead_id, False) or deleted
+
+        if len(buffer) >= self.batch_size:
+            self._flush(subdomain)
+        elif subdomain not in self._timers:
+            self._timers[subdomain] = asyncio.get_running_loop().call_later(
+                self.window, self._flush, subdomain, context=detached_context()
+            )
+
+    def _flush(self, subdomain: str) -> None:
+        timer = self._timers.pop(subdomain, None)
+        if timer is not None:
+            timer.cancel()
+
+        leads = self._buffers.pop(subdomain, None)
+        if leads:
+            self._submit(subdomain, leads, 0)
+
+    def _submit(self, subdomain: str, leads: Dict[int, bool], attempt: int) -> None:
+        # Пачка собрана из разных вебхуков: дедлайн первого к ней не относится
+        task = asyncio.create_task(
+            self._check(subdomain, leads, attempt), context=detached_context()
+        )
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def invalidate(self, subdomain: str, related: Dict[str, Set[int]]) -> None:
+        """
+        Сброс измененных контактов и компаний в amo_cache.
+
+        Сделки при этом не переиндексируются: новые телефоны и email
+        попадут в индекс при следующей проверке или скане связанных сделок.
+        """
+
+        await asyncio.gather(
+            *(
+                amo_cache.invalidate(subdomain, entity, entity_id)
+                for entity, entity_ids in related.items()
+                for entity_id in entity_ids
+            )
+        )
+
+    async def close(self) -> None:
+        """Отправляет накопленные события и дожидается проверок"""
+
+        for subdomain in list(self._buffers):
+            self._flush(subdomain)
+        for handle in self._retries:
+            handle.cancel()
+        if self._retries:
+            logger.warning(f"Dropped {len(self._retries)} pending webhook retries")
+            self._retries.clear()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _check(
+        self, subdomain: str, leads: Dict[int, bool], attempt: int = 0
+    ) -> None:
+        lock = self._locks.setdefault(subdomain, asyncio.Lock())
+        async with lock:
+            try:
+                groups = await self.check(subdomain, leads)
+            except Exception as e:
+                self._retry(subdomain, leads, attempt, e)
+                return
+
+        if groups:
+            logger.info(
+                f"Webhook check for {subdomain}: {len(leads)} leads, "
+                f"{len(groups)} duplicate groups"
+            )
+
+    def _retry(
+        self,
+        subdomain: str,
+        leads: Dict[int, bool],
+        attempt: int,
+        error: Exception,
+    ) -> None:
+        if attempt >= self.retry_attempts:
+            logger.error(
+                f"Webhook duplicate check failed for {subdomain}, "
+                f"{len(leads)} leads dropped after {attempt + 1} attempts: {error}"
+            )
+            return
+
+        delay = self.retry_delay * 2**attempt
+        logger.warning(
+            f"Webhook duplicate check failed for {subdomain} ({error}), "
+            f"retry in {delay:.0f}s"
+        )
+
+        def resubmit() -> None:
+            self._retries.discard(handle)
+            self._submit(subdomain, leads, attempt + 1)
+
+        handle = asyncio.get_running_loop().call_later(delay, resubmit)
+        self._retries.add(handle)
+
+    async def check(
+        self, subdomain: str, leads: Dict[int, bool]
+    ) -> List[Dict[str, Any]]:
+        """
+        Одна проверка на окно: обновляет индексы воронок и отдает затронутые группы.
+
+        Из индекса убираются только сделки, удаленные по вебхуку, не найденные
+        в amoCRM (404) или не подходящие под фильтр воронки. Любая другая
+        ошибка загрузки прерывает проверку до изменения индексов.
+        """
+
+        tenants = self.scheduler.tenants(subdomain)
+        if not tenants:
+            logger.debug(f"No scheduled scans for {subdomain}, webhook skipped")
+            return []
+
+        # Данные в кеше устарели: сделки изменились
+        await asyncio.gather(
+            *(amo_cache.invalidate(subdomain, "leads", lead_id) for lead_id in leads)
+        )
+
+        tokens = await get_tokens_from_service(subdomain)
+        headers = build_headers(tokens["access_token"])
+        loaders = AmoLoaders(subdomain, headers, amo_client)
+        gone = {lead_id for lead_id, deleted in leads.items() if deleted}
+        alive = [lead_id for lead_id, deleted in leads.items() if not deleted]
+        results = await asyncio.gather(
+            *(loaders.leads.load(lead_id) for lead_id in alive),
+            return_exceptions=True,
+        )
+
+        loaded: List[Dict[str, Any]] = []
+        for lead_id, result in zip(alive, results):
+            if not isinstance(result, BaseException):
+                loaded.append(result)
+            elif _is_not_found(result):
+                gone.add(lead_id)
+            else:
+                raise result
+
+        groups: List[Dict[str, Any]] = []
+        async with async_session_maker() as session:
+            for tenant in tenants:
+                async with tenant.lock:
+                    tenant_groups = await self._check_tenant(
+                        session, tenant, gone, loaded, headers
+                    )
+                groups.extend(tenant_groups)
+        return groups
+
+    async def _check_tenant(
+        self,
+        session: AsyncSession,
+        tenant: TenantScan,
+        gone: Set[int],
+        loaded: List[Dict[str, Any]],
+        headers: dict,
+    ) -> List[Dict[str, Any]]:
+        # До первого полного скана индекса нет, сделки попадут в него сами
+        if tenant.high_water_mark is None:
+            return []
+
+        tenant.materialize()
+        records = [tenant.project(lead) for lead in loaded]
+        matching = [lead for lead in records if tenant.matches(lead)]
+        removed = gone | {lead.id for lead in records if not tenant.matches(lead)}
+
+        # apply_many может упасть на загрузке контактов: до него индекс не трогаем
+        affected = set(await tenant.apply_many(amo_client, headers, matching))
+        for lead_id in removed:
+            if lead_id in tenant.index:
+                affected.add(lead_id)
+                affected.update(tenant.discard(lead_id))
+
+        groups = tenant.affected_groups(affected)
+        try:
+            await save_duplicate_groups(
+                session,
+                tenant.subdomain,
+                tenant.pipeline_id,
+                groups,
+                lead_ids=affected,
+            )
+            await session.commit()
+        except Exception:
+            # В базе остались старые группы: пересобираем индекс полным сканом
+            tenant.reset()
+            await session.rollback()
+            raise
+
+        if affected:
+            tenant.schedule_snapshot()
+        return groups
+
+
+webhook_batcher = WebhookBatcher()
@@ -1,10 +1,23 @@
 import asyncio
 
 import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from starlette.middleware.cors import CORSMiddleware
 
+from src.amocrm.cache import amo_cache
+from src.amocrm.client import amo_client
+from src.common.config import HTTP_REQUEST_TIMEOUT
+from src.common.deadline import DeadlineMiddleware
 from src.common.log_config import setup_logging
+from src.dublicate_widget.parallel import shutdown_executor
+from src.dublicate_widget.routers import router as duplicate_router
+from src.dublicate_widget.scanner import scan_scheduler
+from src.dublicate_widget.webhooks import webhook_batcher
+from src.mirror.routers import router as mirror_router
+from src.mirror.sync import mirror_scheduler
+from src.rabbitmq.rmq_sender import close_publishers
+from src.rabbitmq.rpc_consumer import rpc_client
 from loguru import logger
 
 app = FastAPI(title="Duplication_widget")
@@ -16,6 +29,15 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(DeadlineMiddleware, default_timeout=HTTP_REQUEST_TIMEOUT)
+
+app.include_router(duplicate_router)
+app.include_router(mirror_router)
+
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
 
 
 @app.post("/test_log")
@@ -26,9 +48,26 @@ def test_log():
 @app.on_event("startup")
 async def startup_event():
     setup_logging()
+    await amo_client.start()
+    await amo_cache.start()
+    scan_scheduler.start()
+    mirror_scheduler.start()
     logger.info("Виджет дубли сделок запущен.")
     loop = asyncio.get_event_loop()
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    scan_scheduler.shutdown()
+    mirror_scheduler.shutdown()
+    await webhook_batcher.close()
+    await scan_scheduler.flush_snapshots()
+    shutdown_executor()
+    await amo_client.close()
+    await amo_cache.close()
+    await rpc_client.close()
+    await close_publishers()
+
+
 if __name__ == "__main__":
     uvicorn.run("main:app", reload=True)
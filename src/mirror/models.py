@@ -0,0 +1,139 @@
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    DateTime,
+    Index,
+    String,
+    Text,
+    func,
+    text,
+)
+from sqlalchemy.dialects.postgresql import ARRAY
+
+from src.common.database import Base
+
+
+class AmoLead(Base):
+    """Копия сделки amoCRM; deleted_at - время удаления в amoCRM (timestamp)"""
+
+    __tablename__ = "amo_leads"
+
+    subdomain = Column(String(255), primary_key=True)
+    id = Column(BigInteger, primary_key=True)
+    name = Column(Text)
+    pipeline_id = Column(BigInteger)
+    status_id = Column(BigInteger)
+    responsible_user_id = Column(BigInteger)
+    company_ids = Column(ARRAY(BigInteger), nullable=False, server_default="{}")
+    created_at = Column(BigInteger, nullable=False)
+    updated_at = Column(BigInteger, nullable=False)
+    deleted_at = Column(BigInteger)
+    synced_at = Column(
+        DateTime(timezone=True), nullable=False, server_default=func.now()
+    )
+
+    __table_args__ = (
+        Index(
+            "ix_amo_leads_pipeline",
+            "subdomain",
+            "pipeline_id",
+            "status_id",
+            postgresql_where=text("deleted_at IS NULL"),
+        ),
+        Index("ix_amo_leads_updated_at", "subdomain", "updated_at"),
+    )
+
+
+class AmoLeadContact(Base):
+    """Связь сделки с контактом"""
+
+    __tablename__ = "amo_lead_contacts"
+
+    subdomain = Column(String(255), primary_key=True)
+    lead_id = Column(BigInteger, primary_key=True)
+    contact_id = Column(BigInteger, primary_key=True)
+
+    __table_args__ = (Index("ix_amo_lead_contacts_contact", "subdomain", "contact_id"),)
+
+
+class AmoLeadField(Base):
+    """Нормализованное значение кастомного поля сделки (normalize_field_value)"""
+
+    __tablename__ = "amo_lead_fields"
+
+    subdomain = Column(String(255), primary_key=True)
+    lead_id = Column(BigInteger, primary_key=True)
+    field_id = Column(BigInteger, primary_key=True)
+    value = Column(Text, primary_key=True)
+
+    __table_args__ = (
+        Index("ix_amo_lead_fields_value", "subdomain", "field_id", "value"),
+    )
+
+
+class AmoContact(Base):
+    """Копия контакта amoCRM"""
+
+    __tablename__ = "amo_contacts"
+
+    subdomain = Column(String(255), primary_key=True)
+    id = Column(BigInteger, primary_key=True)
+    name = Column(Text)
+    responsible_user_id = Column(BigInteger)
+    created_at = Column(BigInteger, nullable=False)
+    updated_at = Column(BigInteger, nullable=False)
+    deleted_at = Column(BigInteger)
+    synced_at = Column(
+        DateTime(timezone=True), nullable=False, server_default=func.now()
+    )
+
+    __table_args__ = (Index("ix_amo_contacts_updated_at", "subdomain", "updated_at"),)
+
+
+class AmoContactKey(Base):
+    """Нормализованный телефон или email контакта (kind - phone/email)"""
+
+    __tablename__ = "amo_contact_keys"
+
+    subdomain = Column(String(255), primary_key=True)
+    contact_id = Column(BigInteger, primary_key=True)
+    kind = Column(String(16), primary_key=True)
+    value = Column(Text, primary_key=True)
+
+    __table_args__ = (Index("ix_amo_contact_keys_value", "subdomain", "kind", "value"),)
+
+
+class AmoCompany(Base):
+    """Копия компании amoCRM"""
+
+    __tablename__ = "amo_companies"
+
+    subdomain = Column(String(255), primary_key=True)
+    id = Column(BigInteger, primary_key=True)
+    name = Column(Text)
+    responsible_user_id = Column(BigInteger)
+    created_at = Column(BigInteger, nullable=False)
+    updated_at = Column(BigInteger, nullable=False)
+    deleted_at = Column(BigInteger)
+    synced_at = Column(
+        DateTime(timezone=True), nullable=False, server_default=func.now()
+    )
+
+
+class SyncState(Base):
+    """
+    Состояние синхронизации сущности аккаунта.
+
+    high_water_mark - updated_at (для events - created_at), с которого
+    начнется следующая инкрементальная синхронизация.
+    """
+
+    __tablename__ = "amo_sync_state"
+
+    subdomain = Column(String(255), primary_key=True)
+    entity = Column(String(16), primary_key=True)
+    high_water_mark = Column(BigInteger)
+    full_synced_at = Column(DateTime(timezone=True))
+    synced_at = Column(
+        DateTime(timezone=True), nullable=False, server_default=func.now()
+    )
@@ -0,0 +1,378 @@
+"""
+Хранение копии сделок, контактов и компаний amoCRM в Postgres.
+
+Страницы сущностей пишутся пачкой: COPY во временные staging-таблицы
+той же структуры, затем upsert основной таблицы и замена дочерних строк
+(связей с контактами, значений полей, телефонов и email) set-based
+запросами. Поиск дублей по копии - агрегация по индексам ключей.
+"""
+
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import func, select, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.common.database import copy_records
+from src.mirror.models import SyncState
+
+# Дочерняя таблица: (таблица, колонка с id родителя, остальные колонки)
+ChildTable = Tuple[str, str, Tuple[str, ...]]
+
+# Сущность amoCRM -> (таблица, колонки без subdomain, дочерние таблицы)
+MIRROR_TABLES: Dict[str, Tuple[str, Tuple[str, ...], Tuple[ChildTable, ...]]] = {
+    "leads": (
+        "amo_leads",
+        (
+            "id",
+            "name",
+            "pipeline_id",
+            "status_id",
+            "responsible_user_id",
+            "company_ids",
+            "created_at",
+            "updated_at",
+        ),
+        (
+            ("amo_lead_contacts", "lead_id", ("contact_id",)),
+            ("amo_lead_fields", "lead_id", ("field_id", "value")),
+        ),
+    ),
+    "contacts": (
+        "amo_contacts",
+        ("id", "name", "responsible_user_id", "created_at", "updated_at"),
+        (("amo_contact_keys", "contact_id", ("kind", "value")),),
+    ),
+    "companies": (
+        "amo_companies",
+        ("id", "name", "responsible_user_id", "created_at", "updated_at"),
+        (),
+    ),
+}
+
+UPSERT_ENTITIES = """
+INSERT INTO {table} (subdomain, {columns})
+SELECT DISTINCT ON (id) subdomain, {columns}
+FROM staging_{table}
+ORDER BY id, updated_at DESC
+ON CONFLICT (subdomain, id) DO UPDATE
+SET {updates}, deleted_at = NULL, synced_at = now()
+"""
+
+DELETE_CHILDREN = """
+DELETE FROM {child} c
+USING staging_{table} s
+WHERE c.subdomain = s.subdomain AND c.{parent} = s.id
+"""
+
+INSERT_CHILDREN = """
+INSERT INTO {child} (subdomain, {parent}, {columns})
+SELECT DISTINCT subdomain, {parent}, {columns}
+FROM staging_{child}
+ON CONFLICT DO NOTHING
+"""
+
+MARK_DELETED = """
+UPDATE {table} t
+SET deleted_at = d.deleted_at, synced_at = now()
+FROM unnest(CAST(:ids AS bigint[]), CAST(:deleted_at AS bigint[])) AS d(id, deleted_at)
+WHERE t.subdomain = :subdomain AND t.id = d.id
+"""
+
+COUNT_ENTITIES = """
+SELECT count(*) FILTER (WHERE deleted_at IS NULL), count(*) FILTER (WHERE deleted_at IS NOT NULL)
+FROM {table}
+WHERE subdomain = :subdomain
+"""
+
+# Сделки воронки по фильтру поиска дублей; условия подставляет _leads_query
+PIPELINE_LEADS = """
+WITH leads AS (
+    SELECT id, name, company_ids, created_at
+    FROM amo_leads
+    WHERE subdomain = :subdomain AND pipeline_id = :pipeline_id
+      AND deleted_at IS NULL{conditions}
+)
+"""
+
+LEADS = """
+SELECT id, created_at, name FROM leads
+"""
+
+# Блоки ключей совпадения (как у DuplicateIndex.blocks): контакт, телефон и
+# email неудаленного контакта, значение выбранного поля
+DUPLICATE_BLOCKS = """
+SELECT 'contact', lc.contact_id::text, array_agg(lc.lead_id)
+FROM amo_lead_contacts lc
+JOIN leads l ON l.id = lc.lead_id
+WHERE lc.subdomain = :subdomain
+  AND NOT EXISTS (
+      SELECT 1 FROM amo_contacts c
+      WHERE c.subdomain = lc.subdomain AND c.id = lc.contact_id
+        AND c.deleted_at IS NOT NULL
+  )
+GROUP BY lc.contact_id
+HAVING count(*) > 1
+UNION ALL
+SELECT k.kind, k.value, array_agg(DISTINCT lc.lead_id)
+FROM amo_contact_keys k
+JOIN amo_contacts c
+  ON c.subdomain = k.subdomain AND c.id = k.contact_id AND c.deleted_at IS NULL
+JOIN amo_lead_contacts lc
+  ON lc.subdomain = k.subdomain AND lc.contact_id = k.contact_id
+JOIN leads l ON l.id = lc.lead_id
+WHERE k.subdomain = :subdomain
+GROUP BY k.kind, k.value
+HAVING count(DISTINCT lc.lead_id) > 1
+UNION ALL
+SELECT 'field:' || f.field_id, f.value, array_agg(f.lead_id)
+FROM amo_lead_fields f
+JOIN leads l ON l.id = f.lead_id
+WHERE f.subdomain = :subdomain AND f.field_id = ANY(:custom_field_ids)
+GROUP BY f.field_id, f.value
+HAVING count(*) > 1
+"""
+
+CONTACT_NAMES = """
+SELECT c.id, c.name, array_agg(lc.lead_id)
+FROM amo_lead_contacts lc
+JOIN leads l ON l.id = lc.lead_id
+JOIN amo_contacts c
+  ON c.subdomain = lc.subdomain AND c.id = lc.contact_id AND c.deleted_at IS NULL
+WHERE lc.subdomain = :subdomain
+GROUP BY c.id, c.name
+"""
+
+COMPANY_NAMES = """
+SELECT co.id, co.name, array_agg(l.id)
+FROM leads l
+CROSS JOIN LATERAL unnest(l.company_ids) AS lc(company_id)
+JOIN amo_companies co
+  ON co.subdomain = :subdomain AND co.id = lc.company_id AND co.deleted_at IS NULL
+GROUP BY co.id, co.name
+"""
+
+
+async def save_entities(
+    session: AsyncSession,
+    subdomain: str,
+    entity: str,
+    rows: Iterable[Tuple[Any, ...]],
+    children: Dict[str, Iterable[Tuple[Any, ...]]],
+) -> None:
+    """
+    Сохраняет пачку сущностей (без commit).
+
+    rows - строки основной таблицы в порядке колонок MIRROR_TABLES,
+    children - строки дочерних таблиц (id родителя, колонки). Дочерние
+    строки сохраненных сущностей заменяются целиком, удаленные в amoCRM
+    сущности, попавшие в пачку, считаются восстановленными.
+    """
+
+    table, columns, child_tables = MIRROR_TABLES[entity]
+    staging_tables = [table, *(child for child, _, _ in child_tables)]
+
+    await session.execute(
+        text(
+            "DROP TABLE IF EXISTS "
+            + ", ".join(f"pg_temp.staging_{name}" for name in staging_tables)
+        )
+    )
+    for name in staging_tables:
+        await session.execute(
+            text(
+                f"CREATE TEMP TABLE staging_{name} (LIKE {name} INCLUDING DEFAULTS) "
+                "ON COMMIT DROP"
+            )
+        )
+
+    await copy_records(
+        session,
+        f"staging_{table}",
+        ("subdomain", *columns),
+        ((subdomain, *row) for row in rows),
+    )
+    for child, parent, child_columns in child_tables:
+        await copy_records(
+            session,
+            f"staging_{child}",
+            ("subdomain", parent, *child_columns),
+            ((subdomain, *row) for row in children.get(child, ())),
+        )
+
+    updates = ", ".join(
+        f"{column} = EXCLUDED.{column}" for column in columns if column != "id"
+    )
+    await session.execute(
+        text(
+            UPSERT_ENTITIES.format(
+                table=table, columns=", ".join(columns), updates=updates
+            )
+        )
+    )
+    for child, parent, child_columns in child_tables:
+        await session.execute(
+            text(DELETE_CHILDREN.format(child=child, table=table, parent=parent))
+        )
+        await session.execute(
+            text(
+                INSERT_CHILDREN.format(
+                    child=child, parent=parent, columns=", ".join(child_columns)
+                )
+            )
+        )
+
+
+async def mark_deleted(
+    session: AsyncSession,
+    subdomain: str,
+    entity: str,
+    deleted_at: Dict[int, Optional[int]],
+) -> None:
+    """Отмечает удаление сущностей (timestamp) или восстановление (None)"""
+
+    if not deleted_at:
+        return
+
+    table, _, _ = MIRROR_TABLES[entity]
+    await session.execute(
+        text(MARK_DELETED.format(table=table)),
+        {
+            "subdomain": subdomain,
+            "ids": list(deleted_at),
+            "deleted_at": list(deleted_at.values()),
+        },
+    )
+
+
+async def get_sync_state(session: AsyncSession, subdomain: str) -> Dict[str, int]:
+    """High-water mark синхронизации по сущностям аккаунта"""
+
+    result = await session.execute(
+        select(SyncState.entity, SyncState.high_water_mark).where(
+            SyncState.subdomain == subdomain
+        )
+    )
+    return {
+        entity: high_water_mark
+        for entity, high_water_mark in result
+        if high_water_mark is not None
+    }
+
+
+async def save_sync_state(
+    session: AsyncSession,
+    subdomain: str,
+    entity: str,
+    high_water_mark: int,
+    full: bool = False,
+) -> None:
+    values = {"high_water_mark": high_water_mark, "synced_at": func.now()}
+    if full:
+        values["full_synced_at"] = func.now()
+
+    statement = insert(SyncState).values(subdomain=subdomain, entity=entity, **values)
+    await session.execute(
+        statement.on_conflict_do_update(
+            index_elements=[SyncState.subdomain, SyncState.entity], set_=values
+        )
+    )
+
+
+async def get_sync_status(
+    session: AsyncSession, subdomain: str
+) -> List[Dict[str, Any]]:
+    """Состояние синхронизации и число сущностей в копии по сущностям аккаунта"""
+
+    result = await session.execute(
+        select(SyncState).where(SyncState.subdomain == subdomain)
+    )
+    states = {state.entity: state for state in result.scalars()}
+
+    status = []
+    for entity, (table, _, _) in MIRROR_TABLES.items():
+        count, deleted = (
+            await session.execute(
+                text(COUNT_ENTITIES.format(table=table)), {"subdomain": subdomain}
+            )
+        ).one()
+        state = states.get(entity)
+        status.append(
+            {
+                "entity": entity,
+                "count": count,
+                "deleted": deleted,
+                "high_water_mark": state and state.high_water_mark,
+                "synced_at": state and state.synced_at,
+                "full_synced_at": state and state.full_synced_at,
+            }
+        )
+    return status
+
+
+def _leads_query(
+    query: str,
+    subdomain: str,
+    pipeline_id: int,
+    statuses_ids: Optional[List[int]] = None,
+    responsible_user_id: Optional[int] = None,
+    **params,
+) -> Tuple[Any, Dict[str, Any]]:
+    """Запрос по сделкам воронки: CTE leads с условиями фильтра + query"""
+
+    conditions = ""
+    params = {"subdomain": subdomain, "pipeline_id": pipeline_id, **params}
+    if statuses_ids:
+        conditions += "\n      AND status_id = ANY(:statuses_ids)"
+        params["statuses_ids"] = statuses_ids
+    if responsible_user_id:
+        conditions += "\n      AND responsible_user_id = :responsible_user_id"
+        params["responsible_user_id"] = responsible_user_id
+
+    return text(PIPELINE_LEADS.format(conditions=conditions) + query), params
+
+
+async def _stream(
+    session: AsyncSession, query: str, **filter_params
+) -> AsyncIterator[Tuple[Any, ...]]:
+    statement, params = _leads_query(query, **filter_params)
+    result = await session.stream(statement, params)
+    async for row in result:
+        yield tuple(row)
+
+
+def iter_pipeline_leads(
+    session: AsyncSession, **filter_params
+) -> AsyncIterator[Tuple[Any, ...]]:
+    """Сделки воронки: (id, created_at, name)"""
+
+    return _stream(session, LEADS, **filter_params)
+
+
+def iter_duplicate_blocks(
+    session: AsyncSession, custom_field_ids: Iterable[int] = (), **filter_params
+) -> AsyncIterator[Tuple[Any, ...]]:
+    """Блоки ключей совпадения сделок воронки: (вид ключа, значение, id сделок)"""
+
+    return _stream(
+        session,
+        DUPLICATE_BLOCKS,
+        custom_field_ids=list(custom_field_ids),
+        **filter_params,
+    )
+
+
+def iter_contact_names(
+    session: AsyncSession, **filter_params
+) -> AsyncIterator[Tuple[Any, ...]]:
+    """Контакты сделок воронки: (id, название, id сделок)"""
+
+    return _stream(session, CONTACT_NAMES, **filter_params)
+
+
+def iter_company_names(
+    session: AsyncSession, **filter_params
+) -> AsyncIterator[Tuple[Any, ...]]:
+    """Компании сделок воронки: (id, название, id сделок)"""
+
+    return _stream(session, COMPANY_NAMES, **filter_params)
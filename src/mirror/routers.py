@@ -0,0 +1,53 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.common.database import get_async_session
+from src.mirror.repository import get_sync_status
+from src.mirror.schemas import (
+    MirrorStateSchemaResponse,
+    MirrorSyncSchema,
+    MirrorSyncSchemaResponse,
+)
+from src.mirror.sync import mirror_scheduler
+
+router = APIRouter(prefix="/mirror", tags=["Mirror"])
+
+
+@router.post("/sync", response_model=MirrorSyncSchemaResponse)
+async def subscribe_to_sync(data: MirrorSyncSchema):
+    """
+    Подписка аккаунта на синхронизацию копии сделок, контактов и компаний.
+
+    Синхронизация запускается сразу и дальше идет периодически;
+    full=True загружает сущности заново целиком.
+    """
+
+    mirror_scheduler.register(data.subdomain, full=data.full)
+    return {
+        "subdomain": data.subdomain,
+        "interval": mirror_scheduler.interval,
+        "full": data.full,
+    }
+
+
+@router.delete("/sync")
+async def unsubscribe_from_sync(subdomain: str):
+    """Отключение синхронизации аккаунта (данные копии остаются)"""
+
+    if subdomain not in mirror_scheduler:
+        raise HTTPException(status_code=404, detail="Sync is not scheduled")
+    mirror_scheduler.unregister(subdomain)
+    return {"status": "ok"}
+
+
+@router.get("/state", response_model=MirrorStateSchemaResponse)
+async def get_sync_state(
+    subdomain: str, session: AsyncSession = Depends(get_async_session)
+):
+    """Состояние синхронизации копии аккаунта"""
+
+    return {
+        "subdomain": subdomain,
+        "scheduled": subdomain in mirror_scheduler,
+        "entities": await get_sync_status(session, subdomain),
+    }
@@ -0,0 +1,30 @@
+from datetime import datetime
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+
+class MirrorSyncSchema(BaseModel):
+    subdomain: str
+    full: bool = False
+
+
+class MirrorSyncSchemaResponse(BaseModel):
+    subdomain: str
+    interval: float
+    full: bool
+
+
+class MirrorEntityStateSchema(BaseModel):
+    entity: str
+    count: int
+    deleted: int
+    high_water_mark: Optional[int] = None
+    synced_at: Optional[datetime] = None
+    full_synced_at: Optional[datetime] = None
+
+
+class MirrorStateSchemaResponse(BaseModel):
+    subdomain: str
+    scheduled: bool
+    entities: List[MirrorEntityStateSchema]
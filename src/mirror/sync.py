@@ -0,0 +1,365 @@
+import asyncio
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from aiohttp import ClientSession
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from loguru import logger
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.amocrm.client import amo_client
+from src.amocrm.normalize import (
+    get_embedded_ids,
+    iter_custom_field_values,
+    normalize_field_value,
+)
+from src.amocrm.records import ContactRecord
+from src.amocrm.services import (
+    build_headers,
+    iter_entities,
+    iter_entities_by_updated_at,
+)
+from src.common.config import (
+    MIRROR_COPY_BATCH_SIZE,
+    MIRROR_SYNC_CONCURRENCY,
+    MIRROR_SYNC_INTERVAL,
+    MIRROR_SYNC_JITTER,
+    MIRROR_SYNC_OVERLAP,
+)
+from src.common.database import async_session_maker
+from src.common.token_service import get_tokens_from_service
+from src.dublicate_widget.utils import contact_match_keys
+from src.mirror.repository import (
+    get_sync_state,
+    mark_deleted,
+    save_entities,
+    save_sync_state,
+)
+
+ENTITIES = ("leads", "contacts", "companies")
+
+# Тип события amoCRM -> (сущность, удалена ли она событием)
+DELETION_EVENTS = {
+    "lead_deleted": ("leads", True),
+    "lead_restored": ("leads", False),
+    "contact_deleted": ("contacts", True),
+    "contact_restored": ("contacts", False),
+    "company_deleted": ("companies", True),
+    "company_restored": ("companies", False),
+}
+EVENTS_PAGE_LIMIT = 100
+
+# Строка основной таблицы и строки дочерних таблиц одной сущности
+EntityRows = Tuple[Tuple[Any, ...], Dict[str, List[Tuple[Any, ...]]]]
+
+
+def lead_rows(lead: Dict[str, Any]) -> EntityRows:
+    lead_id = lead["id"]
+    row = (
+        lead_id,
+        lead.get("name"),
+        lead.get("pipeline_id"),
+        lead.get("status_id"),
+        lead.get("responsible_user_id"),
+        get_embedded_ids(lead, "companies"),
+        lead.get("created_at") or 0,
+        lead.get("updated_at") or 0,
+    )
+    fields = {
+        (lead_id, field_id, normalized)
+        for field_id, _, value in iter_custom_field_values(lead)
+        if field_id is not None and (normalized := normalize_field_value(value))
+    }
+    return row, {
+        "amo_lead_contacts": [
+            (lead_id, contact_id) for contact_id in get_embedded_ids(lead, "contacts")
+        ],
+        "amo_lead_fields": list(fields),
+    }
+
+
+def contact_rows(contact: Dict[str, Any]) -> EntityRows:
+    row = (
+        contact["id"],
+        contact.get("name"),
+        contact.get("responsible_user_id"),
+        contact.get("created_at") or 0,
+        contact.get("updated_at") or 0,
+    )
+    keys = contact_match_keys(ContactRecord.from_dict(contact))
+    return row, {
+        "amo_contact_keys": [(contact["id"], kind, value) for kind, value in keys]
+    }
+
+
+def company_rows(company: Dict[str, Any]) -> EntityRows:
+    row = (
+        company["id"],
+        company.get("name"),
+        company.get("responsible_user_id"),
+        company.get("created_at") or 0,
+        company.get("updated_at") or 0,
+    )
+    return row, {}
+
+
+PROJECTIONS = {"leads": lead_rows, "contacts": contact_rows, "companies": company_rows}
+
+
+async def _save_batch(
+    session: AsyncSession,
+    subdomain: str,
+    entity: str,
+    batch: Dict[int, EntityRows],
+) -> None:
+    children: Dict[str, List[Tuple[Any, ...]]] = {}
+    for _, entity_children in batch.values():
+        for child, child_rows in entity_children.items():
+            children.setdefault(child, []).extend(child_rows)
+
+    await save_entities(
+        session, subdomain, entity, [row for row, _ in batch.values()], children
+    )
+    await session.commit()
+
+
+async def sync_entity(
+    session: AsyncSession,
+    client_session: ClientSession,
+    subdomain: str,
+    headers: dict,
+    entity: str,
+    updated_from: Optional[int] = None,
+    batch_size: int = MIRROR_COPY_BATCH_SIZE,
+) -> int:
+    """
+    Загрузка сущностей аккаунта в копию (все или измененные с updated_from).
+
+    Страницы читаются курсором по updated_at (iter_entities_by_updated_at):
+    при обходе по номерам страниц удаление сущности во время загрузки
+    сдвигает выборку, и часть сущностей пропускается до следующей полной
+    синхронизации. Проекции копятся до batch_size и пишутся пачкой через
+    COPY с коммитом, поэтому память и длина транзакции не зависят от
+    размера аккаунта. Возвращает число сущностей.
+    """
+
+    params: Dict[str, Any] = {}
+    if entity == "leads":
+        params["with"] = "contacts"
+
+    count = 0
+    batch: Dict[int, EntityRows] = {}
+    async for row, children in iter_entities_by_updated_at(
+        client_session,
+        subdomain,
+        headers,
+        entity,
+        params,
+        updated_from=updated_from,
+        project=PROJECTIONS[entity],
+    ):
+        # Сущности на границе страниц приходят дважды
+        batch[row[0]] = (row, children)
+        if len(batch) >= batch_size:
+            await _save_batch(session, subdomain, entity, batch)
+            count += len(batch)
+            batch = {}
+
+    if batch:
+        await _save_batch(session, subdomain, entity, batch)
+        count += len(batch)
+    return count
+
+
+async def sync_deletions(
+    session: AsyncSession,
+    client_session: ClientSession,
+    subdomain: str,
+    headers: dict,
+    created_from: int,
+) -> int:
+    """
+    Удаления и восстановления сущностей по событиям amoCRM с created_from.
+
+    Удаленные сущности не приходят в списках, поэтому удаление видно
+    только по событиям. Строки остаются в копии с deleted_at. Возвращает
+    число затронутых сущностей.
+    """
+
+    params = {
+        "filter[type]": ",".join(DELETION_EVENTS),
+        "filter[created_at][from]": created_from,
+    }
+    events = [
+        event
+        async for event in iter_entities(
+            client_session,
+            subdomain,
+            headers,
+            "events",
+            params,
+            limit=EVENTS_PAGE_LIMIT,
+            project=lambda event: (
+                event.get("created_at") or 0,
+                event["type"],
+                event["entity_id"],
+            ),
+        )
+    ]
+
+    # События применяются по порядку: итог - последнее событие сущности
+    deleted_at: Dict[str, Dict[int, Optional[int]]] = {
+        entity: {} for entity in ENTITIES
+    }
+    for created_at, event_type, entity_id in sorted(events):
+        entity, deleted = DELETION_EVENTS[event_type]
+        deleted_at[entity][entity_id] = created_at if deleted else None
+
+    for entity, values in deleted_at.items():
+        await mark_deleted(session, subdomain, entity, values)
+    await session.commit()
+    return sum(len(values) for values in deleted_at.values())
+
+
+async def sync_account(
+    client_session: ClientSession,
+    subdomain: str,
+    headers: dict,
+    full: bool = False,
+) -> Dict[str, int]:
+    """
+    Синхронизация копии аккаунта.
+
+    Первая синхронизация (или full=True) загружает сущности целиком,
+    следующие - только измененные с high-water mark. High-water mark -
+    время начала синхронизации минус MIRROR_SYNC_OVERLAP, поэтому
+    сущности, измененные во время загрузки, и расхождение часов
+    с amoCRM покрываются следующим проходом (upsert идемпотентен).
+    """
+
+    started = int(time.time())
+    high_water_mark = started - MIRROR_SYNC_OVERLAP
+    counts: Dict[str, int] = {}
+
+    async with async_session_maker() as session:
+        state = await get_sync_state(session, subdomain)
+        await session.commit()
+
+        for entity in ENTITIES:
+            updated_from = None if full else state.get(entity)
+            counts[entity] = await sync_entity(
+                session, client_session, subdomain, headers, entity, updated_from
+            )
+            await save_sync_state(
+                session,
+                subdomain,
+                entity,
+                high_water_mark,
+                full=updated_from is None,
+            )
+            await session.commit()
+
+        # До первой синхронизации удаленные сущности в копию не попали
+        if "events" in state:
+            counts["deleted"] = await sync_deletions(
+                session, client_session, subdomain, headers, state["events"]
+            )
+        await save_sync_state(session, subdomain, "events", high_water_mark)
+        await session.commit()
+
+    logger.info(
+        f"Synced amoCRM mirror for {subdomain} in {time.time() - started:.1f}s: "
+        f"{counts}"
+    )
+    return counts
+
+
+class MirrorScheduler:
+    """
+    Периодическая синхронизация копий аккаунтов на APScheduler.
+
+    Как у ScanScheduler: interval-задание на аккаунт со случайным сдвигом
+    первого запуска и джиттером, max_instances=1 и не больше concurrency
+    синхронизаций одновременно.
+    """
+
+    def __init__(
+        self,
+        interval: float = MIRROR_SYNC_INTERVAL,
+        jitter: float = MIRROR_SYNC_JITTER,
+        concurrency: int = MIRROR_SYNC_CONCURRENCY,
+    ):
+        self.interval = interval
+        self.jitter = jitter
+        self._scheduler = AsyncIOScheduler(timezone=timezone.utc)
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._subdomains: Set[str] = set()
+        self._full: Set[str] = set()
+
+    def start(self) -> None:
+        if not self._scheduler.running:
+            self._scheduler.start()
+
+    def shutdown(self) -> None:
+        if self._scheduler.running:
+            self._scheduler.shutdown(wait=False)
+
+    @staticmethod
+    def job_id(subdomain: str) -> str:
+        return f"amo_mirror_sync:{subdomain}"
+
+    def __contains__(self, subdomain: str) -> bool:
+        return subdomain in self._subdomains
+
+    def register(self, subdomain: str, full: bool = False) -> None:
+        """Подписывает аккаунт на синхронизацию; ближайший проход - сразу"""
+
+        if full:
+            self._full.add(subdomain)
+
+        now = datetime.now(timezone.utc)
+        if subdomain in self._subdomains:
+            # Идущая синхронизация не запускается второй раз (max_instances=1)
+            self._scheduler.modify_job(self.job_id(subdomain), next_run_time=now)
+            return
+
+        self._subdomains.add(subdomain)
+        self._scheduler.add_job(
+            self._run,
+            "interval",
+            seconds=self.interval,
+            jitter=self.jitter,
+            args=[subdomain],
+            id=self.job_id(subdomain),
+            replace_existing=True,
+            max_instances=1,
+            coalesce=True,
+            next_run_time=now,
+        )
+        logger.info(f"Scheduled amoCRM mirror sync for {subdomain}")
+
+    def unregister(self, subdomain: str) -> None:
+        if subdomain in self._subdomains:
+            self._subdomains.discard(subdomain)
+            self._full.discard(subdomain)
+            self._scheduler.remove_job(self.job_id(subdomain))
+
+    async def _run(self, subdomain: str) -> None:
+        if subdomain not in self._subdomains:
+            return
+
+        async with self._semaphore:
+            full = subdomain in self._full
+            self._full.discard(subdomain)
+            try:
+                tokens = await get_tokens_from_service(subdomain)
+                headers = build_headers(tokens["access_token"])
+                await sync_account(amo_client, subdomain, headers, full=full)
+            except Exception as e:
+                if full:
+                    self._full.add(subdomain)
+                logger.error(f"amoCRM mirror sync failed for {subdomain}: {e}")
+
+
+mirror_scheduler = MirrorScheduler()
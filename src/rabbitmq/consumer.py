@@ -1,29 +1,217 @@
+import asyncio
 import json
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Set
 
+from fastapi import HTTPException
 from loguru import logger
 
 import aio_pika
-from src.common.database import get_async_session
-from src.rabbitmq.rmq_sender import send_response_message
+from src.common.config import (
+    RMQ_CONCURRENCY,
+    RMQ_DRAIN_TIMEOUT,
+    RMQ_PREFETCH_COUNT,
+    RMQ_RETRY_BASE_DELAY,
+    RMQ_RETRY_MAX_ATTEMPTS,
+    RMQ_RETRY_MULTIPLIER,
+)
+from src.common.database import async_session_maker
+from src.common.deadline import (
+    DEADLINE_HEADER,
+    deadline_from_headers,
+    deadline_scope,
+)
+from src.common.metrics import RMQ_HANDLING_TIME, RMQ_MESSAGES, observe_queue_wait
+from src.rabbitmq.rmq_sender import get_publisher, send_response_message
+
+RETRY_COUNT_HEADER = "x-retry-count"
+LAST_ERROR_HEADER = "x-last-error"
+
+# Ошибки клиента, которые могут пройти при повторе; остальные 4xx - сразу в DLQ
+RETRYABLE_CLIENT_STATUSES = {408, 409, 423, 429}
+
+
+def retry_delays(
+    max_attempts: int = RMQ_RETRY_MAX_ATTEMPTS,
+    base_delay: float = RMQ_RETRY_BASE_DELAY,
+    multiplier: float = RMQ_RETRY_MULTIPLIER,
+) -> List[float]:
+    """Задержки ступеней повтора в секундах: 5, 20, 80, ..."""
+
+    return [base_delay * multiplier**step for step in range(max_attempts)]
+
+
+def retry_queue_name(queue_name: str, step: int) -> str:
+    return f"{queue_name}.retry.{step}"
+
+
+def dead_letter_queue_name(queue_name: str) -> str:
+    return f"{queue_name}.dlq"
+
+
+async def declare_retry_queues(
+    channel: aio_pika.abc.AbstractChannel,
+    queue_name: str,
+    delays: Sequence[float],
+) -> None:
+    """
+    Очереди задержки и DLQ для очереди queue_name.
+
+    У каждой ступени свой x-message-ttl на всю очередь, поэтому сообщения
+    истекают строго по порядку и через default exchange возвращаются
+    в основную очередь. Пока сообщение ждет в очереди задержки, оно не
+    занимает ни обработчик, ни prefetch основной очереди.
+    """
+
+    for step, delay in enumerate(delays):
+        await channel.declare_queue(
+            retry_queue_name(queue_name, step),
+            durable=True,
+            arguments={
+                "x-message-ttl": int(delay * 1000),
+                "x-dead-letter-exchange": "",
+                "x-dead-letter-routing-key": queue_name,
+            },
+        )
+    await channel.declare_queue(dead_letter_queue_name(queue_name), durable=True)
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Может ли повтор позже исправить ошибку"""
+
+    if isinstance(error, (UnicodeDecodeError, json.JSONDecodeError)):
+        return False
+    if isinstance(error, HTTPException):
+        return (
+            error.status_code >= 500 or error.status_code in RETRYABLE_CLIENT_STATUSES
+        )
+    return True
+
+
+def retry_step(
+    attempt: int, error: BaseException, delays: Sequence[float]
+) -> Optional[int]:
+    """
+    Ступень очереди задержки для повтора (None - в DLQ).
+
+    Обычно ступень равна номеру попытки. Если ошибка сообщает, когда
+    повторять (retry_after у CircuitOpenError), берется первая ступень
+    не короче: повтор раньше снова упрется в разомкнутый breaker.
+    """
+
+    if attempt >= len(delays) or not is_retryable(error):
+        return None
+
+    step = attempt
+    retry_after = getattr(error, "retry_after", None) or 0
+    while step < len(delays) - 1 and delays[step] < retry_after:
+        step += 1
+    return step
+
+
+async def schedule_retry(
+    message: aio_pika.IncomingMessage,
+    queue_name: str,
+    error: BaseException,
+    connection_url: str,
+    delays: Sequence[float],
+    deadline: Optional[float] = None,
+) -> str:
+    """
+    Переотправка упавшего сообщения в очередь задержки или в DLQ.
+
+    Копия публикуется с подтверждением брокера, исходное сообщение
+    подтверждается после этого (at-least-once). Повтор, который вернется
+    в очередь уже после дедлайна сообщения, не отправляется: сообщение
+    выбрасывается. Возвращает исход для метрик.
+    """
+
+    headers = dict(message.headers or {})
+    attempt = int(headers.get(RETRY_COUNT_HEADER) or 0)
+    step = retry_step(attempt, error, delays)
+    headers[RETRY_COUNT_HEADER] = attempt + 1
+    headers[LAST_ERROR_HEADER] = repr(error)[:1000]
+    if deadline is not None:
+        # У копии новый timestamp: дедлайн передается абсолютным временем
+        headers[DEADLINE_HEADER] = deadline
+        if step is not None and time.time() + delays[step] >= deadline:
+            logger.warning(
+                f"Message from {queue_name} failed ({error!r}) and is dropped: "
+                f"retry in {delays[step]:.0f}s would miss its deadline"
+            )
+            return "expired"
+
+    if step is None:
+        routing_key = dead_letter_queue_name(queue_name)
+        outcome = "dead_lettered"
+        logger.error(
+            f"Message from {queue_name} moved to {routing_key} "
+            f"after {attempt + 1} attempts: {error!r}"
+        )
+    else:
+        routing_key = retry_queue_name(queue_name, step)
+        outcome = "retried"
+        logger.warning(
+            f"Message from {queue_name} failed ({error!r}), "
+            f"retry {attempt + 1}/{len(delays)} in {delays[step]:.0f}s"
+        )
+
+    await get_publisher(connection_url).publish(
+        message.body,
+        routing_key=routing_key,
+        correlation_id=message.correlation_id,
+        headers=headers,
+        reply_to=message.reply_to,
+        content_type=message.content_type,
+        delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+    )
+    return outcome
 
 
 async def process_message(
-    message: aio_pika.IncomingMessage, process_func, connection_url: str
+    message: aio_pika.IncomingMessage,
+    process_func,
+    connection_url: str,
+    queue_name: Optional[str] = None,
+    delays: Optional[Sequence[float]] = None,
 ):
     """
     :param message: Сообщение из очереди RabbitMQ.
     :param process_func: Функция для обработки данных сообщения.
     :param connection_url: URL подключения к RabbitMQ для отправки ответов.
+    :param queue_name: Очередь, от которой строятся имена очередей повторов.
+    :param delays: Задержки ступеней повтора (по умолчанию retry_delays()).
     """
-    async with message.process():
-        body = message.body.decode("utf-8")
-        data = json.loads(body)
+    queue = queue_name or message.routing_key or ""
+    observe_queue_wait(queue, message.timestamp)
+    started = time.perf_counter()
+    outcome = "failed"
+    deadline = deadline_from_headers(
+        message.headers,
+        sent_at=message.timestamp.timestamp() if message.timestamp else None,
+    )
+
+    # requeue=True: сообщение, прерванное остановкой воркера (или упавшее
+    # вместе с переотправкой на повтор), вернется в очередь
+    async with message.process(requeue=True):
         logger.info("Get message from RMQ")
-        session = get_async_session()
+
+        if deadline is not None and deadline <= time.time():
+            # Ответ уже никому не нужен: подтверждаем без обработки
+            logger.warning(f"Message from {queue} expired before processing")
+            RMQ_MESSAGES.labels(queue, "expired").inc()
+            return
 
         try:
-            # Вызов основной логики обработки
-            result = await process_func(data, session)
+            body = message.body.decode("utf-8")
+            data = json.loads(body)
+
+            # Своя сессия на сообщение: транзакции обработчиков не пересекаются
+            async with async_session_maker() as session:
+                # Вызов основной логики обработки в пределах дедлайна сообщения
+                with deadline_scope(deadline):
+                    result = await process_func(data, session)
+                await session.commit()
 
             # Если присутствует reply_to, отправляем ответ
             if message.reply_to and message.correlation_id:
@@ -34,21 +222,157 @@ async def process_message(
                     message.reply_to,
                     message.correlation_id,
                 )
+            outcome = "processed"
         except Exception as e:
-            logger.info("Error processing message.", e)
+            outcome = await schedule_retry(
+                message,
+                queue,
+                e,
+                connection_url,
+                retry_delays() if delays is None else delays,
+                deadline,
+            )
+        finally:
+            RMQ_HANDLING_TIME.labels(queue).observe(time.perf_counter() - started)
+            RMQ_MESSAGES.labels(queue, outcome).inc()
+
+
+def subdomain_key(message: aio_pika.IncomingMessage) -> Optional[str]:
+    """Ключ упорядочивания: subdomain из тела сообщения"""
+
+    try:
+        return json.loads(message.body).get("subdomain")
+    except (ValueError, AttributeError):
+        return None
+
 
+class HandlerPool:
+    """
+    Пул задач-обработчиков: не больше concurrency одновременно.
 
-async def start_consumer(queue_name: str, connection_url: str, process_func):
+    Задачи с одинаковым ключом выполняются строго по очереди в порядке
+    поступления, задачи с разными ключами - параллельно. Ожидающая своей
+    очереди задача не занимает слот, поэтому один тенант не блокирует остальных.
+    """
+
+    def __init__(self, concurrency: int):
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._tasks: Set[asyncio.Task] = set()
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._waiters: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    def submit(self, handler: Callable, key: Optional[str] = None) -> asyncio.Task:
+        task = asyncio.create_task(self._run(handler, key))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _run(self, handler: Callable, key: Optional[str]) -> None:
+        if key is None:
+            async with self._semaphore:
+                await handler()
+            return
+
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            async with lock:
+                async with self._semaphore:
+                    await handler()
+        finally:
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+                del self._locks[key]
+
+    async def drain(self, timeout: float) -> None:
+        """Ожидание текущих задач, по таймауту оставшиеся отменяются"""
+
+        if not self._tasks:
+            return
+
+        logger.info(f"Draining {len(self._tasks)} in-flight messages")
+        _, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            logger.warning(f"Cancelled {len(pending)} messages after drain timeout")
+            await asyncio.gather(*pending, return_exceptions=True)
+
+
+async def _consume(
+    queue: aio_pika.abc.AbstractQueue,
+    pool: HandlerPool,
+    process_func,
+    connection_url: str,
+    key_func: Optional[Callable[[aio_pika.IncomingMessage], Optional[str]]],
+    delays: Sequence[float],
+) -> None:
+    async with queue.iterator() as queue_iter:
+        async for message in queue_iter:
+            key = key_func(message) if key_func else None
+            pool.submit(
+                lambda message=message: process_message(
+                    message, process_func, connection_url, queue.name, delays
+                ),
+                key,
+            )
+
+
+async def start_consumer(
+    queue_name: str,
+    connection_url: str,
+    process_func,
+    prefetch_count: int = RMQ_PREFETCH_COUNT,
+    concurrency: int = RMQ_CONCURRENCY,
+    key_func: Optional[
+        Callable[[aio_pika.IncomingMessage], Optional[str]]
+    ] = subdomain_key,
+    stop_event: Optional[asyncio.Event] = None,
+    drain_timeout: float = RMQ_DRAIN_TIMEOUT,
+    delays: Optional[Sequence[float]] = None,
+):
     """
     :param queue_name: Название очереди RabbitMQ.
     :param connection_url: URL подключения к RabbitMQ.
     :param process_func: Функция для обработки сообщений.
+    :param prefetch_count: Сколько неподтвержденных сообщений брокер выдает сразу.
+    :param concurrency: Сколько сообщений обрабатывается одновременно.
+    :param key_func: Ключ, внутри которого сохраняется порядок (None - без порядка).
+    :param stop_event: Событие остановки: прием прекращается, текущие дорабатываются.
+    :param drain_timeout: Сколько ждать текущие сообщения при остановке.
+    :param delays: Задержки ступеней повтора упавших сообщений (по умолчанию
+        retry_delays()); после последней ступени сообщение уходит в DLQ.
     """
     connection = await aio_pika.connect_robust(connection_url)
     channel = await connection.channel()
+    await channel.set_qos(prefetch_count=prefetch_count)
 
     queue = await channel.declare_queue(queue_name, durable=True)
+    delays = retry_delays() if delays is None else delays
+    await declare_retry_queues(channel, queue_name, delays)
 
-    async with queue.iterator() as queue_iter:
-        async for message in queue_iter:
-            await process_message(message, process_func, connection_url)
+    pool = HandlerPool(concurrency)
+    consume_task = asyncio.create_task(
+        _consume(queue, pool, process_func, connection_url, key_func, delays)
+    )
+    waiters = {consume_task}
+    if stop_event is not None:
+        waiters.add(asyncio.create_task(stop_event.wait()))
+
+    try:
+        await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in waiters:
+            task.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+
+        await pool.drain(drain_timeout)
+        await connection.close()
+        logger.info(f"Consumer for {queue_name} stopped")
+
+    if consume_task.done() and not consume_task.cancelled():
+        consume_task.result()
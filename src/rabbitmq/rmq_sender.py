@@ -1,26 +1,302 @@
+import asyncio
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Set, Tuple
+
 import aio_pika
+from aio_pika.exceptions import (
+    AMQPConnectionError,
+    ChannelClosed,
+    ChannelInvalidStateError,
+)
 from loguru import logger
 
+from src.common.config import (
+    RMQ_PUBLISHER_CHANNELS,
+    RMQ_PUBLISHER_CLOSE_TIMEOUT,
+    RMQ_PUBLISH_BATCH_INTERVAL,
+    RMQ_PUBLISH_BATCH_SIZE,
+)
 
-async def send_response_message(connection_url: str, message_body: str, reply_to: str, correlation_id: str):
-    """Отправка сообщения в указанную очередь RabbitMQ."""
-    try:
-        # Подключаемся к RabbitMQ
-        connection = await aio_pika.connect_robust(connection_url)
-        async with connection:
-            channel = await connection.channel()
-
-            # Создаем сообщение с указанными свойствами
-            response_message = aio_pika.Message(
-                body=message_body.encode("utf-8"),
-                correlation_id=correlation_id
+CHANNEL_ERRORS = (
+    AMQPConnectionError,
+    ChannelClosed,
+    ChannelInvalidStateError,
+    ConnectionError,
+)
+
+
+class RmqPublisher:
+    """
+    Общий издатель сообщений: одно robust-соединение и пул каналов
+    с подтверждениями публикации (publisher confirms).
+
+    Сообщения копятся в очереди и отправляются пачками: публикации пачки
+    идут параллельно в один канал, подтверждения ожидаются вместе.
+    Пачки разных каналов отправляются одновременно: пока канал ждет
+    подтверждений, следующая пачка уходит в свободный. Упавший канал
+    пересоздается, пачка повторяется один раз.
+
+    close() ждет отправки принятых сообщений не дольше close_timeout,
+    неотправленные к этому моменту публикации завершаются ошибкой.
+    """
+
+    def __init__(
+        self,
+        connection_url: str,
+        channels: int = RMQ_PUBLISHER_CHANNELS,
+        batch_size: int = RMQ_PUBLISH_BATCH_SIZE,
+        batch_interval: float = RMQ_PUBLISH_BATCH_INTERVAL,
+        close_timeout: float = RMQ_PUBLISHER_CLOSE_TIMEOUT,
+    ):
+        self.connection_url = connection_url
+        self.channels_count = channels
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.close_timeout = close_timeout
+
+        self._connection: Optional[aio_pika.abc.AbstractRobustConnection] = None
+        self._channels: List[Optional[aio_pika.abc.AbstractChannel]] = []
+        self._free_channels: "asyncio.Queue[int]" = asyncio.Queue()
+        self._queue: (
+            "asyncio.Queue[Tuple[aio_pika.Message, str, asyncio.Future, float]]"
+        ) = asyncio.Queue()
+        self._flusher: Optional[asyncio.Task] = None
+        self._batches: Set[asyncio.Task] = set()
+        self._futures: Set[asyncio.Future] = set()
+        self._lock = asyncio.Lock()
+
+        self.published = 0
+        self.failed = 0
+        self.batches = 0
+        self.publish_latency_total = 0.0
+        self.publish_latency_max = 0.0
+        self.confirm_lag_last = 0.0
+
+    async def start(self) -> None:
+        async with self._lock:
+            if self._flusher is not None and not self._flusher.done():
+                return
+
+            self._connection = await aio_pika.connect_robust(self.connection_url)
+            self._channels = [None] * self.channels_count
+            self._free_channels = asyncio.Queue()
+            for channel_id in range(self.channels_count):
+                self._free_channels.put_nowait(channel_id)
+            self._flusher = asyncio.create_task(self._flush_loop())
+            logger.info("RMQ publisher started")
+
+    async def close(self) -> None:
+        if self._flusher is not None:
+            # Дожидаемся отправки уже принятых сообщений, пока жив flusher
+            drained = asyncio.create_task(self._drain())
+            await asyncio.wait(
+                [drained, self._flusher],
+                timeout=self.close_timeout,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            drained.cancel()
+            self._flusher.cancel()
+            for task in self._batches:
+                task.cancel()
+            await asyncio.gather(
+                drained, self._flusher, *self._batches, return_exceptions=True
+            )
+            self._flusher = None
+
+        self._fail_outstanding()
+
+        if self._connection is not None and not self._connection.is_closed:
+            await self._connection.close()
+        self._connection = None
+
+    async def publish(
+        self,
+        body: bytes,
+        routing_key: str,
+        correlation_id: Optional[str] = None,
+        headers: Optional[Dict] = None,
+        wait_confirm: bool = True,
+        **message_kwargs,
+    ) -> None:
+        """Публикация в default exchange; при wait_confirm ждем подтверждения брокера"""
+
+        await self.start()
+
+        # timestamp нужен потребителю для метрики ожидания в очереди
+        message_kwargs.setdefault("timestamp", datetime.now(timezone.utc))
+        message = aio_pika.Message(
+            body=body, correlation_id=correlation_id, headers=headers, **message_kwargs
+        )
+        future = asyncio.get_running_loop().create_future()
+        self._futures.add(future)
+        future.add_done_callback(self._futures.discard)
+        await self._queue.put((message, routing_key, future, time.monotonic()))
+
+        if wait_confirm:
+            await future
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "published": self.published,
+            "failed": self.failed,
+            "batches": self.batches,
+            "queued": self._queue.qsize(),
+            "batches_in_flight": len(self._batches),
+            "publish_latency_avg": (
+                self.publish_latency_total / self.published if self.published else 0.0
+            ),
+            "publish_latency_max": self.publish_latency_max,
+            "confirm_lag_last": self.confirm_lag_last,
+        }
+
+    async def _get_channel(self, channel_id: int) -> aio_pika.abc.AbstractChannel:
+        channel = self._channels[channel_id]
+        if channel is None or channel.is_closed:
+            channel = await self._connection.channel(publisher_confirms=True)
+            self._channels[channel_id] = channel
+        return channel
+
+    async def _drain(self) -> None:
+        while self._futures:
+            await asyncio.wait(list(self._futures))
+
+    def _fail_outstanding(self) -> None:
+        """Публикации, не дождавшиеся отправки до close(), завершаются ошибкой"""
+
+        while not self._queue.empty():
+            self._queue.get_nowait()
+        if self._futures:
+            logger.error(
+                f"RMQ publisher closed with {len(self._futures)} unsent messages"
+            )
+        for future in list(self._futures):
+            if not future.done():
+                future.set_exception(ConnectionError("RMQ publisher is closed"))
+        self._futures.clear()
+
+    async def _flush_loop(self) -> None:
+        while True:
+            # Пачка собирается, когда есть свободный канал: пока все каналы
+            # ждут подтверждений, сообщения копятся в очереди
+            channel_id = await self._free_channels.get()
+            try:
+                batch = await self._collect_batch()
+            except BaseException:
+                self._free_channels.put_nowait(channel_id)
+                raise
+
+            task = asyncio.create_task(self._publish_batch(batch, channel_id))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+    async def _collect_batch(self) -> list:
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.batch_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _publish_batch(self, batch: list, channel_id: int) -> None:
+        try:
+            await self._publish_on_channel(batch, channel_id)
+        finally:
+            self._free_channels.put_nowait(channel_id)
+
+    async def _publish_on_channel(self, batch: list, channel_id: int) -> None:
+        self.batches += 1
+
+        results: list = [None] * len(batch)
+        todo = list(range(len(batch)))
+        for _ in range(2):
+            try:
+                channel = await self._get_channel(channel_id)
+            except CHANNEL_ERRORS as e:
+                logger.warning(f"RMQ publisher failed to open channel: {e!r}")
+                for i in todo:
+                    results[i] = e
+                continue
+
+            sent_at = time.monotonic()
+            outcome = await asyncio.gather(
+                *(
+                    channel.default_exchange.publish(
+                        batch[i][0], routing_key=batch[i][1]
+                    )
+                    for i in todo
+                ),
+                return_exceptions=True,
             )
+            self.confirm_lag_last = time.monotonic() - sent_at
+
+            retry = []
+            for i, result in zip(todo, outcome):
+                results[i] = result
+                if isinstance(result, CHANNEL_ERRORS):
+                    retry.append(i)
+            if not retry:
+                break
 
-            # Публикуем сообщение в очередь, указанную в reply_to
-            await channel.default_exchange.publish(
-                response_message,
-                routing_key=reply_to
+            # Канал закрылся посреди пачки: открываем новый и повторяем остаток
+            logger.warning(
+                f"RMQ publisher channel failed, retrying {len(retry)} messages"
             )
-            logger.info(f"Sent response to {reply_to} with Correlation ID: {correlation_id}")
+            self._channels[channel_id] = None
+            todo = retry
+
+        confirmed_at = time.monotonic()
+        for (_, routing_key, future, queued_at), result in zip(batch, results):
+            if isinstance(result, BaseException):
+                self.failed += 1
+                logger.error(f"Failed to publish message to {routing_key}: {result!r}")
+                if not future.done():
+                    future.set_exception(result)
+                continue
+
+            latency = confirmed_at - queued_at
+            self.published += 1
+            self.publish_latency_total += latency
+            self.publish_latency_max = max(self.publish_latency_max, latency)
+            if not future.done():
+                future.set_result(None)
+
+
+_publishers: Dict[str, RmqPublisher] = {}
+
+
+def get_publisher(connection_url: str) -> RmqPublisher:
+    """Общий издатель на URL подключения"""
+
+    publisher = _publishers.get(connection_url)
+    if publisher is None:
+        publisher = _publishers[connection_url] = RmqPublisher(connection_url)
+    return publisher
+
+
+async def close_publishers() -> None:
+    for publisher in _publishers.values():
+        await publisher.close()
+    _publishers.clear()
+
+
+async def send_response_message(
+    connection_url: str, message_body: str, reply_to: str, correlation_id: str
+):
+    """Отправка сообщения в указанную очередь RabbitMQ."""
+    try:
+        await get_publisher(connection_url).publish(
+            message_body.encode("utf-8"),
+            routing_key=reply_to,
+            correlation_id=correlation_id,
+        )
+        logger.info(
+            f"Sent response to {reply_to} with Correlation ID: {correlation_id}"
+        )
     except Exception as e:
         logger.error(f"Failed to send message: {e}")
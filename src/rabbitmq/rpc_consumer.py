@@ -1,63 +1,147 @@
 import aio_pika
 import asyncio
 import json
+import time
 import uuid
+from typing import Dict, Optional
+
 from loguru import logger
 
 from fastapi import HTTPException
 
-from src.common.config import RMQ_USER, RMQ_HOST, RMQ_PORT, RMQ_VHOST, RMQ_PASSWORD
+from src.common.config import (
+    RMQ_USER,
+    RMQ_HOST,
+    RMQ_PORT,
+    RMQ_VHOST,
+    RMQ_PASSWORD,
+    RPC_TIMEOUT,
+)
+from src.common.deadline import (
+    DeadlineExceeded,
+    deadline_headers,
+    expired,
+    timeout_for,
+)
+from src.common.metrics import RPC_DURATION
 
 CONNECTION_URL = f"amqp://{RMQ_USER}:{RMQ_PASSWORD}@{RMQ_HOST}:{RMQ_PORT}/{RMQ_VHOST}"
 
 
-async def send_rpc_request_and_wait_for_reply(subdomain: str, client_id: str):
+class RpcClient:
     """
-    Отправка RPC запроса в очередь и ожидание ответа.
+    Долгоживущий RPC-клиент поверх RabbitMQ.
+
+    Одно соединение, один канал и одна общая очередь ответов на процесс.
+    Ответы сопоставляются с ожидающими вызовами по correlation_id,
+    каждый вызов ограничен таймаутом.
     """
-    correlation_id = str(uuid.uuid4())  # Уникальный идентификатор запроса
-    logger.info("СГЕНЕРИРОВАЛИ correlation_id", correlation_id)
-    reply_queue_name = f"reply_queue_{correlation_id}"  # Уникальная очередь для ответа
-    logger.info(f"Определили reply_queue_name {reply_queue_name}")
 
-    connection = await aio_pika.connect_robust(CONNECTION_URL)
-    async with connection:
-        channel = await connection.channel()
+    def __init__(
+        self, connection_url: str = CONNECTION_URL, timeout: float = RPC_TIMEOUT
+    ):
+        self.connection_url = connection_url
+        self.timeout = timeout
+
+        self._connection: Optional[aio_pika.abc.AbstractRobustConnection] = None
+        self._channel: Optional[aio_pika.abc.AbstractChannel] = None
+        self._reply_queue: Optional[aio_pika.abc.AbstractQueue] = None
+        self._futures: Dict[str, asyncio.Future] = {}
+        self._lock = asyncio.Lock()
+
+    async def connect(self) -> None:
+        async with self._lock:
+            if self._connection is not None and not self._connection.is_closed:
+                return
+
+            self._connection = await aio_pika.connect_robust(self.connection_url)
+            self._channel = await self._connection.channel()
+            self._reply_queue = await self._channel.declare_queue(
+                f"rpc_reply_{uuid.uuid4()}", exclusive=True, auto_delete=True
+            )
+            await self._reply_queue.consume(self._on_reply, no_ack=True)
+            logger.info(f"RPC client listens for replies in {self._reply_queue.name}")
+
+    async def close(self) -> None:
+        for future in self._futures.values():
+            if not future.done():
+                future.cancel()
+        self._futures.clear()
+
+        if self._connection is not None and not self._connection.is_closed:
+            await self._connection.close()
+        self._connection = None
 
-        # Объявляем временную очередь для ответа
-        reply_queue = await channel.declare_queue(reply_queue_name, exclusive=True)
+    async def call(
+        self, routing_key: str, payload: dict, timeout: Optional[float] = None
+    ) -> dict:
+        """
+        Отправка запроса и ожидание ответа не дольше timeout секунд
+        (и не дольше остатка до дедлайна текущей работы)
+        """
 
-        # Формируем тело сообщения
-        message_body = json.dumps({
-            "client_id": client_id,
-            "subdomain": subdomain
-        })
+        timeout = timeout_for(self.timeout if timeout is None else timeout)
+        await self.connect()
+
+        correlation_id = str(uuid.uuid4())
+        future = asyncio.get_running_loop().create_future()
+        self._futures[correlation_id] = future
 
         message = aio_pika.Message(
-            body=message_body.encode(),
+            body=json.dumps(payload).encode(),
             correlation_id=correlation_id,
-            reply_to=reply_queue_name
+            reply_to=self._reply_queue.name,
+            headers=deadline_headers(),
+            # Запрос, на который уже никто не ждет ответа, брокер выбросит сам
+            expiration=timeout,
         )
 
-        # Отправляем запрос в очередь
-        await channel.default_exchange.publish(
-            message, routing_key="tokens_get_user"
-        )
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            await self._channel.default_exchange.publish(
+                message, routing_key=routing_key
+            )
+            reply = await asyncio.wait_for(future, timeout)
+            outcome = "ok"
+            return reply
+        except asyncio.TimeoutError:
+            outcome = "timeout"
+            if expired():
+                raise DeadlineExceeded(f"Deadline exceeded waiting for {routing_key}")
+            logger.error(f"No RPC reply from {routing_key} within {timeout}s")
+            raise HTTPException(
+                status_code=504, detail="No response received from token service"
+            )
+        finally:
+            self._futures.pop(correlation_id, None)
+            RPC_DURATION.labels(routing_key, outcome).observe(
+                time.perf_counter() - started
+            )
+
+    async def _on_reply(self, message: aio_pika.abc.AbstractIncomingMessage) -> None:
+        future = self._futures.get(message.correlation_id)
+        if future is None or future.done():
+            logger.warning(f"Unexpected RPC reply: {message.correlation_id}")
+            return
+
+        try:
+            future.set_result(json.loads(message.body.decode()))
+        except ValueError as e:
+            future.set_exception(e)
 
-        # Ожидаем ответа в reply_queue
-        async with reply_queue.iterator() as reply_queue_iter:
-            async for incoming_message in reply_queue_iter:
-                async with incoming_message.process():
-                    logger.info(f"Сообщение с токенами упало в: {reply_queue_name}")
-                    if incoming_message.correlation_id == correlation_id:
-                        # Декодируем и возвращаем ответ с токенами
-                        response = json.loads(incoming_message.body.decode())
-                        return {
-                            "access_token": response.get("access_token"),
-                            "refresh_token": response.get("refresh_token"),
-                        }
 
-    # Если не получили ответ
-    raise HTTPException(status_code=504, detail="No response received from token service")
+rpc_client = RpcClient()
 
 
+async def send_rpc_request_and_wait_for_reply(subdomain: str, client_id: str):
+    """
+    Отправка RPC запроса в очередь и ожидание ответа.
+    """
+    response = await rpc_client.call(
+        "tokens_get_user", {"client_id": client_id, "subdomain": subdomain}
+    )
+    return {
+        "access_token": response.get("access_token"),
+        "refresh_token": response.get("refresh_token"),
+    }
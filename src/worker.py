@@ -0,0 +1,130 @@
+"""
+Воркер очереди RabbitMQ без HTTP-приложения.
+
+    python -m src.worker                # по процессу на ядро (WORKER_PROCESSES)
+    python -m src.worker --workers 4 --queue duplicate_leads
+
+Модуль импортирует только конфиг и супервизор: клиенты amoCRM и RabbitMQ,
+SQLAlchemy и обработчики загружаются уже в процессе-воркере, поэтому
+супервизор стартует и форкается быстро, а воркер не тянет FastAPI-приложение
+и роутеры. Перед приемом сообщений воркер прогревает пулы HTTP, AMQP и БД,
+чтобы первые сообщения не платили за установку соединений.
+"""
+
+import argparse
+import asyncio
+import signal
+from functools import partial
+
+from loguru import logger
+
+from src.common.config import (
+    RMQ_CONCURRENCY,
+    RMQ_QUEUE,
+    WORKER_METRICS_PORT,
+    WORKER_PROCESSES,
+)
+from src.common.supervisor import Supervisor, default_workers
+
+
+async def prewarm(concurrency: int = RMQ_CONCURRENCY) -> None:
+    """Соединения до приема сообщений: по одному на слот обработчика"""
+
+    from sqlalchemy import text
+
+    from src.amocrm.cache import amo_cache
+    from src.amocrm.client import amo_client
+    from src.common.database import engine
+    from src.rabbitmq.rmq_sender import get_publisher
+    from src.rabbitmq.rpc_consumer import CONNECTION_URL, rpc_client
+
+    async def db_connection() -> None:
+        async with engine.connect() as connection:
+            await connection.execute(text("SELECT 1"))
+
+    # Соединения открываются одновременно и остаются в пуле engine
+    db_connections = min(concurrency, engine.pool.size())
+    await asyncio.gather(
+        amo_client.start(),
+        amo_cache.start(),
+        rpc_client.connect(),
+        get_publisher(CONNECTION_URL).start(),
+        *(db_connection() for _ in range(db_connections)),
+    )
+    logger.info(f"Worker pools are warm ({db_connections} DB connections)")
+
+
+async def shutdown() -> None:
+    from src.amocrm.cache import amo_cache
+    from src.amocrm.client import amo_client
+    from src.common.database import engine
+    from src.dublicate_widget.parallel import shutdown_executor
+    from src.rabbitmq.rmq_sender import close_publishers
+    from src.rabbitmq.rpc_consumer import rpc_client
+
+    shutdown_executor()
+    await amo_client.close()
+    await amo_cache.close()
+    await rpc_client.close()
+    await close_publishers()
+    await engine.dispose()
+
+
+async def serve(queue_name: str) -> None:
+    """Прогрев пулов и прием сообщений до SIGTERM/SIGINT"""
+
+    from src.dublicate_widget.handlers import handle_message
+    from src.rabbitmq.consumer import start_consumer
+    from src.rabbitmq.rpc_consumer import CONNECTION_URL
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    try:
+        await prewarm()
+        if not stop_event.is_set():
+            logger.info(f"Worker consumes {queue_name}")
+            await start_consumer(
+                queue_name, CONNECTION_URL, handle_message, stop_event=stop_event
+            )
+    finally:
+        await shutdown()
+
+
+def run_worker(index: int, queue_name: str = RMQ_QUEUE) -> None:
+    """Точка входа процесса-воркера: свои логи, метрики и event loop"""
+
+    from src.common.log_config import setup_logging
+
+    setup_logging()
+    if WORKER_METRICS_PORT:
+        from prometheus_client import start_http_server
+
+        start_http_server(WORKER_METRICS_PORT + index)
+
+    logger.info(f"Worker {index} starting")
+    asyncio.run(serve(queue_name))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="RabbitMQ duplicate leads worker")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=WORKER_PROCESSES,
+        help="число процессов (0 - по одному на ядро)",
+    )
+    parser.add_argument("--queue", default=RMQ_QUEUE, help="очередь RabbitMQ")
+    args = parser.parse_args()
+
+    if not args.queue:
+        parser.error("queue is not set (--queue or RMQ_QUEUE)")
+
+    target = partial(run_worker, queue_name=args.queue)
+    Supervisor(target, default_workers(args.workers)).run()
+
+
+if __name__ == "__main__":
+    main()